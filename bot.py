@@ -15,7 +15,8 @@ Usage:
 Key Commands:
     - `start`: Starts the Minecraft server.
     - `stop`: Stops the Minecraft server.
-    - `snapshots`: Manage world snapshots (list, create, delete, restore, download).
+    - `snapshots`: Manage world snapshots (list, create, delete, restore, player-restore,
+      download, diff, verify, schedule, prune).
     - `verify`: Links a Discord account to a Minecraft account.
     - `ping`: Measures the bot's latency.
 
@@ -44,7 +45,6 @@ import subprocess
 # Third-party imports
 import aiohttp
 import discord
-import mcrcon
 from discord.ext import commands
 
 # First-party imports
@@ -69,9 +69,6 @@ TOKEN = config.get('PythonConfig', 'TOKEN')
 REQUIRED_ROLE = config.get('PythonConfig', 'required_role')
 BOT_OWNER_ID = int(config.get('PythonConfig', 'bot_owner_id'))
 PORT = config.get("PythonConfig", "port")
-RCON_HOST = config.get('PythonConfig', 'rcon_host')
-RCON_PORT = int(config.get('PythonConfig', 'rcon_port'))
-RCON_PASSWORD = config.get('PythonConfig', 'rcon_password')
 
 intents = discord.Intents.default()
 intents.message_content = True
@@ -129,16 +126,22 @@ async def stop_command(ctx):
         await ctx.send(embed=embed)
         return
 
+    # Scheduled snapshots before stopping, the world only has to be frozen before the server goes down
+    skipped = await bot_modules.run_stop_schedules(ctx, bot)
+
     try:
-        with mcrcon.MCRcon(RCON_HOST, RCON_PASSWORD, port=RCON_PORT) as rcon:
-            rcon.command('stop')
-            embed = discord.Embed(
-                title=":hourglass: Server Stopping...",
-                description='Sent the `stop` command to the Minecraft server.',
-                color=discord.Color.blue())
-            stop = await ctx.send(embed=embed)
+        await bot_modules.send_command('stop')
+        embed = discord.Embed(
+            title=":hourglass: Server Stopping...",
+            description='Sent the `stop` command to the Minecraft server.',
+            color=discord.Color.blue())
+        if skipped:
+            names = ', '.join(f'"{name}"' for name in skipped)
+            embed.description += f'\n\n:warning: Skipped the scheduled snapshots of {names}, snapshots cannot be ' \
+                                 'created while the server is running (`hot_snapshots` is disabled in config.cfg).'
+        stop = await ctx.send(embed=embed)
 
-    except mcrcon.MCRconException:
+    except (bot_modules.RconError, TimeoutError):
         embed = discord.Embed(
             title=':x: Server Error!',
             description='Failed to send the `stop` command to the Minecraft server.',
@@ -146,6 +149,11 @@ async def stop_command(ctx):
         await ctx.send(embed=embed)
         return
 
+    server = bot_modules.running_server()
+    if server is not None:
+        # Started by the bot, so it knows the moment the server process exits
+        await server.wait_until_stopped()
+
     # Checking if server actually went offline
     for attempt in range(5):
         logging.debug("Checking server state... Attempt %d/5", attempt + 1)
@@ -273,18 +281,18 @@ async def console_command(ctx, *, command):
         await ctx.send(embed=embed)
         return
 
+    # `console batch` sends every line of the script after it (or attached to the message) over one connection
+    if command.split(maxsplit=1)[0] == 'batch':
+        await bot_modules.console_batch(ctx, command[len('batch'):])
+        return
+
     try:
-        # Set up an RCON connection with a timeout
-        with mcrcon.MCRcon(RCON_HOST, RCON_PASSWORD, port=RCON_PORT, timeout=5) as rcon:
-            response = rcon.command(command)
-            embed = discord.Embed(
-                title='Minecraft Console',
-                description=f'Command: {command}',
-                color=discord.Color.green())
-            embed.add_field(name='Output', value=response)
-            await ctx.send(embed=embed)
+        # Sent over the shared RCON connection pool, with a timeout
+        response = await bot_modules.send_command(command)
+        # Long output is sent in several embeds, or as a file
+        await bot_modules.send_output(ctx, f'Command: {command}', response)
 
-    except mcrcon.MCRconException as e:
+    except bot_modules.RconError as e:
         # Handle RCON-specific errors
         embed = discord.Embed(
             title='Minecraft Console',
@@ -297,7 +305,7 @@ async def console_command(ctx, *, command):
         # Handle timeout errors
         embed = discord.Embed(
             title='❌ Timed Out',
-            description=':x: Failed to connect to the server within the timeout period.',
+            description=':x: The server did not answer within the timeout period.',
             color=discord.Color.red()
         )
         await ctx.send(embed=embed)
@@ -373,7 +381,15 @@ async def snapshots_command(ctx, action=None, *args):
     discord_id = ctx.author.id
 
     if action == 'list' or action is None:  # When 'list' or no arguments are given, simply list the snapshots
-        await bot_modules.list_snapshots(ctx)
+        await bot_modules.list_snapshots(ctx, *args)
+        return
+
+    if action == 'compression':
+        await bot_modules.compression_stats(ctx)
+        return
+
+    if action == 'diff':
+        await bot_modules.diff_snapshots(ctx, *args)
         return
 
     if action == 'create':
@@ -393,7 +409,11 @@ async def snapshots_command(ctx, action=None, *args):
         return
 
     # Check if user is owner before executing descructive commands
-    if action in ['delete', 'restore'] and discord_id != BOT_OWNER_ID:
+    destructive = action in ['delete', 'restore', 'player-restore', 'verify'] or \
+        (action == 'schedule' and args and args[0] in ['add', 'remove']) or \
+        (action == 'replication' and args and args[0] == 'now') or \
+        (action == 'prune' and '--dry-run' not in args)
+    if destructive and discord_id != BOT_OWNER_ID:
         embed = discord.Embed(
             title=':x: Missing Permissions',
             description='You do not have permission to use this command.',
@@ -402,8 +422,20 @@ async def snapshots_command(ctx, action=None, *args):
         await ctx.send(embed=embed)
         return
 
-    # Ensure snapshot name is provided for 'delete', 'restore', and 'download'
-    if action in ['delete', 'restore', 'download']:
+    if action == 'schedule':
+        await bot_modules.manage_schedules(ctx, *args)
+        return
+
+    if action == 'prune':
+        await bot_modules.prune_snapshots(ctx, bot, *args)
+        return
+
+    if action == 'replication':
+        await bot_modules.manage_replication(ctx, *args)
+        return
+
+    # Ensure snapshot name is provided for 'delete', 'restore', 'player-restore', and 'download'
+    if action in ['delete', 'restore', 'player-restore', 'download']:
         if not args:  # If no snapshot name is provided
             embed = discord.Embed(
                 title=':x: Missing Arguments',
@@ -417,7 +449,11 @@ async def snapshots_command(ctx, action=None, *args):
     if action == 'delete':
         await bot_modules.delete_snapshot(ctx, bot, ' '.join(args))
     elif action == 'restore':
-        await bot_modules.restore_snapshot(ctx, bot, ' '.join(args))
+        await bot_modules.restore_snapshot(ctx, bot, *args)
+    elif action == 'player-restore':
+        await bot_modules.restore_player(ctx, bot, *args)
+    elif action == 'verify':
+        await bot_modules.verify_snapshots(ctx, bot, *args)
     elif action == 'download':
         await bot_modules.download_snapshot(ctx, ' '.join(args))
     else:
@@ -450,8 +486,17 @@ async def ping_command(ctx):
 @bot.event
 async def on_ready():
     logging.info("Bot is ready. Logged in as %s", bot.user.name)
+    if not bot_modules.reconcile_catalog.is_running():  # on_ready fires again after reconnecting
+        bot_modules.reconcile_catalog.start()
+    bot_modules.start_verify_job(bot)
+    bot_modules.start_retention_job()
+    await bot_modules.start_download_server()
+    bot_modules.start_replication_job()
+    if not bot_modules.run_schedules.is_running():
+        bot_modules.run_schedules.start(bot)
     await bot.change_presence(activity=discord.Activity(type=discord.ActivityType.watching,
                                                         name="over a Minecraft Server"))
 
 if __name__ == "__main__":
+    bot_modules.setup_snapshots()
     bot.run(TOKEN)
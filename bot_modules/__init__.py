@@ -15,25 +15,56 @@ Usage:
 Modules Included:
     - info: Functions for handling info commands related to the bot.
     - snapshots: Functions for managing Minecraft world snapshots.
+    - catalog: Functions for listing and comparing snapshots and keeping their records up to date.
+    - restore: Functions for restoring the server (or a part of it, or a single player) from snapshots.
+    - integrity: Functions for checking that snapshots can still be restored.
+    - scheduler: Functions for creating snapshots automatically on a schedule.
+    - retention: Functions for pruning the snapshots the retention rules do not keep.
+    - downloads: Functions for downloading snapshots through signed links.
+    - replication: Functions for copying snapshots to a second place.
+    - rcon: Functions for sending commands to the Minecraft server over RCON.
+    - console: Functions for running scripts of Minecraft commands and sending their output.
+    - supervisor: Functions for running the Minecraft server as a child process of the bot.
     - utils: Miscellaneous utility functions used across the bot.
     - verify: Functions for verifying user accounts with the Minecraft server.
 
 Notes:
     - This file does not contain any executable code itself; it only
       facilitates module imports and suppresses linter warnings for unused imports.
+    - mockserver (a stand-in Minecraft server for tests), benchmark (measures RCON and status
+      latency against it) and slp (the Server List Ping client they use) are not imported here,
+      as the bot itself does not use them.
 """
 
 
 # Importing modules
 from .info import info, info_snapshots
-from .snapshots import create_snapshot, delete_snapshot, download_snapshot, list_snapshots, restore_snapshot
+from .snapshots import create_snapshot, delete_snapshot, setup_snapshots
+from .catalog import compression_stats, diff_snapshots, list_snapshots, reconcile_catalog
+from .restore import restore_player, restore_snapshot
+from .integrity import start_verify_job, verify_snapshots
+from .scheduler import manage_schedules, run_schedules, run_stop_schedules
+from .retention import prune_snapshots, start_retention_job
+from .downloads import download_snapshot, start_download_server
+from .replication import manage_replication, start_replication_job
+from .rcon import RconError, send_command
+from .console import console_batch, send_output
+from .supervisor import running_server
 from .utils import check_server_running, check_server_latency, get_public_ip, ping, has_required_role, has_operator
 from .verify import verify
 from .start import start_server
 
 # Suppress unused import warnings
 __all__ = ['info', 'info_snapshots',
-           'create_snapshot', 'delete_snapshot', 'download_snapshot', 'list_snapshots', 'restore_snapshot',
+           'compression_stats', 'create_snapshot', 'delete_snapshot', 'download_snapshot', 'list_snapshots',
+           'setup_snapshots',
+           'diff_snapshots', 'reconcile_catalog',
+           'restore_player', 'restore_snapshot',
+           'start_verify_job', 'verify_snapshots',
+           'manage_schedules', 'run_schedules', 'run_stop_schedules',
+           'prune_snapshots', 'start_retention_job',
+           'start_download_server', 'manage_replication', 'start_replication_job',
+           'RconError', 'send_command', 'console_batch', 'send_output', 'running_server',
            'check_server_running', 'check_server_latency', 'get_public_ip', 'ping', 'has_required_role', 'has_operator',
            'verify',
            'start_server']
@@ -0,0 +1,522 @@
+"""
+archive.py
+
+Version: 1.3.0
+
+This module houses the file level logic behind zip snapshots: scanning the world
+folders, streaming them into an archive while recording a manifest, and extracting
+a manifest again from one or more archives (incremental snapshots). Region files
+of incremental snapshots are stored as chunk level deltas (see regions.py).
+
+Functions:
+    - scan_tree(source_folders, base_path): Lists all files and folders in the given world folders.
+    - split_changes(entries, parent_entries): Finds the files that changed since a parent manifest.
+    - write_archive(snapshot_path, entries, archives, parent_id, progress): Streams files into a zip archive,
+      compressing them in parallel and hashing them on the way.
+    - extract_manifest(entries, archives, destination, workers, progress): Extracts the files of a manifest from
+      their archives in parallel.
+    - check_extracted(entries, destination): Checks that all files of a manifest were extracted.
+    - verify_archive(archive_path, entries, throttle, workers): Reads back the files stored in an archive
+      and checks them against their manifest.
+    - export_manifest(entries, archives, zip_path, progress): Bundles the files of a manifest into a single zip archive.
+
+Notes:
+    - Manifest entries are dicts with the keys `path`, `size`, `mtime` (nanoseconds) and `hash`
+      (SHA-256, None for folders). Paths are relative to the server folder, use `/` and folders end
+      with a `/`, exactly like the member names inside the zip archives.
+    - Entries of incremental snapshots carry a `source_id`, the id of the snapshot whose
+      archive holds the actual data.
+    - Region files stored as a delta are kept in the archive as `<path>.delta` and their entry
+      has a `delta_base`, the id of the snapshot whose version of the file the delta applies to,
+      a `delta_depth`, how many deltas have to be applied to rebuild it, and a `packed_hash`, the
+      hash of the rebuilt file (see `regions.packed_hash`).
+      Before extracting, `base` must be set to the manifest entry of that version (recursively).
+    - `progress`, where accepted, is called with the number of bytes done after every block
+      or file (see progress.py).
+    - All functions in this module block on disk I/O and are meant to be run
+      in a worker thread (`asyncio.to_thread`).
+"""
+
+
+# Standard library imports
+import collections
+import concurrent.futures
+import contextlib
+import hashlib
+import os
+import threading
+import zipfile
+import zlib
+from pathlib import Path
+
+# First-party imports
+from bot_modules import compression, regions
+
+
+script_path = Path(__file__).resolve().parent
+root_path = script_path.parent
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# Region deltas larger than this share of the whole file are not worth the longer restore chain
+MAX_DELTA_RATIO = 0.5
+# After this many deltas in a row a region file is stored whole again, so a restore never applies more
+MAX_DELTA_DEPTH = 8
+
+
+def _scan_folder(folder, arc_path, entries):
+    entries.append({'path': f"{arc_path}/", 'size': 0, 'mtime': 0, 'hash': None, 'full_path': Path(folder)})
+
+    with os.scandir(folder) as scanner:
+        items = sorted(scanner, key=lambda item: item.name)
+
+    subfolders = []
+    for item in items:
+        if item.is_dir():
+            subfolders.append(item)
+            continue
+
+        stat = item.stat()  # Served from the directory listing itself on Windows
+        entries.append({'path': f"{arc_path}/{item.name}", 'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                        'hash': None, 'full_path': Path(item.path)})
+
+    for subfolder in subfolders:
+        _scan_folder(subfolder.path, f"{arc_path}/{subfolder.name}", entries)
+
+
+def scan_tree(source_folders, base_path=None):
+    """
+    Lists every folder and file in the given world folders as manifest entries (without hashes).
+
+    Paths are relative to `base_path`, the server folder by default.
+    """
+    base_path = Path(base_path or root_path.parent)
+    entries = []
+
+    for source_folder in source_folders:
+        _scan_folder(source_folder, Path(source_folder).relative_to(base_path).as_posix(), entries)
+
+    return entries
+
+
+def split_changes(entries, parent_entries):
+    """
+    Compares scanned entries to the manifest of a parent snapshot.
+
+    Files whose size and modification time are unchanged take over the hash (and any other
+    stored details, such as `source_id` or `chunks`) of the parent entry. Changed files keep
+    a reference to their parent entry as `base_version`. Returns the list of files that are
+    new or changed and still need to be stored.
+    """
+    parent = {entry['path']: entry for entry in parent_entries}
+    changed = []
+
+    for entry in entries:
+        if entry['path'].endswith('/'):
+            continue
+
+        previous = parent.get(entry['path'])
+        if previous and previous['size'] == entry['size'] and previous['mtime'] == entry['mtime']:
+            for key, value in previous.items():
+                entry.setdefault(key, value)
+            entry['hash'] = previous['hash']
+        else:
+            if previous:
+                entry['base_version'] = previous
+            changed.append(entry)
+
+    return changed
+
+
+def _member_name(version):
+    return f"{version['path']}.delta" if version.get('delta_base') is not None else version['path']
+
+
+def _read_header(archive, version):
+    """Reads only the region header of a stored file version, without decompressing the rest."""
+    with compression.open_member(archive, _member_name(version)) as member:
+        if version.get('delta_base') is not None:
+            return regions.delta_header(member.read(len(regions.DELTA_MAGIC) + regions.HEADER_SIZE))
+        return member.read(regions.HEADER_SIZE)
+
+
+def _read_member(open_archive, version):
+    with compression.open_member(open_archive(version['source_id']), _member_name(version)) as member:
+        return member.read()
+
+
+def _read_version(open_archive, version):
+    """Returns the full contents of a stored file version, applying region deltas on top of their bases."""
+    deltas = []
+    while version.get('delta_base') is not None:
+        deltas.append(version)
+        version = version['base']
+
+    # Starting from the full copy the chain ends in
+    data = _read_member(open_archive, version)
+    for delta in reversed(deltas):
+        data = regions.apply_delta(data, _read_member(open_archive, delta))
+    return data
+
+
+def _hash_file(file_path):
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        while data := file.read(COPY_BUFFER_SIZE):
+            file_hash.update(data)
+    return file_hash.hexdigest()
+
+
+def _make_region_delta(entry, open_archive, parent_id):
+    """
+    Creates a delta of a changed region file against its parent version.
+
+    Returns None when the file should be stored as a whole instead, including when the parent
+    version is already at the end of MAX_DELTA_DEPTH deltas and when the delta does not rebuild
+    the file exactly. `base_version` must be linked to its own bases (see `_read_version`).
+    """
+    base_version = entry['base_version']
+    depth = 0
+    if base_version.get('delta_base') is not None:
+        # Deltas from before depths were recorded have an unknown chain, so start a new one
+        depth = base_version.get('delta_depth') or MAX_DELTA_DEPTH
+    if depth >= MAX_DELTA_DEPTH:
+        return None
+
+    base_header = _read_header(open_archive(base_version['source_id']), base_version)
+    delta = regions.make_delta(entry['full_path'], base_header)
+
+    if delta is None or len(delta) > entry['size'] * MAX_DELTA_RATIO:
+        return None
+
+    # A chunk saved again within the same second as its base keeps its timestamp and is left
+    # out of the delta, so only keep a delta that rebuilds the file as it is now
+    packed_hash = regions.packed_hash(entry['full_path'])
+    try:
+        rebuilt = regions.apply_delta(_read_version(open_archive, base_version), delta)
+    except ValueError:
+        return None
+    if hashlib.sha256(rebuilt).hexdigest() != packed_hash:
+        return None
+
+    entry['hash'] = _hash_file(entry['full_path'])
+    entry['packed_hash'] = packed_hash
+    entry['delta_base'] = parent_id
+    entry['delta_depth'] = depth + 1
+    return delta
+
+
+def _completed(result):
+    future = concurrent.futures.Future()
+    future.set_result(result)
+    return future
+
+
+def _file_operations(entry, compress):
+    """
+    Reads a file block by block, hashing it on the way, and hands every block to `compress`.
+
+    Yields a write operation per block, with the CRC-32 of the file up to that block. The hash
+    and final size are recorded in the entry once the last block has been read.
+    """
+    file_hash = hashlib.sha256()
+    crc = 0
+    mtime = entry['mtime'] / 1e9
+    size = 0
+    rule, codec = compression.choose_codec(entry['path'])
+
+    with open(entry['full_path'], 'rb') as source:
+        data = source.read(compression.BLOCK_SIZE)
+        first = True
+
+        while True:
+            following = source.read(compression.BLOCK_SIZE) if len(data) == compression.BLOCK_SIZE else b''
+            final = not following
+            file_hash.update(data)
+            crc = zlib.crc32(data, crc)
+            size += len(data)
+            yield ('block', entry['path'], entry['size'], mtime, codec, rule, first, final, len(data), crc,
+                   compress(data, codec, final))
+
+            if final:
+                break
+            data = following
+            first = False
+
+    entry['hash'] = file_hash.hexdigest()
+    entry['size'] = size
+
+
+def _archive_operations(entries, compress, archives, parent_id, open_archive):
+    for entry in entries:
+        if entry['path'].endswith('/'):
+            # Keep (empty) directories in the archive
+            yield ('folder', entry['path'], entry['full_path'].stat().st_mtime)
+            continue
+
+        if archives and entry['path'].endswith('.mca') and 'base_version' in entry:
+            delta = _make_region_delta(entry, open_archive, parent_id)
+            if delta is not None:
+                yield ('bytes', f"{entry['path']}.delta", delta, entry['mtime'] / 1e9, entry['size'])
+                continue
+
+        yield from _file_operations(entry, compress)
+
+
+def _run_operation(writer, operation, progress):
+    kind, name, *details = operation
+
+    if kind == 'folder':
+        writer.add_folder(name, *details)
+    elif kind == 'bytes':
+        data, mtime, size = details
+        writer.add_bytes(name, data, mtime)
+        if progress is not None:
+            progress(size)
+    else:
+        size, mtime, codec, rule, first, final, raw_size, crc, future = details
+        if first:
+            writer.begin_file(name, size, mtime, codec, rule)
+        writer.write_block(crc, raw_size, future.result())
+        if final:
+            writer.end_file()
+        if progress is not None:
+            progress(raw_size)
+
+
+def _archive_opener(stack, archives):
+    """Returns a function opening the archive of a snapshot id, keeping every archive open until `stack` closes."""
+    open_archives = {}
+
+    def open_archive(source_id):
+        if source_id not in open_archives:
+            open_archives[source_id] = stack.enter_context(zipfile.ZipFile(archives[source_id]))
+        return open_archives[source_id]
+
+    return open_archive
+
+
+def write_archive(snapshot_path, entries, archives=None, parent_id=None, progress=None):
+    """
+    Streams the given entries straight from their source files into a zip archive in a single pass.
+
+    Files are read in blocks which are compressed in parallel by a process pool, using the
+    codec their compression rule selects, and written to the archive in order. The SHA-256 hash and final
+    size of every file are recorded in its entry on the way.
+    Region files with a `base_version` are stored as a chunk level delta against the parent
+    snapshot `parent_id` when `archives` (the archive paths of the parent snapshot's chain,
+    see `extract_manifest`) is given.
+    The archive is written to a `.partial` file first and only renamed into place once it is
+    complete, so a failed run never leaves a broken snapshot.
+
+    Returns the bytes before and after compression per compression rule (see `compression.add_stats`).
+    """
+    partial_path = snapshot_path.with_name(f"{snapshot_path.name}.partial")
+
+    try:
+        with contextlib.ExitStack() as stack:
+            writer = compression.ZipWriter(stack.enter_context(open(partial_path, 'w+b')))
+            open_archive = _archive_opener(stack, archives or {})
+            # Worker processes are only started once the first block needs compressing
+            pool = stack.enter_context(concurrent.futures.ProcessPoolExecutor(compression.WORKERS))
+
+            def compress(data, codec, final):
+                if codec == 'none':
+                    return _completed(compression.compress_block(data, codec, 0, final))
+                return pool.submit(compression.compress_block, data, codec, compression.level_for(codec), final)
+
+            # Keep a few blocks per worker in flight, while the oldest ones are written in order
+            pending = collections.deque()
+            for operation in _archive_operations(entries, compress, archives, parent_id, open_archive):
+                pending.append(operation)
+                if len(pending) > 4 * compression.WORKERS:
+                    _run_operation(writer, pending.popleft(), progress)
+
+            while pending:
+                _run_operation(writer, pending.popleft(), progress)
+            writer.close()
+
+        partial_path.replace(snapshot_path)
+
+    except BaseException:
+        partial_path.unlink(missing_ok=True)
+        raise
+
+    return writer.stats
+
+
+def _copy_member(archive, entry, target):
+    file_hash = hashlib.sha256()
+
+    with compression.open_member(archive, entry['path']) as source:
+        while data := source.read(COPY_BUFFER_SIZE):
+            file_hash.update(data)
+            target.write(data)
+
+    if entry['hash'] is not None and file_hash.hexdigest() != entry['hash']:
+        raise ValueError(f"File {entry['path']} does not match its manifest")
+
+
+def _copy_version(open_archive, entry, target):
+    if entry.get('delta_base') is None:
+        _copy_member(open_archive(entry['source_id']), entry, target)
+        return
+
+    # Rebuilt region files are repacked, so they are compared to the hash of the repacked original
+    data = _read_version(open_archive, entry)
+    if entry.get('packed_hash') is not None and hashlib.sha256(data).hexdigest() != entry['packed_hash']:
+        raise ValueError(f"File {entry['path']} does not match its manifest")
+    target.write(data)
+
+
+def _group_by_source(entries):
+    """Groups the file entries by the snapshot holding their data, oldest snapshot first."""
+    groups = {}
+    for entry in entries:
+        if not entry['path'].endswith('/'):
+            groups.setdefault(entry['source_id'], []).append(entry)
+
+    return sorted(groups.items())
+
+
+def extract_manifest(entries, archives, destination, workers=None, progress=None):
+    """
+    Rebuilds the files of a manifest inside `destination`, extracting them with a pool of threads.
+
+    `archives` maps snapshot ids to their archive paths. Every thread opens the archives it
+    needs itself, so entries are read and decompressed in parallel. Restored files get their
+    original modification time back, so the next incremental snapshot recognises them as unchanged.
+    """
+    destination = Path(destination)
+    files = []
+
+    for entry in entries:
+        if entry['path'].endswith('/'):
+            (destination / entry['path']).mkdir(parents=True, exist_ok=True)
+        else:
+            files.append(entry)
+
+    local = threading.local()
+    stacks = []
+
+    def extract(entry):
+        if not hasattr(local, 'open_archive'):
+            local.stack = contextlib.ExitStack()
+            stacks.append(local.stack)
+            local.open_archive = _archive_opener(local.stack, archives)
+
+        target = destination / entry['path']
+        target.parent.mkdir(parents=True, exist_ok=True)
+        with open(target, 'wb') as file:
+            _copy_version(local.open_archive, entry, file)
+        os.utime(target, ns=(entry['mtime'], entry['mtime']))
+        if progress is not None:
+            progress(entry['size'])
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(workers or compression.WORKERS) as pool:
+            # Largest files first, so a big region file does not end up last on a single thread
+            for future in [pool.submit(extract, entry) for entry in sorted(files, key=lambda entry: -entry['size'])]:
+                future.result()
+    finally:
+        for stack in stacks:
+            stack.close()
+
+
+def check_extracted(entries, destination):
+    """
+    Checks that every entry of a manifest was rebuilt inside `destination`.
+
+    Raises a ValueError naming the first few files that are missing or have the wrong size.
+    Region files rebuilt from deltas are repacked, so only their presence is checked here, their
+    contents were checked against their `packed_hash` while extracting.
+    """
+    destination = Path(destination)
+    problems = []
+
+    for entry in entries:
+        target = destination / entry['path']
+        if entry['path'].endswith('/'):
+            if not target.is_dir():
+                problems.append(entry['path'])
+        elif not target.is_file():
+            problems.append(entry['path'])
+        elif entry.get('delta_base') is None and target.stat().st_size != entry['size']:
+            problems.append(entry['path'])
+
+    if problems:
+        raise ValueError(f"{len(problems)} files were not restored correctly: {', '.join(problems[:5])}")
+
+
+def verify_archive(archive_path, entries=None, throttle=None, workers=None):
+    """
+    Reads back every file stored in an archive, checking it against its manifest entry.
+
+    `entries` are the manifest entries whose data lives in this archive, None for archives from
+    before manifests were recorded. Whole files are compared to their hash, region deltas (and
+    files without a manifest) only to the CRC-32 stored in the archive. Files are read by a pool
+    of threads, each with its own handle on the archive, and `throttle` (if given) is called with
+    the size of every block read so it can limit the read rate. Returns the number of files and
+    bytes checked, or raises a ValueError naming the first few damaged files.
+    """
+    with zipfile.ZipFile(archive_path) as archive:
+        if entries is None:
+            entries = [{'path': info.filename, 'hash': None} for info in archive.infolist() if not info.is_dir()]
+
+    entries = [entry for entry in entries if not entry['path'].endswith('/')]
+    local = threading.local()
+    stacks = []
+    problems = []
+
+    def check(entry):
+        if not hasattr(local, 'archive'):
+            local.stack = contextlib.ExitStack()
+            stacks.append(local.stack)
+            local.archive = local.stack.enter_context(zipfile.ZipFile(archive_path))
+
+        file_hash = hashlib.sha256()
+        size = 0
+        try:
+            with compression.open_member(local.archive, _member_name(entry)) as member:
+                while data := member.read(COPY_BUFFER_SIZE):
+                    if throttle is not None:
+                        throttle(len(data))
+                    file_hash.update(data)
+                    size += len(data)
+        except (KeyError, OSError, ValueError, zipfile.BadZipFile, zlib.error) as e:
+            problems.append(f"{entry['path']} ({e})")
+            return 0
+
+        if entry.get('delta_base') is None and entry['hash'] is not None and file_hash.hexdigest() != entry['hash']:
+            problems.append(f"{entry['path']} (does not match its hash)")
+        return size
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(workers or compression.WORKERS) as pool:
+            checked_bytes = sum(pool.map(check, entries))
+    finally:
+        for stack in stacks:
+            stack.close()
+
+    if problems:
+        raise ValueError(f"{len(problems)} files are damaged: {', '.join(sorted(problems)[:5])}")
+    return len(entries), checked_bytes
+
+
+def export_manifest(entries, archives, zip_path, progress=None):
+    """Bundles the files of a manifest, possibly spread over an incremental chain, into a single zip archive."""
+    with contextlib.ExitStack() as stack:
+        export = stack.enter_context(
+            zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True))
+        open_archive = _archive_opener(stack, archives)
+
+        for entry in entries:
+            if entry['path'].endswith('/'):
+                export.writestr(entry['path'], b'')
+
+        for _, source_entries in _group_by_source(entries):
+            for entry in source_entries:
+                with export.open(entry['path'], 'w', force_zip64=entry['size'] > zipfile.ZIP64_LIMIT) as file:
+                    _copy_version(open_archive, entry, file)
+                if progress is not None:
+                    progress(entry['size'])
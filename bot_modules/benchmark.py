@@ -0,0 +1,170 @@
+"""
+benchmark.py
+
+Version: 1.3.0
+
+This module measures how fast the bot talks to a Minecraft server: RCON commands sent one
+after the other, at the same time and in batches, responses split over many packets, and
+the Server List Ping. It runs against the stand-in server of mockserver.py on localhost, so
+it needs no server jar, Java or network access, and can run on any CI machine.
+
+    python -m bot_modules.benchmark [--requests 2000] [--latency 0] [--json results.json]
+
+With `--baseline results.json` the results are compared to those of an earlier run (saved
+with `--json`), exiting with status 1 when the throughput of any benchmark dropped by more
+than `--tolerance`, so slowdowns are caught like failing tests.
+
+Functions:
+    - _measure(operation, count, concurrency, items): (Internal) Runs an operation and measures how long it takes.
+    - run_benchmark(requests, concurrency, pool_size, latency, response_size): Runs every benchmark.
+    - compare(results, baseline, tolerance): Returns the benchmarks that got slower than the baseline allows.
+    - main(): Runs the benchmarks with the options given on the command line and prints the results.
+
+Notes:
+    - The RCON benchmarks use a connection pool of their own, exactly like the bot's (see rcon.py).
+    - By default the stand-in server reads RCON like vanilla, so commands on one connection wait
+      for each other, as they must on a real server. `--pipelining` measures servers (and the
+      `rcon_pipelining` setting) that read RCON as a byte stream.
+    - Throughput depends on the machine, compare against a baseline from the same machine.
+"""
+
+
+# Standard library imports
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# First-party imports
+from bot_modules import rcon, slp
+from bot_modules.mockserver import MockServer
+
+
+PASSWORD = 'benchmark'
+# Seconds any single operation may take, generous so a slow machine measures rather than fails
+TIMEOUT = 30
+BATCH_SIZE = 100
+
+
+async def _measure(operation, count, concurrency=1, items=1):
+    """
+    Runs `operation` `count` times, `concurrency` at a time, and returns the throughput (of `items`
+    per operation) and the latency percentiles of a single operation.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    durations = []
+
+    async def timed():
+        async with semaphore:
+            start_time = time.perf_counter()
+            await operation()
+            durations.append(time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*(timed() for _ in range(count)))
+    total = time.perf_counter() - start_time
+
+    percentiles = statistics.quantiles(durations, n=100, method='inclusive') if count > 1 else durations * 99
+    return {
+        'count': count * items,
+        'seconds': round(total, 3),
+        'per_second': round(count * items / total, 1),
+        'p50_ms': round(statistics.median(durations) * 1000, 3),
+        'p95_ms': round(percentiles[94] * 1000, 3),
+        'max_ms': round(max(durations) * 1000, 3),
+    }
+
+
+async def run_benchmark(requests=2000, concurrency=32, pool_size=2, latency=0.0, response_size=64 * 1024,
+                        pipelining=False):
+    """
+    Runs every benchmark against a stand-in server and returns the results by benchmark name.
+
+    `requests` is how many commands each RCON benchmark sends, `latency` how many seconds the
+    server takes to answer each and `response_size` how many characters the split responses hold.
+    `pipelining` has the server read RCON as a byte stream, and the client send commands at once.
+    """
+    long_response = ('x' * 79 + '\n') * (response_size // 80)
+    results = {}
+
+    async with MockServer(PASSWORD, latency=latency, responses={'data': long_response},
+                          pipelining=pipelining) as server:
+        pool = rcon.RconPool(server.host, server.rcon_port, PASSWORD, pool_size, pipelining)
+        try:
+            await pool.command('list', TIMEOUT)  # Connects, so that is not measured
+
+            results['rcon_sequential'] = await _measure(lambda: pool.command('list', TIMEOUT), requests)
+            results['rcon_concurrent'] = await _measure(lambda: pool.command('list', TIMEOUT), requests,
+                                                        concurrency=concurrency)
+            results['rcon_batch'] = await _measure(lambda: pool.batch(['list'] * BATCH_SIZE, TIMEOUT),
+                                                   max(1, requests // BATCH_SIZE), items=BATCH_SIZE)
+
+            async def fragmented():
+                response = await pool.command('data get entity @p', TIMEOUT)
+                if response != long_response:
+                    raise RuntimeError(f"A response split over several packets came back as {len(response)} "
+                                       f"characters instead of {len(long_response)}")
+
+            results['rcon_fragmented'] = await _measure(fragmented, max(1, requests // 20))
+        finally:
+            pool.close()
+        if server.rejected_reads:
+            raise RuntimeError(f"The server dropped {server.rejected_reads} connection(s) for sending several "
+                               "packets at once")
+
+        results['status'] = await _measure(lambda: slp.query_status(server.host, server.port, TIMEOUT),
+                                           max(1, requests // 10))
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Returns a line for every benchmark whose throughput is more than `tolerance` (e.g. 0.2) below the baseline."""
+    slower = []
+    for name, expected in baseline.items():
+        measured = results.get(name)
+        if measured and measured['per_second'] < expected['per_second'] * (1 - tolerance):
+            slower.append(f"{name}: {measured['per_second']}/s, was {expected['per_second']}/s")
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measures how fast the bot talks to a (stand-in) Minecraft server.')
+    parser.add_argument('--requests', type=int, default=2000, help='how many commands each RCON benchmark sends')
+    parser.add_argument('--concurrency', type=int, default=32, help='how many commands are sent at the same time')
+    parser.add_argument('--pool-size', type=int, default=2, help='how many RCON connections are kept open')
+    parser.add_argument('--latency', type=float, default=0, help='milliseconds the server takes to answer')
+    parser.add_argument('--response-size', type=int, default=64 * 1024,
+                        help='characters of the responses split over several packets')
+    parser.add_argument('--pipelining', action='store_true',
+                        help='sends commands at once, to a server that reads RCON as a byte stream')
+    parser.add_argument('--json', type=Path, help='saves the results to this file')
+    parser.add_argument('--baseline', type=Path, help='fails when slower than the results in this file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='how much slower than the baseline is still accepted (default 0.2, 20%%)')
+    args = parser.parse_args()
+
+    results = asyncio.run(run_benchmark(args.requests, args.concurrency, args.pool_size, args.latency / 1000,
+                                        args.response_size, args.pipelining))
+
+    print(f"{'benchmark':<18}{'count':>8}{'per second':>14}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+    for name, result in results.items():
+        print(f"{name:<18}{result['count']:>8}{result['per_second']:>14}{result['p50_ms']:>10}"
+              f"{result['p95_ms']:>10}{result['max_ms']:>10}")
+
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=4), encoding='utf-8')
+
+    if args.baseline:
+        slower = compare(results, json.loads(args.baseline.read_text(encoding='utf-8')), args.tolerance)
+        for line in slower:
+            print(f"Slower than the baseline: {line}")
+        if slower:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
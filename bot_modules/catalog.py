@@ -0,0 +1,412 @@
+"""
+catalog.py
+
+Version: 1.3.0
+
+This module houses the snapshot catalog: listing the snapshots recorded in the
+database a page at a time, comparing two snapshots, and keeping the database in
+line with the archives actually present in the snapshots folder, in the background.
+
+Functions:
+    - _scan_snapshot_archives(): (Internal) Lists the archives in the snapshots folder.
+    - _find_dependents(snapshot_ids): (Internal) Finds the incremental snapshots based on the given ones.
+    - reconcile_catalog(): Background task keeping the database in line with the snapshots folder.
+    - list_snapshots(ctx, *args): Displays one page of snapshots, sorted by date, name or size.
+    - compression_stats(ctx): Displays how much every compression rule has saved so far.
+    - _classify(path): (Internal) Finds the dimension a world file belongs to.
+    - _file_kind(dimension, relative_path): (Internal) Tells region files, player data and other files apart.
+    - _central_directory(archive_path): (Internal) Lists the files in a zip archive without extracting it.
+    - _file_index(snapshot, use_manifest): (Internal) Lists the files of a snapshot with their size and checksum.
+    - compare_indexes(old_files, new_files): Groups the files that differ between two snapshots.
+    - diff_snapshots(ctx, *args): Displays which files differ between two snapshots.
+
+Attributes:
+    - conn: The SQLite connection to the database.
+    - c: The cursor object for executing SQL commands.
+    - RECONCILE_INTERVAL: How many seconds pass between reconciling the catalog with the snapshots folder.
+    - LIST_ORDERS: The orders snapshots can be listed in, each backed by an index.
+    - DIMENSION_FOLDERS: The folders of every dimension, the most specific ones first.
+
+Notes:
+    - The tables themselves are created (and migrated) in snapshots.py.
+    - Snapshots are compared by the hashes in their manifests, or by the CRC-32 in the
+      central directory of their archives, so nothing is ever extracted.
+"""
+
+
+# Standard library imports
+import asyncio
+import configparser
+import logging
+import math
+import os
+import sqlite3
+import time
+import zipfile
+from pathlib import Path
+
+# Third-party imports
+import discord
+from discord.ext import tasks
+
+# First-party imports
+from bot_modules import restore, snapshots
+
+
+script_path = Path(__file__).resolve().parent
+root_path = script_path.parent
+db_path = root_path / 'minecraft_manager.db'
+config_path = root_path / 'config.cfg'
+snapshots_path = root_path / 'snapshots'
+
+config = configparser.ConfigParser()
+config.read(config_path)
+
+RECONCILE_INTERVAL = config.getint('Snapshots', 'reconcile_interval', fallback=300)
+
+LIST_PAGE_SIZE = 10  # Discord embeds hold at most 25 fields and 6000 characters
+LIST_ORDERS = {
+    'newest': 'id DESC',
+    'oldest': 'id ASC',
+    'name': 'fancy_name ASC',
+    'size': 'file_size DESC',
+}
+
+DIFF_FILES_SHOWN = 8
+DIMENSION_FOLDERS = sorted(((folder, dimension) for dimension, folders in restore.DIMENSIONS.items()
+                            for folder in folders), key=lambda item: len(item[0]), reverse=True)
+PLAYER_FOLDERS = {Path(player_file).parts[0] for player_file in restore.PLAYER_FILES}
+
+conn = sqlite3.connect(db_path)
+conn.row_factory = sqlite3.Row
+c = conn.cursor()
+
+
+def _scan_snapshot_archives():
+    """Lists the zip archives in the snapshots folder by name, with their size and modification time."""
+    archives = {}
+    if not snapshots_path.exists():
+        return archives
+
+    with os.scandir(snapshots_path) as scan:
+        for entry in scan:
+            if entry.name.endswith('.zip') and entry.is_file():
+                stat = entry.stat()
+                archives[entry.name] = (stat.st_size, stat.st_mtime)
+
+    return archives
+
+
+def _find_dependents(snapshot_ids):
+    """Returns the ids and names of the snapshots reading files from the given ones, directly or through others."""
+    dependents = {}
+    based_on = set(snapshot_ids)
+    while based_on:
+        marks = ', '.join('?' * len(based_on))
+        c.execute(f"""SELECT DISTINCT snapshots.id, snapshots.fancy_name FROM snapshot_files
+                      JOIN snapshots ON snapshots.id = snapshot_files.snapshot_id
+                      WHERE snapshot_files.source_id IN ({marks}) OR snapshot_files.delta_base IN ({marks})""",
+                  [*based_on, *based_on])
+        found = {row['id']: row['fancy_name'] for row in c.fetchall()
+                 if row['id'] not in snapshot_ids and row['id'] not in dependents}
+        dependents.update(found)
+        based_on = set(found)
+
+    return dependents
+
+
+@tasks.loop(seconds=RECONCILE_INTERVAL)
+async def reconcile_catalog():
+    """
+    Reconciles the snapshots in the database with the archives in the snapshots folder.
+
+    Snapshots whose archive is gone are removed from the database, and archives without a
+    snapshot (e.g. copied back in by hand, or left from a lost database) are added to it.
+    Incremental snapshots based on a removed snapshot are marked as damaged first.
+    Runs in the background, so listing snapshots never has to touch the disk.
+    """
+    try:
+        async with snapshots.store_lock:  # Snapshots being written are not in the database yet
+            archives = await asyncio.to_thread(_scan_snapshot_archives)
+
+            c.execute("SELECT id, filename, fancy_name, path, storage FROM snapshots")
+            missing = {}
+            known = set()
+            for snapshot in c.fetchall():
+                snapshot_path = Path(snapshot['path'])
+                if snapshot['storage'] != 'store' and snapshot_path.parent == snapshots_path:
+                    exists = snapshot_path.name in archives
+                else:
+                    exists = snapshot_path.exists()
+
+                if exists:
+                    known.add(snapshot_path.name)
+                else:
+                    missing[snapshot['id']] = snapshot['fancy_name']
+
+            if missing:
+                # Incremental snapshots based on them can no longer be restored, mark them damaged
+                for missing_id, missing_name in missing.items():
+                    result = f'The snapshot "{missing_name}" it is based on is missing'
+                    for snapshot_id, fancy_name in _find_dependents([missing_id]).items():
+                        if snapshot_id not in missing:
+                            logging.warning("Snapshot %s is damaged: %s", fancy_name, result)
+                            c.execute("UPDATE snapshots SET verified_at=?, verify_result=? WHERE id=?",
+                                      (time.strftime('%Y-%m-%d %H:%M:%S'), result, snapshot_id))
+
+                c.executemany("DELETE FROM snapshots WHERE id=?", [(snapshot_id,) for snapshot_id in missing])
+                c.executemany("DELETE FROM snapshot_files WHERE snapshot_id=?",
+                              [(snapshot_id,) for snapshot_id in missing])
+
+            pending = {f"{filename}.zip" for filename in snapshots.pending_snapshots}
+            orphans = sorted(name for name in archives if name not in known and name not in pending)
+            for name in orphans:
+                file_size, mtime = archives[name]
+                fancy_name = Path(name).stem
+                c.execute("SELECT 1 FROM snapshots WHERE fancy_name=?", (fancy_name,))
+                if c.fetchone() is not None:
+                    fancy_name = f"{fancy_name} (recovered)"
+
+                c.execute("INSERT OR IGNORE INTO snapshots(filename, fancy_name, path, file_size, date, notes) \
+                           VALUES (?, ?, ?, ?, ?, ?)",
+                          (name, fancy_name, str(snapshots_path / name), file_size,
+                           time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(mtime)),
+                           'Found in the snapshots folder'))
+
+            conn.commit()
+
+        if missing or orphans:
+            logging.info("Reconciled the snapshot catalog: removed %d missing snapshots, added %d found on disk",
+                         len(missing), len(orphans))
+
+    except Exception as e:
+        logging.error("Failed to reconcile the snapshot catalog: %s", e)
+
+
+async def list_snapshots(ctx, *args):
+    page = 1
+    order = 'newest'
+    args = list(args)
+
+    while args:
+        arg = args.pop(0)
+        if arg == '--sort' and args and args[0] in LIST_ORDERS:
+            order = args.pop(0)
+        elif arg.isdigit() and int(arg) > 0:
+            page = int(arg)
+        else:
+            embed = discord.Embed(
+                title=':x: Invalid Arguments',
+                description=f'Usage: `list [page] [--sort {"|".join(LIST_ORDERS)}]`',
+                color=discord.Color.red()
+            )
+            await ctx.send(embed=embed)
+            return
+
+    c.execute("SELECT COUNT(*) FROM snapshots")
+    snapshot_count = c.fetchone()[0]
+    page_count = max(1, math.ceil(snapshot_count / LIST_PAGE_SIZE))
+    page = min(page, page_count)
+
+    c.execute(f"SELECT * FROM snapshots ORDER BY {LIST_ORDERS[order]} LIMIT ? OFFSET ?",
+              (LIST_PAGE_SIZE, (page - 1) * LIST_PAGE_SIZE))
+    page_snapshots = c.fetchall()
+
+    # Logical size of deduplicated snapshots, their file_size only counts the data they added to the store
+    store_ids = [snapshot[0] for snapshot in page_snapshots if snapshot['storage'] == 'store']
+    c.execute(f"SELECT snapshot_id, SUM(size) AS total_size FROM snapshot_files \
+                WHERE snapshot_id IN ({', '.join('?' * len(store_ids))}) GROUP BY snapshot_id", store_ids)
+    total_sizes = {row['snapshot_id']: row['total_size'] for row in c.fetchall()}
+
+    parent_ids = [snapshot['parent_id'] for snapshot in page_snapshots if snapshot['parent_id'] is not None]
+    c.execute(f"SELECT id, fancy_name FROM snapshots WHERE id IN ({', '.join('?' * len(parent_ids))})", parent_ids)
+    snapshot_names = {row['id']: row['fancy_name'] for row in c.fetchall()}
+
+    normal_embed = discord.Embed(color=discord.Color.green())
+
+    for snapshot in page_snapshots:
+        file_size_mb = round(snapshot[4] / (1024 * 1024), 2)
+        if snapshot['storage'] == 'store':
+            total_size_mb = round(total_sizes.get(snapshot[0], 0) / (1024 * 1024), 2)
+            size_text = f'**Stored Size:** {file_size_mb} MB new of {total_size_mb} MB total'
+        else:
+            size_text = f'**File Size:** {file_size_mb} MB'
+
+        if snapshot['kind'] == 'incremental':
+            delta_size_mb = round(snapshot['delta_size'] / (1024 * 1024), 2)
+            parent_name = snapshot_names.get(snapshot['parent_id'], 'a deleted snapshot')
+            kind_text = f'**Type:** Incremental, {delta_size_mb} MB changed since "{parent_name}"'
+        else:
+            kind_text = '**Type:** Full'
+
+        if snapshot['verified_at'] is None:
+            verified_text = '**Verified:** Never'
+        else:
+            result_text = ':white_check_mark:' if snapshot['verify_result'] == 'ok' else ':x: Damaged'
+            verified_text = f"**Verified:** {snapshot['verified_at']} {result_text}"
+
+        notes = snapshot[6] if snapshot[6] is None or len(snapshot[6]) <= 300 else f'{snapshot[6][:300]}...'
+        normal_embed.add_field(
+            name=f'{snapshot[1]} - {snapshot[2]}'[:256],
+            value=f'**Date:** {snapshot[5]}\n{kind_text}\n{size_text}\n{verified_text}\n**Notes:** {notes}',
+            inline=False
+        )
+
+    normal_embed.title = '📸 World Snapshots'
+
+    if normal_embed.fields:
+        normal_embed.set_footer(text=f"Page {page} of {page_count} | {snapshot_count} snapshots sorted by {order} | "
+                                     f"list [page] [--sort {'|'.join(LIST_ORDERS)}]")
+        await ctx.send(embed=normal_embed)
+    else:
+        normal_embed.description = 'No snapshots available.'
+        await ctx.send(embed=normal_embed)
+
+
+async def compression_stats(ctx):
+    c.execute('''SELECT rule, codec, COUNT(DISTINCT snapshot_id) AS snapshots, SUM(files) AS files,
+                        SUM(bytes_in) AS bytes_in, SUM(bytes_out) AS bytes_out
+                 FROM compression_stats GROUP BY rule, codec ORDER BY SUM(bytes_in) DESC''')
+    rows = c.fetchall()
+
+    embed = discord.Embed(title=':bar_chart: Compression Statistics', color=discord.Color.green())
+    if not rows:
+        embed.description = 'No snapshots have been compressed yet.'
+
+    for row in rows:
+        saved = row['bytes_in'] - row['bytes_out']
+        saved_percent = round(100 * saved / row['bytes_in'], 1) if row['bytes_in'] else 0
+        embed.add_field(
+            name=f"`{row['rule']}` ({row['codec']})",
+            value=(f"**Files:** {row['files']} in {row['snapshots']} snapshot(s)\n"
+                   f"**Size:** {round(row['bytes_in'] / (1024 * 1024), 2)} MB into "
+                   f"{round(row['bytes_out'] / (1024 * 1024), 2)} MB\n"
+                   f"**Saved:** {round(saved / (1024 * 1024), 2)} MB ({saved_percent}%)"),
+            inline=False
+        )
+
+    await ctx.send(embed=embed)
+
+
+def _classify(path):
+    """Returns the dimension a world file belongs to (None for none) and its path inside the dimension folder."""
+    for folder, dimension in DIMENSION_FOLDERS:
+        if path.startswith(f'{folder}/'):
+            return dimension, path[len(folder) + 1:]
+    return None, path
+
+
+def _file_kind(dimension, relative_path):
+    """Tells region files, player data and other files apart."""
+    parts = relative_path.split('/')
+    if len(parts) > 1 and parts[0] in restore.REGION_FOLDERS and parts[-1].endswith('.mca'):
+        return 'region files'
+    if dimension == 'overworld' and parts[0] in PLAYER_FOLDERS:
+        return 'player data'
+    return 'other files'
+
+
+def _central_directory(archive_path):
+    """Lists the files in a zip archive as path: (size, CRC-32), reading only its central directory."""
+    with zipfile.ZipFile(archive_path) as archive:
+        return {info.filename: (info.file_size, info.CRC) for info in archive.infolist() if not info.is_dir()}
+
+
+async def _file_index(snapshot, use_manifest):
+    """Lists the files of a snapshot as path: (size, checksum), from its manifest or the central directory."""
+    if use_manifest:
+        c.execute("SELECT path, size, hash FROM snapshot_files WHERE snapshot_id=? AND path NOT LIKE '%/'",
+                  (snapshot['id'],))
+        return {row['path']: (row['size'], row['hash']) for row in c.fetchall()}
+
+    if snapshot['storage'] == 'store' or snapshot['kind'] == 'incremental':
+        raise ValueError(f'Snapshot "{snapshot["fancy_name"]}" can only be compared to snapshots with a manifest')
+    return await asyncio.to_thread(_central_directory, snapshot['path'])
+
+
+def compare_indexes(old_files, new_files):
+    """Groups the files added, removed and changed between two file indexes by dimension and kind."""
+    groups = {}
+    for path in sorted(old_files.keys() | new_files.keys()):
+        old, new = old_files.get(path), new_files.get(path)
+        if old == new:
+            continue
+
+        dimension, relative_path = _classify(path)
+        group = groups.setdefault((dimension, _file_kind(dimension, relative_path)),
+                                  {'added': [], 'removed': [], 'changed': [], 'bytes': 0})
+        if old is None:
+            group['added'].append(relative_path)
+            group['bytes'] += new[0]
+        elif new is None:
+            group['removed'].append(relative_path)
+            group['bytes'] += old[0]
+        else:
+            group['changed'].append(relative_path)
+            group['bytes'] += max(old[0], new[0])
+
+    return groups
+
+
+async def diff_snapshots(ctx, *args):
+    if len(args) != 2:
+        embed = discord.Embed(
+            title=':x: Invalid Arguments',
+            description='Usage: `diff <old> <new>`, put names with spaces in quotes.',
+            color=discord.Color.red()
+        )
+        await ctx.send(embed=embed)
+        return
+
+    old_snapshot = await snapshots.get_snapshot(ctx, args[0])
+    new_snapshot = old_snapshot and await snapshots.get_snapshot(ctx, args[1])
+    if not new_snapshot:
+        return
+
+    start_time = time.monotonic()
+    # Manifest hashes and zip CRCs cannot be compared, snapshots from before manifests only have the latter
+    c.execute("SELECT COUNT(DISTINCT snapshot_id) FROM snapshot_files WHERE snapshot_id IN (?, ?)",
+              (old_snapshot['id'], new_snapshot['id']))
+    use_manifest = c.fetchone()[0] == len({old_snapshot['id'], new_snapshot['id']})
+
+    try:
+        old_files = await _file_index(old_snapshot, use_manifest)
+        new_files = await _file_index(new_snapshot, use_manifest)
+    except (OSError, ValueError, zipfile.BadZipFile) as e:
+        embed = discord.Embed(
+            title=':x: Cannot Compare Snapshots',
+            description=str(e),
+            color=discord.Color.red()
+        )
+        await ctx.send(embed=embed)
+        return
+
+    groups = compare_indexes(old_files, new_files)
+
+    embed = discord.Embed(
+        title=':mag: Snapshot Differences',
+        description=f'From "{old_snapshot["fancy_name"]}" ({old_snapshot["date"]}) '
+                    f'to "{new_snapshot["fancy_name"]}" ({new_snapshot["date"]})',
+        color=discord.Color.green()
+    )
+    if not groups:
+        embed.description += '\nBoth snapshots hold exactly the same files.'
+
+    dimension_order = list(restore.DIMENSIONS) + [None]
+    for (dimension, kind), group in sorted(groups.items(), key=lambda item: (dimension_order.index(item[0][0]),
+                                                                              item[0][1])):
+        lines = [f"**+{len(group['added'])} / -{len(group['removed'])} / ~{len(group['changed'])}**, "
+                 f"{round(group['bytes'] / (1024 * 1024), 2)} MB differ"]
+        changes = ([f'+ {path}' for path in group['added']] + [f'- {path}' for path in group['removed']] +
+                   [f'~ {path}' for path in group['changed']])
+        lines += changes[:DIFF_FILES_SHOWN]
+        if len(changes) > DIFF_FILES_SHOWN:
+            lines.append(f'And {len(changes) - DIFF_FILES_SHOWN} more')
+
+        embed.add_field(name=f'{(dimension or "other").capitalize()} {kind}',
+                        value='\n'.join(lines)[:1024], inline=False)
+
+    source = 'manifests' if use_manifest else 'archive directories'
+    embed.set_footer(text=f'Compared {len(old_files) + len(new_files)} files from their {source} '
+                          f'in {time.monotonic() - start_time:.1f} s | + added, - removed, ~ changed')
+    await ctx.send(embed=embed)
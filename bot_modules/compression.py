@@ -0,0 +1,330 @@
+"""
+compression.py
+
+Version: 1.3.0
+
+This module houses the compression engine for zip snapshots. Files are cut into
+blocks which are compressed in parallel by a process pool and then written, in
+order, into the archive by a streaming zip writer. The codec and level are chosen
+in config.cfg, so CPU time can be traded for archive size, and per-file rules keep
+already compressed files (region files, gzipped `.dat` files) from being compressed twice.
+
+Classes:
+    - ZipWriter: Writes a zip archive from blocks that were compressed elsewhere.
+
+Functions:
+    - check_settings(): Raises a ValueError when a configured codec cannot be used.
+    - choose_codec(name): Returns the compression rule matching a file and the codec it selects.
+    - level_for(codec): Returns the compression level to use with a codec.
+    - add_stats(stats, rule, codec, bytes_in, bytes_out): Adds a file to per-rule statistics.
+    - compress_block(data, codec, level, final): Compresses one block (runs in the process pool).
+    - open_member(archive, name): Opens a member of a `zipfile.ZipFile` for reading, including zstd members.
+
+Attributes:
+    - CODECS: The supported codecs and their zip compression method.
+    - BLOCK_SIZE: The size of the blocks files are compressed in.
+    - CODEC, LEVEL: The codec and level new snapshots are compressed with.
+    - WORKERS: The number of processes compressing in parallel, all cores by default.
+    - RULES: The (pattern, codec) compression rules, from the `[CompressionRules]` section
+      of config.cfg or `DEFAULT_RULES`. The first pattern matching a file's path wins;
+      the codec `default` stands for `CODEC`.
+
+Notes:
+    - Deflate blocks are flushed at byte boundaries without ending the stream, so the blocks
+      of a file simply concatenate into one valid deflate stream. zstd blocks are separate
+      frames, which zstd decoders read back to back.
+    - The CRC-32 of a file is computed while reading it, and handed to the writer with every
+      block, the process pool only compresses.
+    - On Windows every worker process imports the bot_modules package again, which is why
+      snapshots.py upgrades its tables and probes the freeze method in `setup_snapshots`, called
+      by bot.py, instead of on import.
+    - zstd needs the optional `zstandard` package. Archives using it can be read by this bot
+      and by tools such as 7-Zip, but not by every zip tool.
+"""
+
+
+# Standard library imports
+import configparser
+import fnmatch
+import os
+import struct
+import time
+import zipfile
+import zlib
+from pathlib import Path
+
+# Third-party imports
+try:
+    import zstandard
+except ImportError:  # Optional, only needed for the zstd codec
+    zstandard = None
+
+
+script_path = Path(__file__).resolve().parent
+root_path = script_path.parent
+config_path = root_path / 'config.cfg'
+
+config = configparser.ConfigParser()
+config.read(config_path)
+
+ZIP_ZSTANDARD = 93
+CODECS = {'none': zipfile.ZIP_STORED, 'deflate': zipfile.ZIP_DEFLATED, 'zstd': ZIP_ZSTANDARD}
+DEFAULT_LEVELS = {'none': 0, 'deflate': 6, 'zstd': 3}
+BLOCK_SIZE = 4 * 1024 * 1024
+
+CODEC = config.get('Snapshots', 'codec', fallback='deflate')
+LEVEL = config.getint('Snapshots', 'level', fallback=DEFAULT_LEVELS.get(CODEC, 0))
+WORKERS = config.getint('Snapshots', 'compression_workers', fallback=0) or os.cpu_count() or 1
+
+# Minecraft already compresses these with zlib or gzip, deflating them again only costs CPU time
+DEFAULT_RULES = [('*.mca', 'none'), ('*.mcc', 'none'), ('*.dat', 'none'), ('*.dat_old', 'none'),
+                 ('*.gz', 'none'), ('*.zip', 'none'), ('*.png', 'none')]
+
+if config.has_section('CompressionRules'):
+    RULES = [(pattern, codec.strip().lower()) for pattern, codec in config.items('CompressionRules')]
+else:
+    RULES = DEFAULT_RULES
+
+_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+_CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+_END_RECORD = struct.Struct('<IHHHHIIH')
+_ZIP64_END_RECORD = struct.Struct('<IQHHIIQQQQ')
+_ZIP64_LOCATOR = struct.Struct('<IIQI')
+_UINT32_MAX = 0xFFFFFFFF
+
+
+def check_codec(codec):
+    """Raises a ValueError when the codec is unknown or cannot be used on this machine."""
+    if codec not in CODECS:
+        raise ValueError(f"Unknown compression codec '{codec}', use one of: {', '.join(CODECS)}")
+    if codec == 'zstd' and zstandard is None:
+        raise ValueError("The zstd codec requires the `zstandard` package (`pip install zstandard`)")
+
+
+def check_settings():
+    """Raises a ValueError when the configured codec, or the codec of any rule, cannot be used."""
+    check_codec(CODEC)
+    for pattern, codec in RULES:
+        if codec != 'default':
+            try:
+                check_codec(codec)
+            except ValueError as e:
+                raise ValueError(f"Compression rule '{pattern}': {e}") from e
+
+
+def choose_codec(name):
+    """Returns the rule matching a file path (case-insensitive) and the codec it selects."""
+    lowered = name.lower()
+    for pattern, codec in RULES:
+        if fnmatch.fnmatchcase(lowered, pattern.lower()):
+            return pattern, CODEC if codec == 'default' else codec
+    return 'default', CODEC
+
+
+def level_for(codec):
+    return LEVEL if codec == CODEC else DEFAULT_LEVELS[codec]
+
+
+def add_stats(stats, rule, codec, bytes_in, bytes_out):
+    """Adds one file to statistics of the form `{rule: {'codec', 'files', 'bytes_in', 'bytes_out'}}`."""
+    rule_stats = stats.setdefault(rule, {'codec': codec, 'files': 0, 'bytes_in': 0, 'bytes_out': 0})
+    rule_stats['files'] += 1
+    rule_stats['bytes_in'] += bytes_in
+    rule_stats['bytes_out'] += bytes_out
+
+
+def compress_block(data, codec, level, final):
+    """Returns the compressed bytes of one block of a file."""
+    if codec == 'deflate':
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        compressed = compressor.compress(data) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+    elif codec == 'zstd':
+        compressed = zstandard.ZstdCompressor(level=level).compress(data) if data or final else b''
+    else:
+        compressed = data
+
+    return compressed
+
+
+def _dos_time(mtime):
+    local = time.localtime(max(mtime, 315532800))  # Zip dates start in 1980
+    return ((local.tm_hour << 11) | (local.tm_min << 5) | (local.tm_sec // 2),
+            ((local.tm_year - 1980) << 9) | (local.tm_mon << 5) | local.tm_mday)
+
+
+class ZipWriter:
+    """
+    Writes a zip archive (with ZIP64 support) from data that is compressed outside of the writer.
+
+    Files are written with `begin_file`, any number of `write_block` calls and `end_file`,
+    each file with its own codec, and every block with the CRC-32 of the file up to its end.
+    The local header is patched with the final CRC and sizes afterwards, so the output must be
+    seekable. `stats` counts the data before and after compression per compression rule
+    (see `add_stats`).
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.stats = {}
+        self._members = []
+        self._current = None
+
+    def _write_local_header(self, name, method, mtime, zip64):
+        encoded_name = name.encode('utf-8')
+        extra = struct.pack('<HHQQ', 1, 16, 0, 0) if zip64 else b''
+        dos_time, dos_date = _dos_time(mtime)
+        member = {'name': encoded_name, 'offset': self.file.tell(), 'method': method, 'time': dos_time,
+                  'date': dos_date, 'crc': 0, 'size': 0, 'compress_size': 0, 'zip64': zip64,
+                  'folder': name.endswith('/')}
+
+        self.file.write(_LOCAL_HEADER.pack(0x04034B50, 45 if zip64 else 20, 0x800, method, dos_time, dos_date,
+                                           0, _UINT32_MAX if zip64 else 0, _UINT32_MAX if zip64 else 0,
+                                           len(encoded_name), len(extra)))
+        self.file.write(encoded_name)
+        self.file.write(extra)
+        return member
+
+    def add_folder(self, name, mtime):
+        self._members.append(self._write_local_header(name, zipfile.ZIP_STORED, mtime, False))
+
+    def begin_file(self, name, size, mtime, codec, rule):
+        # Same margin as zipfile, in case the file grows or does not compress
+        self._current = self._write_local_header(name, CODECS[codec], mtime, size * 1.05 > zipfile.ZIP64_LIMIT)
+        self._current.update(codec=codec, rule=rule)
+
+    def write_block(self, crc, size, data):
+        member = self._current
+        member['crc'] = crc
+        member['size'] += size
+        member['compress_size'] += len(data)
+        self.file.write(data)
+
+    def end_file(self):
+        member = self._current
+        self._current = None
+
+        if not member['zip64'] and max(member['size'], member['compress_size']) > _UINT32_MAX:
+            raise ValueError(f"File {member['name'].decode('utf-8')} grew beyond 4 GiB while it was archived")
+
+        end = self.file.tell()
+        self.file.seek(member['offset'] + 14)
+        if member['zip64']:
+            self.file.write(struct.pack('<I', member['crc']))
+            self.file.seek(member['offset'] + _LOCAL_HEADER.size + len(member['name']) + 4)
+            self.file.write(struct.pack('<QQ', member['size'], member['compress_size']))
+        else:
+            self.file.write(struct.pack('<III', member['crc'], member['compress_size'], member['size']))
+        self.file.seek(end)
+
+        add_stats(self.stats, member['rule'], member['codec'], member['size'], member['compress_size'])
+        self._members.append(member)
+
+    def add_bytes(self, name, data, mtime):
+        """Compresses and writes a small file that is already in memory, using the codec of its rule."""
+        rule, codec = choose_codec(name)
+        self.begin_file(name, len(data), mtime, codec, rule)
+        self.write_block(zlib.crc32(data), len(data), compress_block(data, codec, level_for(codec), True))
+        self.end_file()
+
+    def _write_central_directory(self):
+        for member in self._members:
+            zip64_fields = []
+            size, compress_size, offset = member['size'], member['compress_size'], member['offset']
+            if size > _UINT32_MAX or member['zip64']:
+                zip64_fields.append(size)
+                size = _UINT32_MAX
+            if compress_size > _UINT32_MAX or member['zip64']:
+                zip64_fields.append(compress_size)
+                compress_size = _UINT32_MAX
+            if offset > _UINT32_MAX:
+                zip64_fields.append(offset)
+                offset = _UINT32_MAX
+
+            extra = struct.pack(f'<HH{len(zip64_fields)}Q', 1, 8 * len(zip64_fields), *zip64_fields) \
+                if zip64_fields else b''
+            if member['folder']:
+                external_attributes = (0o40755 << 16) | 0x10
+            else:
+                external_attributes = 0o100644 << 16
+
+            version = 63 if member['method'] == ZIP_ZSTANDARD else 45 if zip64_fields else 20
+            self.file.write(_CENTRAL_HEADER.pack(0x02014B50, (3 << 8) | version, version, 0x800, member['method'],
+                                                 member['time'], member['date'], member['crc'], compress_size, size,
+                                                 len(member['name']), len(extra), 0, 0, 0, external_attributes,
+                                                 offset))
+            self.file.write(member['name'])
+            self.file.write(extra)
+
+    def close(self):
+        start = self.file.tell()
+        self._write_central_directory()
+        end = self.file.tell()
+        count = len(self._members)
+
+        if count >= 0xFFFF or start > _UINT32_MAX or end - start > _UINT32_MAX:
+            self.file.write(_ZIP64_END_RECORD.pack(0x06064B50, 44, (3 << 8) | 45, 45, 0, 0, count, count,
+                                                   end - start, start))
+            self.file.write(_ZIP64_LOCATOR.pack(0x07064B50, 0, end, 1))
+            self.file.write(_END_RECORD.pack(0x06054B50, 0, 0, 0xFFFF, 0xFFFF, _UINT32_MAX, _UINT32_MAX, 0))
+        else:
+            self.file.write(_END_RECORD.pack(0x06054B50, 0, 0, count, count, end - start, start, 0))
+
+
+class _RawMember:
+    """Reads the compressed bytes of a member straight from the archive file."""
+
+    def __init__(self, archive, info):
+        self._file = open(archive.filename, 'rb')  # pylint: disable=consider-using-with
+        self._file.seek(info.header_offset)
+        header = _LOCAL_HEADER.unpack(self._file.read(_LOCAL_HEADER.size))
+        self._file.seek(header[9] + header[10], 1)  # Skip the name and extra field
+        self._remaining = info.compress_size
+
+    def read(self, size=-1):
+        if size < 0:
+            size = self._remaining
+        data = self._file.read(min(size, self._remaining))
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+class _ZstdMember:
+    """A readable zstd compressed member, which checks the CRC-32 once it has been read completely."""
+
+    def __init__(self, archive, info):
+        self._info = info
+        self._raw = _RawMember(archive, info)
+        self._reader = zstandard.ZstdDecompressor().stream_reader(self._raw, read_across_frames=True)
+        self._crc = 0
+
+    def read(self, size=-1):
+        data = self._reader.readall() if size < 0 else self._reader.read(size)
+        self._crc = zlib.crc32(data, self._crc)
+
+        if (size < 0 or (size > 0 and not data)) and self._crc != self._info.CRC:
+            raise zipfile.BadZipFile(f"Bad CRC-32 for file {self._info.filename!r}")
+        return data
+
+    def close(self):
+        self._reader.close()
+        self._raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def open_member(archive, name):
+    """Opens a member of an archive for reading, like `ZipFile.open`, but also understands zstd members."""
+    info = archive.getinfo(name)
+    if info.compress_type != ZIP_ZSTANDARD:
+        return archive.open(info)
+
+    if zstandard is None:
+        raise zipfile.BadZipFile(f"{name} is zstd compressed, which requires the `zstandard` package")
+    return _ZstdMember(archive, info)
\ No newline at end of file
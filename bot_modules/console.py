@@ -0,0 +1,133 @@
+"""
+console.py
+
+Version: 1.3.0
+
+This module runs scripts of Minecraft commands from Discord. `$console batch` takes a
+script of one command per line, typed after it (in a code block or not) or attached as
+a file such as a `.mcfunction`, and sends all of its commands to the server over a single
+RCON connection (see rcon.py), e.g. to sync a whitelist or set up gamerules and scoreboards.
+The output of console commands, which can run into tens of thousands of characters (e.g.
+`/data get` or plugin listings), is sent in pages of embeds or as an attached text file.
+
+Functions:
+    - _pages(output): (Internal) Splits output into pages, between lines where possible.
+    - send_output(ctx, description, output): Sends the output of console commands, paginated or as a file.
+    - console_batch(ctx, script): Sends every command of a script to the server and reports the responses.
+
+Attributes:
+    - MAX_BATCH_SIZE: The most commands a single script may hold.
+    - PAGE_SIZE: The most characters of output a single embed shows.
+    - MAX_PAGES: The most pages output is sent in, longer output is attached as a text file.
+
+Notes:
+    - The server runs the commands one after the other, in the order of the script. With
+      `rcon_pipelining` they are sent in a single burst, without waiting for each other.
+    - Formatting codes (e.g. `§a`) some servers and plugins color their output with are removed.
+"""
+
+
+# Standard library imports
+import io
+import logging
+import re
+import time
+
+# Third-party imports
+import discord
+
+# First-party imports
+from bot_modules import rcon
+
+
+MAX_BATCH_SIZE = 500
+# Leaves room in the embed's description for the command sent, which is at most a Discord message long
+PAGE_SIZE = 2000
+MAX_PAGES = 5
+
+FORMATTING_CODE = re.compile('§.')
+
+
+def _pages(output):
+    pages = []
+    page = ''
+    for line in output.splitlines(keepends=True):
+        # Lines longer than a page (e.g. the NBT data of `/data get`) are split over several pages
+        while line:
+            if page and len(page) + len(line) > PAGE_SIZE:
+                pages.append(page)
+                page = ''
+            page += line[:PAGE_SIZE]
+            line = line[PAGE_SIZE:]
+
+    return pages + [page] if page else pages
+
+
+async def send_output(ctx, description, output):
+    """
+    Sends the output of console commands below a description, in up to MAX_PAGES embeds,
+    or attached as a text file when it is longer than that.
+    """
+    output = FORMATTING_CODE.sub('', output).strip()
+    if not output:
+        embed = discord.Embed(
+            title='Minecraft Console',
+            description=f'{description}\nThe server sent no output.',
+            color=discord.Color.green())
+        await ctx.send(embed=embed)
+        return
+
+    pages = _pages(output)
+    if len(pages) > MAX_PAGES:
+        file = discord.File(io.BytesIO(output.encode('utf-8')), filename='output.txt')
+        embed = discord.Embed(
+            title='Minecraft Console',
+            description=f'{description}\nThe output is {len(output)} characters long, see the attached file.',
+            color=discord.Color.green())
+        await ctx.send(embed=embed, file=file)
+        return
+
+    for number, page in enumerate(pages, start=1):
+        # Keeps the output from closing its code block early
+        page = page.rstrip('\n').replace('```', '`\u200b`\u200b`')
+        embed = discord.Embed(
+            title='Minecraft Console',
+            description=f'{description}\n```\n{page}\n```' if number == 1 else f'```\n{page}\n```',
+            color=discord.Color.green())
+        if len(pages) > 1:
+            embed.set_footer(text=f'Page {number} of {len(pages)}')
+        await ctx.send(embed=embed)
+
+
+async def console_batch(ctx, script):
+    # A script can also be attached, e.g. as a .txt or .mcfunction file
+    for attachment in ctx.message.attachments:
+        script += '\n' + (await attachment.read()).decode('utf-8', errors='replace')
+
+    commands = rcon.parse_script(script)
+    if not commands or len(commands) > MAX_BATCH_SIZE:
+        embed = discord.Embed(
+            title=':x: Invalid Script',
+            description='Usage: `console batch` followed by one command per line, or with a script attached '
+                        f'(at most {MAX_BATCH_SIZE} commands).',
+            color=discord.Color.red())
+        await ctx.send(embed=embed)
+        return
+
+    start_time = time.perf_counter()
+    try:
+        responses = await rcon.send_batch(commands)
+    except (rcon.RconError, TimeoutError) as e:
+        embed = discord.Embed(
+            title='Minecraft Console',
+            description=f'Failed to run the script of {len(commands)} command(s): {str(e)}',
+            color=discord.Color.red())
+        await ctx.send(embed=embed)
+        return
+
+    milliseconds = (time.perf_counter() - start_time) * 1000
+    logging.info("Sent a script of %d commands over RCON in %.1f ms", len(commands), milliseconds)
+
+    output = '\n'.join(f'> {command}\n{response}' if response else f'> {command}'
+                       for command, response in zip(commands, responses))
+    await send_output(ctx, f'Sent {len(commands)} command(s) in {round(milliseconds, 1)} ms.', output)
@@ -0,0 +1,292 @@
+"""
+downloads.py
+
+Version: 1.3.0
+
+This module lets users download snapshots of any size. An embedded aiohttp file server
+serves the snapshot archives (with `sendfile` where the OS supports it, and HTTP Range
+requests so interrupted downloads can be resumed), behind signed links that expire.
+`$snapshots download` sends such a link in a DM instead of uploading the archive to
+Discord, whose upload size cap most worlds exceed.
+
+Functions:
+    - _signature(snapshot_id, expires): (Internal) Signs a download link.
+    - _download_name(snapshot): (Internal) The name a snapshot is downloaded as.
+    - _export_path(snapshot): (Internal) Where a snapshot that has no archive of its own is exported to.
+    - _local_url(): (Internal) Whether the public URL points at this machine, so nobody else can use the links.
+    - _remove_expired_exports(): (Internal) Removes exports whose download links have all expired.
+    - _export_snapshot(snapshot, message, embed): (Internal) Rebuilds a snapshot into a single zip archive.
+    - _serve_snapshot(request): (Internal) Serves a snapshot archive for a signed link.
+    - start_download_server(): Starts the download server, unless it is disabled, not set up or already running.
+    - download_snapshot(ctx, snapshot_name): Sends a download link for a snapshot in a DM.
+
+Classes:
+    - _SnapshotResponse: (Internal) Sends a snapshot archive, keeping the snapshot in use meanwhile.
+
+Attributes:
+    - conn: The SQLite connection to the database.
+    - c: The cursor object for executing SQL commands.
+    - exports_path: The folder snapshots without an archive of their own are exported to.
+    - export_locks: Held while a snapshot is exported, by snapshot id, so it is exported only once at a time.
+    - DOWNLOADS_ENABLED: Whether the download server runs, otherwise snapshots are uploaded to Discord.
+    - DOWNLOAD_HOST, DOWNLOAD_PORT: The address the download server listens on.
+    - PUBLIC_URL: The address users reach the download server at, used in the links.
+    - LINK_EXPIRY: How many hours a download link is valid for.
+
+Notes:
+    - Deduplicated and incremental snapshots are exported to a regular zip archive first,
+      which is kept until the links to it have expired and nobody is downloading it.
+    - The download server does not start while `public_url` is left at `localhost`, links to
+      it would only work on the bot's own machine. Snapshots are uploaded to Discord instead.
+    - Links are signed with HMAC-SHA256 using the `secret` from config.cfg. Without one a
+      random key is used, so links stop working when the bot restarts.
+"""
+
+
+# Standard library imports
+import asyncio
+import collections
+import configparser
+import hashlib
+import hmac
+import logging
+import secrets
+import sqlite3
+import time
+import urllib.parse
+from pathlib import Path
+
+# Third-party imports
+import discord
+from aiohttp import web
+
+# First-party imports
+from bot_modules import progress, snapshots
+
+
+script_path = Path(__file__).resolve().parent
+root_path = script_path.parent
+db_path = root_path / 'minecraft_manager.db'
+config_path = root_path / 'config.cfg'
+exports_path = root_path / 'snapshots' / 'exports'
+
+config = configparser.ConfigParser()
+config.read(config_path)
+
+DOWNLOADS_ENABLED = config.getboolean('Downloads', 'enabled', fallback=False)
+DOWNLOAD_HOST = config.get('Downloads', 'host', fallback='0.0.0.0')
+DOWNLOAD_PORT = config.getint('Downloads', 'port', fallback=8080)
+PUBLIC_URL = config.get('Downloads', 'public_url', fallback='').rstrip('/')
+LINK_EXPIRY = config.getint('Downloads', 'link_expiry', fallback=24)
+LINK_SECRET = config.get('Downloads', 'secret', fallback='').encode() or secrets.token_bytes(32)
+
+# Uploads to Discord outside of a server are capped at this size
+DEFAULT_UPLOAD_LIMIT = 10 * 1024 * 1024
+
+conn = sqlite3.connect(db_path)
+conn.row_factory = sqlite3.Row
+c = conn.cursor()
+
+# The runner of the download server, once started
+runners = []
+export_locks = collections.defaultdict(asyncio.Lock)
+
+
+def _signature(snapshot_id, expires):
+    return hmac.new(LINK_SECRET, f'{snapshot_id}:{expires}'.encode(), hashlib.sha256).hexdigest()
+
+
+def _download_name(snapshot):
+    return f"{Path(snapshot['filename']).stem}.zip"
+
+
+def _export_path(snapshot):
+    """Returns where a snapshot is exported to, or None for snapshots that are a complete zip archive themselves."""
+    if snapshot['storage'] == 'store' or snapshot['kind'] == 'incremental':
+        return exports_path / f"{snapshot['id']}.zip"
+    return None
+
+
+def _local_url():
+    return urllib.parse.urlsplit(PUBLIC_URL).hostname in (None, 'localhost', '127.0.0.1', '::1', '0.0.0.0')
+
+
+def _remove_expired_exports():
+    if not exports_path.exists():
+        return
+
+    for export in exports_path.iterdir():
+        if export.stem.isdigit() and snapshots.snapshots_in_use[int(export.stem)] > 0:
+            continue  # Being exported, downloaded or uploaded right now
+        try:
+            if export.stat().st_mtime < time.time() - LINK_EXPIRY * 3600:
+                export.unlink(missing_ok=True)
+        except OSError as e:  # E.g. still open for sending on Windows, it is removed next time
+            logging.warning("Could not remove the expired export %s: %s", export.name, e)
+
+
+async def _export_snapshot(snapshot, message, embed):
+    """Rebuilds a deduplicated or incremental snapshot into a regular zip archive, unless that was done already."""
+    export_path = _export_path(snapshot)
+
+    # Asked for twice at once, the second request waits for the first export instead of writing it again
+    async with export_locks[snapshot['id']]:
+        if export_path.exists():
+            export_path.touch()  # Kept until the new link expires
+            return export_path
+
+        async with progress.reporting(message, embed) as tracker:
+            await snapshots.export_snapshot(snapshot, export_path, tracker)
+
+    return export_path
+
+
+class _SnapshotResponse(web.FileResponse):
+    """Sends the archive of a snapshot, which is marked in use (so not removed) while it is being sent."""
+
+    def __init__(self, snapshot_id, path, **kwargs):
+        super().__init__(path, **kwargs)
+        self.snapshot_id = snapshot_id
+
+    async def prepare(self, request):
+        with snapshots.using_snapshots([self.snapshot_id]):
+            return await super().prepare(request)
+
+
+async def _serve_snapshot(request):
+    """
+    Serves the archive of a snapshot, if the link is signed and has not expired.
+
+    aiohttp answers Range requests (resuming downloads) and uses `sendfile` by itself.
+    """
+    try:
+        snapshot_id = int(request.match_info['snapshot_id'])
+        expires = int(request.query.get('expires', ''))
+    except ValueError as e:
+        raise web.HTTPNotFound() from e
+
+    if not hmac.compare_digest(request.query.get('signature', ''), _signature(snapshot_id, expires)):
+        raise web.HTTPForbidden(text='This download link is not valid.')
+    if expires < time.time():
+        raise web.HTTPGone(text='This download link has expired, request a new one in Discord.')
+
+    c.execute("SELECT * FROM snapshots WHERE id=?", (snapshot_id,))
+    snapshot = c.fetchone()
+    if snapshot is None:
+        raise web.HTTPNotFound(text='This snapshot has been deleted.')
+
+    file_path = _export_path(snapshot) or Path(snapshot['path'])
+    if not file_path.is_file():
+        raise web.HTTPNotFound(text='This snapshot is no longer available, request a new link in Discord.')
+
+    logging.info("Serving snapshot %s to %s (%s)", snapshot['fancy_name'], request.remote,
+                 request.headers.get('Range', 'whole file'))
+    return _SnapshotResponse(snapshot_id, file_path, headers={
+        'Content-Disposition': f'attachment; filename="{_download_name(snapshot)}"'})
+
+
+async def start_download_server():
+    """Starts serving snapshots over HTTP, unless that is disabled, not set up or already running."""
+    if not DOWNLOADS_ENABLED or runners:
+        return
+    if _local_url():
+        logging.error("Not serving snapshot downloads, set `public_url` under [Downloads] in config.cfg to the "
+                      "address users reach this machine at (it is %s)", PUBLIC_URL or 'empty')
+        return
+
+    app = web.Application()
+    app.router.add_get('/snapshots/{snapshot_id}/{filename}', _serve_snapshot)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    runners.append(runner)
+
+    await web.TCPSite(runner, DOWNLOAD_HOST, DOWNLOAD_PORT).start()
+    await asyncio.to_thread(_remove_expired_exports)
+    logging.info("Serving snapshot downloads on %s:%d, linked as %s", DOWNLOAD_HOST, DOWNLOAD_PORT, PUBLIC_URL)
+
+
+async def download_snapshot(ctx, snapshot_name):
+    snapshot = await snapshots.get_snapshot(ctx, snapshot_name)
+    if not snapshot:
+        return
+
+    snapshot_path = Path(snapshot[3])
+    if not snapshot_path.exists():
+        embed = discord.Embed(
+            title=':x: Not Found',
+            description=f'Snapshot file for "{snapshot_name}" not found.',
+            color=discord.Color.red()
+        )
+        await ctx.send(embed=embed)
+        return
+
+    embed = discord.Embed(
+        title=':hourglass: Preparing Download...',
+        description=f'Preparing the download of snapshot "{snapshot_name}", please wait...',
+        color=discord.Color.blue()
+        )
+    message = await ctx.send(embed=embed)
+
+    try:
+        # Exports in use are not removed as expired, nor the snapshot deleted, until it has been sent
+        with snapshots.using_snapshots([snapshot['id']]):
+            await asyncio.to_thread(_remove_expired_exports)
+            if _export_path(snapshot) is not None:
+                # Deduplicated and incremental snapshots are rebuilt into a regular zip archive first
+                snapshot_path = await _export_snapshot(snapshot, message, embed)
+            download_size_mb = round(snapshot_path.stat().st_size / (1024 * 1024), 2)
+
+            if not runners:
+                upload_limit = ctx.guild.filesize_limit if ctx.guild else DEFAULT_UPLOAD_LIMIT
+                if snapshot_path.stat().st_size > upload_limit:
+                    raise ValueError(f'the snapshot is {download_size_mb} MB, more than Discord allows to upload. '
+                                     'Set up the download server under `[Downloads]` in config.cfg to download it')
+
+                file = discord.File(str(snapshot_path), filename=_download_name(snapshot))
+                embed = discord.Embed(
+                    title=':cloud: Snapshot Uploaded',
+                    description=f'Snapshot "{snapshot_name}" has been successfully uploaded.',
+                    color=discord.Color.green()
+                )
+                await ctx.send(embed=embed, file=file)
+                await message.delete()
+                return
+
+            expires = int(time.time()) + LINK_EXPIRY * 3600
+            query = urllib.parse.urlencode({'expires': expires, 'signature': _signature(snapshot['id'], expires)})
+            link = f"{PUBLIC_URL}/snapshots/{snapshot['id']}/{urllib.parse.quote(_download_name(snapshot))}?{query}"
+
+            embed = discord.Embed(
+                title=':link: Snapshot Download',
+                description=f'[Download snapshot "{snapshot_name}"]({link}) ({download_size_mb} MB)\n\n'
+                            f'The link expires <t:{expires}:R>, interrupted downloads can be resumed until then.',
+                color=discord.Color.green()
+            )
+            await ctx.author.send(embed=embed)
+
+            embed = discord.Embed(
+                title=':cloud: Download Link Sent',
+                description=f'A download link for snapshot "{snapshot_name}" has been sent to you in a DM.',
+                color=discord.Color.green()
+            )
+            await message.edit(embed=embed)
+
+    except discord.Forbidden:
+        embed = discord.Embed(
+            title=':x: Cannot Send DM!',
+            description='Allow direct messages from server members to receive the download link.',
+            color=discord.Color.red()
+        )
+        await message.edit(embed=embed)
+
+    except Exception as e:
+        embed = discord.Embed(
+            title=':x: Snapshot Download Failed!',
+            description=f'Failed to download snapshot "{snapshot_name}": {str(e)}',
+            color=discord.Color.red()
+        )
+        await message.edit(embed=embed)
+
+    finally:
+        if not runners and _export_path(snapshot) is not None and not snapshots.snapshots_in_use[snapshot['id']]:
+            _export_path(snapshot).unlink(missing_ok=True)  # Only kept around for download links
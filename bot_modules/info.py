@@ -51,6 +51,7 @@ async def info(ctx, bot):
     operator_commands = [
         '`snapshots <command>`: Manage world snapshots (see `info snapshots`)',
         '`console <command>`: Send commands to the Minecraft Server',
+        '`console batch <script>`: Send a script of commands (one per line, or attached) in one go',
         '`stop`: Stops the Minecraft Server'
     ]
     bot_commands = [
@@ -77,11 +78,20 @@ async def info_snapshots(ctx, bot):
     timestamp = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M UTC")
 
     snapshot_commands = [
-            '`list`: List all available snapshots',
-            '`create <name> | <description>`: Create a new snapshot of the world',
+            '`list [page] [--sort newest|oldest|name|size]`: List the available snapshots, a page at a time',
+            '`create [--incremental] <name> | <description>`: Create a new snapshot of the world',
             '`delete <name>`: Delete a snapshot',
-            '`restore <name>`: Restore the server from a snapshot',
-            '`download <name>`: Download a snapshot ("World download")'
+            '`restore <name> [--dimension <overworld|nether|end>] [--regions x1,z1:x2,z2]`: Restore the server '
+            '(or only a dimension or range of region files) from a snapshot',
+            '`player-restore <name> <player>`: Restore the inventory, stats and advancements of one player',
+            '`download <name>`: Get a download link for a snapshot in a DM ("World download")',
+            '`diff <old> <new>`: Show which region files, player data and other files differ between two snapshots',
+            '`verify [name|all]`: Check that a snapshot (or all of them) can still be restored',
+            '`schedule [add <name> "<cron>|stop" [--incremental] | remove <name> | history <name>]`: '
+            'Create snapshots automatically',
+            '`prune [--dry-run]`: Delete the snapshots the retention rules do not keep, or preview which',
+            '`replication [now]`: Show how far the replication target is behind, or replicate right away',
+            '`compression`: Show how much space every compression rule saved'
     ]
 
     footer_text = f"Version {BOT_VERSION} | Sent at {timestamp}"
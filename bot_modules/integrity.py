@@ -0,0 +1,199 @@
+"""
+integrity.py
+
+Version: 1.3.0
+
+This module checks that snapshots can still be restored, long before the day they
+are needed. Every file a snapshot stored is read back and compared to the SHA-256
+hash recorded in its manifest (or to the CRC-32 in the archive for snapshots without
+one), on demand or in a scheduled background job. The time and result of the last
+check are recorded in the `snapshots` table.
+
+Functions:
+    - _verify_snapshot(snapshot, throttle): (Internal) Checks a single snapshot and records the result.
+    - _verify_many(bot, rows): (Internal) Checks several snapshots, one after the other.
+    - verify_snapshots(ctx, bot, *args): Checks one or all snapshots and reports what is damaged.
+    - verify_job(bot): Background task checking all snapshots every `verify_interval` hours.
+    - start_verify_job(bot): Starts the background task, unless it is disabled or already running.
+
+Classes:
+    - Throttle: Limits how many bytes per second the checking threads read together.
+
+Attributes:
+    - VERIFY_INTERVAL: How many hours pass between background checks, 0 disables them.
+    - VERIFY_BANDWIDTH: How many MB per second may be read while the server is running, 0 for no limit.
+    - VERIFY_WORKERS: How many threads read in parallel.
+
+Notes:
+    - Reads are only throttled while the Minecraft server is running, so checks do not
+      compete with it for disk I/O.
+"""
+
+
+# Standard library imports
+import asyncio
+import configparser
+import logging
+import threading
+import time
+import zipfile
+from pathlib import Path
+
+# Third-party imports
+import discord
+from discord.ext import tasks
+
+# First-party imports
+from bot_modules import archive, snapshots, store
+
+
+script_path = Path(__file__).resolve().parent
+root_path = script_path.parent
+config_path = root_path / 'config.cfg'
+
+config = configparser.ConfigParser()
+config.read(config_path)
+
+VERIFY_INTERVAL = config.getint('Snapshots', 'verify_interval', fallback=24)
+VERIFY_BANDWIDTH = config.getint('Snapshots', 'verify_bandwidth', fallback=50)
+VERIFY_WORKERS = config.getint('Snapshots', 'verify_workers', fallback=2)
+
+# Held while snapshots are being checked, so the job and the command never read at the same time
+verify_lock = asyncio.Lock()
+
+
+class Throttle:
+    """
+    Limits how many bytes per second all threads sharing it read together.
+
+    Call it with the size of every block read, it sleeps for as long as it takes to stay
+    within the budget. A budget of 0 never sleeps.
+    """
+
+    def __init__(self, bytes_per_second):
+        self.bytes_per_second = bytes_per_second
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+
+    def __call__(self, size):
+        if not self.bytes_per_second:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            self.next_time = max(self.next_time, now) + size / self.bytes_per_second
+            delay = self.next_time - now
+
+        time.sleep(delay)
+
+
+async def _verify_snapshot(snapshot, throttle):
+    """Checks every file of a snapshot, records when and with what result, and returns the result."""
+    start_time = time.monotonic()
+
+    try:
+        entries, archives = snapshots.get_sources(snapshot)  # Fails if a snapshot it is based on is gone
+        with snapshots.using_snapshots([snapshot['id'], *archives]):
+            if snapshot['storage'] == 'store':
+                await asyncio.to_thread(store.verify_tree, entries, throttle, VERIFY_WORKERS)
+            else:
+                # Incremental snapshots only check what their own archive holds, the rest is checked with its snapshot
+                own_entries = [entry for entry in entries if entry['source_id'] == snapshot['id']] if entries else None
+                await asyncio.to_thread(archive.verify_archive, snapshot['path'], own_entries, throttle,
+                                        VERIFY_WORKERS)
+        result = 'ok'
+    except (OSError, ValueError, zipfile.BadZipFile) as e:
+        result = str(e) or type(e).__name__
+
+    snapshots.c.execute("UPDATE snapshots SET verified_at=?, verify_result=? WHERE id=?",
+                        (time.strftime('%Y-%m-%d %H:%M:%S'), result, snapshot['id']))
+    snapshots.conn.commit()
+
+    if result == 'ok':
+        logging.info("Verified snapshot %s in %.1f s", snapshot['fancy_name'], time.monotonic() - start_time)
+    else:
+        logging.warning("Snapshot %s is damaged: %s", snapshot['fancy_name'], result)
+    return result
+
+
+async def _verify_many(bot, rows):
+    """Checks the given snapshots one after the other, returning the result for every snapshot name."""
+    results = {}
+    async with verify_lock:
+        for snapshot in rows:
+            # Checked per snapshot, as the server may be started or stopped in the meantime
+            bandwidth = VERIFY_BANDWIDTH * 1024 * 1024 if bot.server_running else 0
+            results[snapshot['fancy_name']] = await _verify_snapshot(snapshot, Throttle(bandwidth))
+
+    return results
+
+
+async def verify_snapshots(ctx, bot, *args):
+    snapshot_name = ' '.join(args)
+
+    if verify_lock.locked():
+        embed = discord.Embed(
+            title=':x: Already Verifying!',
+            description='Snapshots are already being verified, please try again later.',
+            color=discord.Color.red())
+        await ctx.send(embed=embed)
+        return
+
+    if snapshot_name in ('', 'all'):
+        snapshots.c.execute("SELECT * FROM snapshots ORDER BY id")
+        rows = snapshots.c.fetchall()
+    else:
+        snapshot = await snapshots.get_snapshot(ctx, snapshot_name)
+        if not snapshot:
+            return
+        rows = [snapshot]
+
+    embed = discord.Embed(
+        description=f':mag: Verifying {len(rows)} snapshot(s), this may take a while...',
+        color=discord.Color.blue()
+    )
+    message = await ctx.send(embed=embed)
+
+    results = await _verify_many(bot, rows)
+    damaged = {name: result for name, result in results.items() if result != 'ok'}
+
+    if not damaged:
+        embed = discord.Embed(
+            title=':white_check_mark: Snapshots Verified!',
+            description=f'All {len(results)} snapshot(s) are intact.',
+            color=discord.Color.green()
+        )
+    else:
+        embed = discord.Embed(
+            title=':x: Damaged Snapshots!',
+            description=f'{len(damaged)} of {len(results)} snapshot(s) cannot be restored completely.',
+            color=discord.Color.red()
+        )
+        for name, result in list(damaged.items())[:20]:  # Discord embeds hold at most 25 fields
+            embed.add_field(name=name[:256], value=result[:1024], inline=False)
+        if len(damaged) > 20:
+            embed.set_footer(text=f'And {len(damaged) - 20} more, see the snapshot list.')
+
+    await message.edit(embed=embed)
+
+
+@tasks.loop(hours=VERIFY_INTERVAL or 24)
+async def verify_job(bot):
+    """Checks all snapshots in the background, the ones checked longest ago (or never) first."""
+    if verify_job.current_loop == 0:
+        return  # Not while the bot (and usually the server) is just starting
+
+    try:
+        snapshots.c.execute("SELECT * FROM snapshots ORDER BY verified_at IS NOT NULL, verified_at")
+        results = await _verify_many(bot, snapshots.c.fetchall())
+        damaged = sum(result != 'ok' for result in results.values())
+        logging.info("Verified %d snapshots in the background, %d damaged", len(results), damaged)
+
+    except Exception as e:
+        logging.error("Failed to verify snapshots in the background: %s", e)
+
+
+def start_verify_job(bot):
+    """Starts checking all snapshots every `verify_interval` hours, unless that is disabled or already running."""
+    if VERIFY_INTERVAL > 0 and not verify_job.is_running():
+        verify_job.start(bot)
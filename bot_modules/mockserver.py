@@ -0,0 +1,290 @@
+"""
+mockserver.py
+
+Version: 1.3.0
+
+This module is a stand-in for a Minecraft server, for testing and benchmarking the bot
+without a server jar, Java or network access. It speaks RCON (login, commands, responses
+split into 4096 character packets like the real server does) and answers the Server List
+Ping, on localhost. Latency and dropped connections can be added to see how the bot copes.
+
+    async with MockServer('password', players=['Steve']) as server:
+        pool = rcon.RconPool(server.host, server.rcon_port, 'password', 2)
+        await pool.command('list', 5)
+
+It can also be run on its own, to point the bot at while developing:
+`python -m bot_modules.mockserver --port 25565 --rcon-port 25575 --password <rcon_password>`
+
+Functions:
+    - _offline_uuid(name): (Internal) The UUID the server gives a player in offline mode.
+    - _rcon_packet(request_id, packet_type, body): (Internal) Encodes an RCON packet.
+    - main(): Runs a stand-in server until interrupted, with the options given on the command line.
+
+Classes:
+    - MockServer: A stand-in Minecraft server serving RCON and the Server List Ping.
+
+Notes:
+    - Commands are answered like a vanilla server would (e.g. `list`, `say`, `save-all`), any
+      other response can be set in `responses`, as text or as a function of the command.
+    - Like a real server it handles the packets of a connection one at a time, in order, so
+      `latency` adds up for commands sent at once over the same connection.
+    - Like vanilla it reads RCON one packet per read of the socket (at most 1460 bytes), and
+      drops the connection when a read holds more or less than one packet, e.g. because the
+      client sent several at once. With `pipelining` it reads the packets from a byte stream
+      instead, like servers that do support that.
+"""
+
+
+# Standard library imports
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import struct
+import uuid
+
+# First-party imports
+from bot_modules import rcon, slp
+
+
+# The server's answer to a login, either with the login's request id or -1 when refused
+PACKET_LOGIN_RESPONSE = 2
+# The most characters of a response the real server sends in a single packet
+FRAGMENT_SIZE = 4096
+# The most bytes vanilla reads from an RCON connection at once, which must hold exactly one packet
+VANILLA_READ_SIZE = 1460
+
+
+def _offline_uuid(name):
+    digest = bytearray(hashlib.md5(f'OfflinePlayer:{name}'.encode('utf-8')).digest())
+    digest[6] = digest[6] & 0x0F | 0x30  # Version 3, like Java's UUID.nameUUIDFromBytes
+    digest[8] = digest[8] & 0x3F | 0x80
+    return str(uuid.UUID(bytes=bytes(digest)))
+
+
+def _rcon_packet(request_id, packet_type, body):
+    payload = struct.pack('<ii', request_id, packet_type) + body.encode('utf-8') + b'\x00\x00'
+    return struct.pack('<i', len(payload)) + payload
+
+
+class MockServer:
+    """
+    A stand-in Minecraft server on `host`, with RCON on `rcon_port` and the Server List Ping on `port`.
+
+    Ports of 0 (the default) are picked by the OS, read them back from the attributes after `start`.
+    `latency` is how many seconds every answer is delayed, `failure_rate` the chance (0 to 1) that
+    the connection is dropped instead of answering a command. Every command received is added to
+    `commands`, connections dropped because a read did not hold exactly one packet are counted in
+    `rejected_reads` (unless `pipelining` is set).
+    """
+
+    def __init__(self, password='', *, host='127.0.0.1', port=0, rcon_port=0, responses=None, players=(),
+                 max_players=20, motd='A Minecraft Server', version='1.21.1', protocol=767,
+                 latency=0.0, failure_rate=0.0, pipelining=False, seed=None):
+        self.password = password
+        self.host = host
+        self.port = port
+        self.rcon_port = rcon_port
+        self.responses = dict(responses or {})
+        self.players = list(players)
+        self.max_players = max_players
+        self.motd = motd
+        self.version = version
+        self.protocol = protocol
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.pipelining = pipelining
+        self.random = random.Random(seed)
+
+        self.commands = []
+        self.rcon_logins = 0
+        self.rejected_reads = 0
+        self.status_requests = 0
+        self.servers = []
+        self.writers = set()  # Of the open connections, to drop them
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def start(self):
+        """Starts listening for RCON and Server List Ping connections."""
+        rcon_server = await asyncio.start_server(self._serve_rcon, self.host, self.rcon_port)
+        status_server = await asyncio.start_server(self._serve_status, self.host, self.port)
+        self.servers = [rcon_server, status_server]
+        self.rcon_port = rcon_server.sockets[0].getsockname()[1]
+        self.port = status_server.sockets[0].getsockname()[1]
+
+    def drop_connections(self):
+        """Closes every open connection, like a server that crashed or restarted does."""
+        for writer in list(self.writers):
+            writer.close()
+
+    async def close(self):
+        """Stops listening and closes every open connection."""
+        for server in self.servers:
+            server.close()
+        self.drop_connections()
+        for server in self.servers:
+            await server.wait_closed()
+        self.servers = []
+
+    def status(self):
+        """Returns the status the server answers a Server List Ping with."""
+        return {
+            'version': {'name': self.version, 'protocol': self.protocol},
+            'players': {
+                'max': self.max_players,
+                'online': len(self.players),
+                'sample': [{'name': name, 'id': _offline_uuid(name)} for name in self.players[:12]],
+            },
+            'description': {'text': self.motd},
+            'enforcesSecureChat': False,
+        }
+
+    def respond(self, command):
+        """Returns the response to a command, from `responses` (by the command or its first word) or like vanilla."""
+        name = command.split(maxsplit=1)[0] if command.strip() else ''
+        response = self.responses.get(command, self.responses.get(name))
+        if response is not None:
+            return response(command) if callable(response) else response
+
+        if name == 'list':
+            return (f'There are {len(self.players)} of a max of {self.max_players} players online: '
+                    + ', '.join(self.players))
+        if name in ('say', 'tellraw', 'title'):
+            return ''
+        if name == 'save-all':
+            return 'Saving the game (this may take a moment!)Saved the game'
+        if name == 'save-off':
+            return 'Automatic saving is now disabled'
+        if name == 'save-on':
+            return 'Automatic saving is now enabled'
+        if name == 'stop':
+            return 'Stopping the server'
+        return f'Unknown or incomplete command, see below for error{command}<--[HERE]'
+
+    async def _read_rcon_packet(self, reader):
+        """Reads an RCON packet without its length, or returns None when the connection is to be dropped."""
+        if self.pipelining:
+            length, = struct.unpack('<i', await reader.readexactly(4))
+            return await reader.readexactly(length) if length >= rcon.PACKET_OVERHEAD else None
+
+        data = await reader.read(VANILLA_READ_SIZE)
+        if not data:
+            return None  # The client went away
+        if len(data) < 4 + rcon.PACKET_OVERHEAD or struct.unpack('<i', data[:4])[0] != len(data) - 4:
+            self.rejected_reads += 1
+            logging.debug("Mock server dropping the RCON connection, a read held %d bytes", len(data))
+            return None
+        return data[4:]
+
+    async def _serve_rcon(self, reader, writer):
+        self.writers.add(writer)
+        logged_in = False
+        try:
+            while True:
+                payload = await self._read_rcon_packet(reader)
+                if payload is None:
+                    break
+                request_id, packet_type = struct.unpack('<ii', payload[:8])
+                body = payload[8:-2].decode('utf-8', errors='replace')
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+
+                if packet_type == rcon.PACKET_LOGIN:
+                    logged_in = body == self.password
+                    self.rcon_logins += logged_in
+                    writer.write(_rcon_packet(request_id if logged_in else -1, PACKET_LOGIN_RESPONSE, ''))
+                elif not logged_in:
+                    writer.write(_rcon_packet(-1, PACKET_LOGIN_RESPONSE, ''))
+                elif packet_type == rcon.PACKET_COMMAND:
+                    if self.random.random() < self.failure_rate:
+                        logging.debug("Mock server dropping the RCON connection instead of answering `%s`", body)
+                        break
+                    self.commands.append(body)
+                    response = self.respond(body)
+                    # Split like the real server does, without telling which part is the last
+                    for start in range(0, max(len(response), 1), FRAGMENT_SIZE):
+                        writer.write(_rcon_packet(request_id, rcon.PACKET_RESPONSE,
+                                                  response[start:start + FRAGMENT_SIZE]))
+                else:
+                    writer.write(_rcon_packet(request_id, rcon.PACKET_RESPONSE, f'Unknown request {packet_type:x}'))
+                await writer.drain()
+
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass  # The client went away
+
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    async def _serve_status(self, reader, writer):
+        self.writers.add(writer)
+        try:
+            packet_id, data = await slp.read_packet(reader)
+            _, offset = slp.unpack_varint(data)  # The client's protocol version
+            _, offset = slp.unpack_string(data, offset)  # The address and port it connected to
+            state, _ = slp.unpack_varint(data, offset + 2)
+            if packet_id != slp.PACKET_HANDSHAKE or state != slp.STATE_STATUS:
+                return  # Joining is not supported
+
+            while True:
+                packet_id, data = await slp.read_packet(reader)
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+
+                if packet_id == slp.PACKET_STATUS:
+                    self.status_requests += 1
+                    writer.write(slp.pack_packet(slp.PACKET_STATUS, slp.pack_string(json.dumps(self.status()))))
+                elif packet_id == slp.PACKET_PING:
+                    writer.write(slp.pack_packet(slp.PACKET_PING, data))
+                    await writer.drain()
+                    return  # The real server closes the connection after the pong as well
+                await writer.drain()
+
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass  # The client went away or sent something else than a Server List Ping
+
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs a stand-in Minecraft server serving RCON and the '
+                                                 'Server List Ping, to test the bot without a real server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=25565, help='the Server List Ping port (default 25565)')
+    parser.add_argument('--rcon-port', type=int, default=25575, help='the RCON port (default 25575)')
+    parser.add_argument('--password', default='', help='the RCON password')
+    parser.add_argument('--players', nargs='*', default=[], help='the names of the players online')
+    parser.add_argument('--latency', type=float, default=0, help='milliseconds every answer is delayed')
+    parser.add_argument('--failure-rate', type=float, default=0,
+                        help='the chance (0 to 1) the connection is dropped instead of answering a command')
+    parser.add_argument('--pipelining', action='store_true',
+                        help='reads RCON as a byte stream, instead of a single packet per read like vanilla')
+    args = parser.parse_args()
+
+    async def serve():
+        server = MockServer(args.password, host=args.host, port=args.port, rcon_port=args.rcon_port,
+                            players=args.players, latency=args.latency / 1000, failure_rate=args.failure_rate,
+                            pipelining=args.pipelining)
+        async with server:
+            logging.info("Mock server listening on %s, Server List Ping on port %d and RCON on port %d",
+                         server.host, server.port, server.rcon_port)
+            await asyncio.Event().wait()
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
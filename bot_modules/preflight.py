@@ -0,0 +1,241 @@
+"""
+preflight.py
+
+Version: 1.3.0
+
+This module estimates how much disk space and time creating or restoring a snapshot
+takes, before it starts. The world folders are walked with `os.scandir` (a level of
+folders at a time, in parallel), snapshots are measured from their manifest or the
+central directory of their archive, and the result is compared to the free space on
+the disk, so a job that would fill the disk halfway through is refused up front.
+
+Functions:
+    - _scan_folder(path): (Internal) Lists the files and subfolders of a single folder.
+    - scan_sizes(folders, base_path): Walks folders in parallel, returning the size and modification time of every file.
+    - _archive_size(archive_path): (Internal) Sums the uncompressed size of a zip archive from its central directory.
+    - _history(): (Internal) Fetches the compression ratio and throughput of recent snapshots.
+    - estimate_create(source_folders, parent_id, freeze_method): Estimates what creating a snapshot takes.
+    - estimate_restore(snapshot, source_folders, select, freeze_method): Estimates what restoring
+      (a part of) a snapshot takes, including the snapshot made beforehand.
+    - check_space(estimate): Returns the disk space missing for an estimate, by path.
+    - describe(estimate): Describes an estimate in a line of text for Discord.
+    - space_embed(estimate, missing): Drafts the message refusing a job for lack of space.
+
+Attributes:
+    - conn: The SQLite connection to the database.
+    - c: The cursor object for executing SQL commands.
+    - MIN_FREE_SPACE: How many bytes must stay free on the disk once a job is done.
+    - SCAN_WORKERS: How many folders are scanned in parallel.
+    - HISTORY_SIZE: How many recent snapshots the compression ratio and throughput are taken from.
+
+Notes:
+    - Estimates are upper bounds: incremental and deduplicated snapshots are assumed to
+      compress their changed files as well as recent snapshots did, without region deltas
+      or deduplication.
+    - Restores are assumed to run as fast as recent restores did (see progress.py), or as
+      fast as snapshots are archived before the first one.
+"""
+
+
+# Standard library imports
+import asyncio
+import configparser
+import os
+import shutil
+import sqlite3
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Third-party imports
+import discord
+
+# First-party imports
+from bot_modules import freeze
+
+
+script_path = Path(__file__).resolve().parent
+root_path = script_path.parent
+db_path = root_path / 'minecraft_manager.db'
+config_path = root_path / 'config.cfg'
+snapshots_path = root_path / 'snapshots'
+frozen_path = snapshots_path / 'frozen'
+restore_path = root_path.parent / '.restore'
+
+config = configparser.ConfigParser()
+config.read(config_path)
+
+MIN_FREE_SPACE = config.getint('Snapshots', 'min_free_space', fallback=1024) * 1024 * 1024  # In MB
+SCAN_WORKERS = min(8, os.cpu_count() or 1)
+HISTORY_SIZE = 10
+
+conn = sqlite3.connect(db_path)
+conn.row_factory = sqlite3.Row
+c = conn.cursor()
+
+
+def _scan_folder(path):
+    files, folders = [], []
+    with os.scandir(path) as scanner:
+        for item in scanner:
+            if item.is_dir(follow_symlinks=False):
+                folders.append(item.path)
+            else:
+                stat = item.stat()  # Served from the directory listing itself on Windows
+                files.append((item.path, stat.st_size, stat.st_mtime_ns))
+
+    return files, folders
+
+
+def scan_sizes(folders, base_path):
+    """
+    Walks the given folders, returning the size and modification time of every file below them.
+
+    Paths are relative to `base_path`, like in snapshot manifests. Every level of subfolders is
+    scanned in parallel, which pays off for worlds with many region folders on SSDs.
+    """
+    sizes = {}
+    level = [str(folder) for folder in folders if Path(folder).is_dir()]
+
+    with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as executor:
+        while level:
+            next_level = []
+            for files, subfolders in executor.map(_scan_folder, level):
+                for path, size, mtime in files:
+                    sizes[Path(os.path.relpath(path, base_path)).as_posix()] = (size, mtime)
+                next_level += subfolders
+            level = next_level
+
+    return sizes
+
+
+def _archive_size(archive_path):
+    with zipfile.ZipFile(archive_path) as archive:
+        return sum(info.file_size for info in archive.infolist())
+
+
+def _history():
+    """
+    Returns the share of their size recent snapshots were compressed to, and how many bytes per
+    second were archived and restored (None when unknown).
+    """
+    c.execute('''SELECT SUM(bytes_in) AS bytes_in, SUM(bytes_out) AS bytes_out, SUM(duration) AS duration
+                 FROM (SELECT bytes_in, bytes_out, duration FROM snapshots
+                       WHERE bytes_in > 0 AND duration > 0 ORDER BY id DESC LIMIT ?)''', (HISTORY_SIZE,))
+    row = c.fetchone()
+    if not row['bytes_in']:
+        return 1.0, None, None
+
+    c.execute('''SELECT AVG(restore_throughput) FROM (SELECT restore_throughput FROM snapshots
+                 WHERE restore_throughput > 0 ORDER BY id DESC LIMIT ?)''', (HISTORY_SIZE,))
+    throughput = row['bytes_in'] / row['duration']
+    return min(1.0, row['bytes_out'] / row['bytes_in']), throughput, c.fetchone()[0] or throughput
+
+
+async def estimate_create(source_folders, parent_id=None, freeze_method=None):
+    """
+    Estimates the disk space and time a new snapshot of the given world folders takes.
+
+    `parent_id` is the snapshot an incremental snapshot is based on, `freeze_method` how the world
+    is frozen into a copy first (None when it is not, see freeze.py). Returns a dict with the
+    `world_size`, the bytes `changed` since the parent snapshot (all of them for a full snapshot),
+    the bytes `needed` per folder they are written to and the estimated `seconds`.
+    """
+    server_path = root_path.parent
+    parent_files = None
+    if parent_id is not None:
+        c.execute("SELECT path, size, mtime FROM snapshot_files WHERE snapshot_id=?", (parent_id,))
+        parent_files = {row['path']: (row['size'], row['mtime']) for row in c.fetchall()}
+
+    world = await asyncio.to_thread(scan_sizes, source_folders, server_path)
+    world_size = sum(size for size, _ in world.values())
+    if parent_files is None:
+        changed = world_size
+    else:
+        changed = sum(size for path, (size, mtime) in world.items() if parent_files.get(path) != (size, mtime))
+
+    frozen_size = 0
+    if freeze_method == 'copy':
+        frozen_size = world_size
+    elif freeze_method == 'hardlink':
+        # Only files changed since the previous frozen copy are copied, the rest is linked
+        previous = freeze.latest_tree(frozen_path)
+        linked = await asyncio.to_thread(scan_sizes, [previous], previous) if previous else {}
+        frozen_size = sum(size for path, (size, mtime) in world.items() if linked.get(path) != (size, mtime))
+
+    ratio, throughput, _ = _history()
+    return {
+        'world_size': world_size,
+        'changed': changed,
+        'needed': {frozen_path: frozen_size, snapshots_path: int(changed * ratio)},
+        'seconds': changed / throughput if throughput else None,
+    }
+
+
+async def estimate_restore(snapshot, source_folders, select=None, freeze_method=None):
+    """
+    Estimates the disk space and time restoring a snapshot takes, including the snapshot of the
+    `source_folders` made beforehand.
+
+    `select` works like for `snapshots.restore_files`. Returns a dict like `estimate_create`, whose
+    `changed` bytes are the ones rebuilt from the snapshot.
+    """
+    c.execute("SELECT path, size FROM snapshot_files WHERE snapshot_id=?", (snapshot['id'],))
+    rows = c.fetchall()
+    if rows:
+        restored = sum(row['size'] for row in rows if select is None or select(row['path']))
+    else:
+        # Snapshots from before manifests were recorded
+        restored = await asyncio.to_thread(_archive_size, snapshot['path'])
+
+    estimate = await estimate_create(source_folders, None, freeze_method)
+    _, _, throughput = _history()
+
+    estimate['changed'] = restored
+    estimate['needed'][restore_path] = restored
+    estimate['seconds'] = estimate['seconds'] + restored / throughput if throughput else None
+    return estimate
+
+
+def check_space(estimate):
+    """
+    Compares an estimate to the free space on the disks it writes to.
+
+    Returns how many bytes are missing by path, empty when everything fits with `min_free_space` to spare.
+    """
+    disks = {}
+    for path, needed in estimate['needed'].items():
+        existing = next(parent for parent in [path, *path.parents] if parent.exists())
+        device = existing.stat().st_dev
+        disk = disks.setdefault(device, {'path': existing, 'needed': 0})
+        disk['needed'] += needed
+
+    missing = {}
+    for disk in disks.values():
+        free = shutil.disk_usage(disk['path']).free
+        if disk['needed'] + MIN_FREE_SPACE > free:
+            missing[disk['path']] = disk['needed'] + MIN_FREE_SPACE - free
+
+    return missing
+
+
+def describe(estimate):
+    """Describes the size and estimated duration of a job in a line of text."""
+    needed = sum(estimate['needed'].values())
+    text = (f":bar_chart: {round(estimate['changed'] / (1024 * 1024), 2)} MB to process, "
+            f"up to {round(needed / (1024 * 1024), 2)} MB of disk space")
+    if estimate['seconds'] is not None:
+        text += f", about {max(1, round(estimate['seconds']))} s"
+    return f'{text}.'
+
+
+def space_embed(estimate, missing):
+    """Drafts the message refusing to start a job that would fill the disk."""
+    missing_text = '\n'.join(f'{round(size / (1024 * 1024), 2)} MB more is needed on the disk of `{path}`.'
+                             for path, size in missing.items())
+    return discord.Embed(
+        title=':x: Not Enough Disk Space!',
+        description=f'{describe(estimate)}\n{missing_text}\n'
+                    f'Free up some space, for example by deleting old snapshots, and try again.',
+        color=discord.Color.red()
+    )
@@ -0,0 +1,125 @@
+"""
+progress.py
+
+Version: 1.3.0
+
+This module reports the progress of long snapshot jobs (creating, restoring and
+downloading snapshots) in Discord. The threads doing the work count the bytes they
+processed, while a background task edits the job's message with the percentage done,
+the throughput and the estimated time left.
+
+Functions:
+    - _report(tracker, message, embed): (Internal) Edits a message with the progress of a job until cancelled.
+    - reporting(message, embed): Reports the progress of the job run inside the block in a message.
+
+Classes:
+    - Progress: Counts the bytes a job processed, from any thread.
+
+Attributes:
+    - PROGRESS_INTERVAL: How many seconds pass between edits of a progress message.
+
+Notes:
+    - Discord limits how often a message can be edited, so progress is only reported
+      every `progress_interval` seconds (5 by default), and never for jobs done sooner.
+"""
+
+
+# Standard library imports
+import asyncio
+import configparser
+import contextlib
+import logging
+import threading
+import time
+from pathlib import Path
+
+# Third-party imports
+import discord
+
+
+script_path = Path(__file__).resolve().parent
+root_path = script_path.parent
+config_path = root_path / 'config.cfg'
+
+config = configparser.ConfigParser()
+config.read(config_path)
+
+PROGRESS_INTERVAL = max(1, config.getint('Snapshots', 'progress_interval', fallback=5))
+
+
+class Progress:
+    """
+    Counts the bytes a job processed, from any thread.
+
+    Call it with the size of every block or file done. `total` is the number of bytes the job
+    will process, it can be set once known (None until then).
+    """
+
+    def __init__(self, total=None):
+        self.total = total
+        self.done = 0
+        self.lock = threading.Lock()
+        self.start_time = time.monotonic()
+        self.end_time = None
+
+    def __call__(self, size):
+        with self.lock:
+            self.done += size
+
+    @property
+    def seconds(self):
+        """How many seconds the job has been running, or ran for once finished."""
+        return (self.end_time or time.monotonic()) - self.start_time
+
+    @property
+    def throughput(self):
+        """How many bytes per second were processed on average, None before anything was done."""
+        seconds = self.seconds
+        return self.done / seconds if self.done and seconds > 0 else None
+
+    def describe(self):
+        """Describes the progress in a line of text, with the percentage done, MB/s and the time left."""
+        text = f':hourglass_flowing_sand: {round(self.done / (1024 * 1024), 2)} MB'
+        if self.total:
+            text += f' of {round(self.total / (1024 * 1024), 2)} MB ({min(100, 100 * self.done // self.total)}%)'
+
+        throughput = self.throughput
+        if throughput:
+            text += f', {round(throughput / (1024 * 1024), 2)} MB/s'
+            if self.total and self.total > self.done:
+                text += f', about {max(1, round((self.total - self.done) / throughput))} s left'
+        return text
+
+
+async def _report(tracker, message, embed):
+    while True:
+        await asyncio.sleep(PROGRESS_INTERVAL)
+        if tracker.total is None and not tracker.done:
+            continue  # Nothing to tell yet, e.g. for jobs that cannot count their bytes
+
+        progress_embed = embed.copy()
+        progress_embed.description = f'{embed.description or ""}\n{tracker.describe()}'
+        try:
+            await message.edit(embed=progress_embed)
+        except discord.HTTPException as e:
+            logging.debug("Failed to report progress: %s", e)  # Reported again with the next update
+
+
+@contextlib.asynccontextmanager
+async def reporting(message, embed):
+    """
+    Reports the progress of the job run inside the block by editing `message`.
+
+    Yields a `Progress` to pass to the job. Its line is added below the description of
+    `embed`, every `progress_interval` seconds, until the block is left.
+    """
+    tracker = Progress()
+    task = asyncio.create_task(_report(tracker, message, embed))
+
+    try:
+        yield tracker
+    finally:
+        tracker.end_time = time.monotonic()
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
@@ -0,0 +1,368 @@
+"""
+rcon.py
+
+Version: 1.3.0
+
+This module talks to the Minecraft server over RCON. It keeps a small pool of logged in
+connections on asyncio streams, so sending a command takes a single round trip instead
+of a new TCP connection and login, and a slow server never blocks the event loop the
+Discord bot runs on. A connection has one command in flight at a time, further commands
+wait for it, or go over another connection of the pool. With `rcon_pipelining` enabled,
+for servers that read RCON as a byte stream, many commands can be in flight on one
+connection, matched to their responses by request id, so a script is sent in one burst.
+Responses the server splits across several packets are joined back together, using an
+empty marker packet sent after the first part.
+
+Functions:
+    - parse_script(script): Splits a script into the commands it holds, one per line.
+    - send_command(command, timeout): Sends a command to the server and returns its response.
+    - send_batch(commands, timeout): Sends several commands over one connection and returns the response to each.
+
+Classes:
+    - RconError: Raised when the server cannot be reached, refuses the password or drops the connection.
+    - RconConnection: A single logged in RCON connection, with one (or, pipelining, any number of) commands in flight.
+    - RconPool: Sends commands over the least busy connection, (re)connecting with backoff when needed.
+
+Attributes:
+    - RCON_HOST: The host address for the Minecraft server RCON.
+    - RCON_PORT: The port for the Minecraft server RCON.
+    - RCON_PASSWORD: The password for the Minecraft server RCON.
+    - RCON_POOL_SIZE: How many connections are kept open at most.
+    - RCON_TIMEOUT: How many seconds a command may take by default, connecting included.
+    - RCON_PIPELINING: Whether several commands may be in flight on one connection.
+    - pool: The connection pool all RCON commands of the bot share.
+
+Notes:
+    - Connections the server closed (e.g. because it restarted) are replaced when next needed.
+      A command is never sent twice, a connection failing halfway raises an RconError.
+    - The vanilla server reads a single packet per read of the socket (at most 1460 bytes), and
+      closes the connection when that holds more or less than one packet. Packets sent right
+      after each other can arrive together, so without pipelining a packet is only sent when
+      the connection has nothing else in flight.
+    - The server handles the commands of a connection in the order they were sent. When a
+      command times out while pipelining, its late response is recognised by its request id
+      and dropped. Without pipelining the connection is closed instead, as the server may still
+      be busy with it when the next command arrives.
+    - Minecraft splits responses longer than 4096 characters into several packets with the
+      same request id, with no sign of which one is the last. A packet shorter than that is
+      the last one. After a full one an empty packet is sent as a marker: the server handles
+      packets in order, so its answer comes after all parts of the response, and ends it.
+"""
+
+
+# Standard library imports
+import asyncio
+import configparser
+import logging
+import struct
+from pathlib import Path
+
+
+script_path = Path(__file__).resolve().parent
+root_path = script_path.parent
+config_path = root_path / 'config.cfg'
+
+config = configparser.ConfigParser()
+config.read(config_path)
+
+RCON_HOST = config.get('PythonConfig', 'rcon_host')
+RCON_PORT = int(config.get('PythonConfig', 'rcon_port'))
+RCON_PASSWORD = config.get('PythonConfig', 'rcon_password')
+RCON_POOL_SIZE = max(1, config.getint('PythonConfig', 'rcon_pool_size', fallback=2))
+RCON_TIMEOUT = config.getfloat('PythonConfig', 'rcon_timeout', fallback=5)
+RCON_PIPELINING = config.getboolean('PythonConfig', 'rcon_pipelining', fallback=False)
+
+# Packet types of the RCON protocol
+PACKET_LOGIN = 3
+PACKET_COMMAND = 2
+PACKET_RESPONSE = 0  # Sent empty as a marker, which the server answers after the response it follows
+# The most bytes of a response the server sends in one packet (4096 characters, so at least 4096 bytes)
+MAX_FRAGMENT_SIZE = 4096
+# Request id, type and the two null bytes ending every packet
+PACKET_OVERHEAD = 10
+# Seconds between connection attempts, doubled after every failed attempt up to the maximum
+BACKOFF_START = 0.25
+BACKOFF_MAX = 5
+
+
+class RconError(Exception):
+    """Raised when the server cannot be reached, refuses the password or drops the connection."""
+
+
+class RconConnection:
+    """
+    A single logged in RCON connection.
+
+    A background task hands every response to the request with the same request id. A response
+    that may have been split is followed up with a marker packet, whose answer means it arrived
+    completely. Packets are sent one at a time, each after the previous one was answered, unless
+    `pipelining` is set: then they are written without waiting for the previous response.
+    """
+
+    def __init__(self, reader, writer, pipelining=False):
+        self.reader = reader
+        self.writer = writer
+        self.pipelining = pipelining
+        self.lock = asyncio.Lock()  # Held by the request in flight, when not pipelining
+        self.requests = 0  # Requests in flight or waiting for the lock
+        self.last_id = 0
+        self.pending = {}  # Future and packets received so far of the requests waiting for a response, by request id
+        self.markers = {}  # Request id of the command each marker packet follows, by request id of the marker
+        self.reader_task = asyncio.create_task(self._read_responses())
+
+    @classmethod
+    async def open(cls, host, port, password, pipelining=False):
+        """Connects and logs in, raising an RconError when the password is refused."""
+        reader, writer = await asyncio.open_connection(host, port)
+        connection = cls(reader, writer, pipelining)
+        try:
+            request_id, _ = (await connection.request([(PACKET_LOGIN, password)]))[0]
+            if request_id == -1:
+                raise RconError("The server refused the RCON password")
+        except BaseException:
+            connection.close()
+            raise
+
+        return connection
+
+    @property
+    def closed(self):
+        """Whether the connection was closed, by either side."""
+        return self.writer.is_closing() or self.reader_task.done()
+
+    async def _read_packet(self):
+        try:
+            length, = struct.unpack('<i', await self.reader.readexactly(4))
+            if length < PACKET_OVERHEAD:
+                raise RconError(f"The server sent an invalid RCON packet ({length} bytes)")
+            payload = await self.reader.readexactly(length)
+        except asyncio.IncompleteReadError as e:
+            raise RconError("The server closed the RCON connection") from e
+
+        request_id, _ = struct.unpack('<ii', payload[:8])
+        return request_id, payload[8:-2]
+
+    def _next_id(self):
+        self.last_id = self.last_id % 0x7FFFFFFF + 1
+        return self.last_id
+
+    def _resolve(self, request_id):
+        """Hands the packets received for a request to it, as a single response."""
+        future, parts = self.pending.pop(request_id, (None, None))
+        if future is not None and not future.done():
+            # Joined before decoding, a character may be split across two packets
+            future.set_result((request_id, b''.join(parts).decode('utf-8', errors='replace')))
+
+    async def _read_responses(self):
+        """Hands every response to the request it answers, until the connection is closed."""
+        error = RconError("The RCON connection was closed")
+        try:
+            while True:
+                request_id, body = await self._read_packet()
+                if request_id in self.markers:
+                    # Everything the command's response was split into came before
+                    self._resolve(self.markers.pop(request_id))
+                elif request_id == -1 and self.pending:
+                    # A refused login is answered with -1 instead of its request id
+                    future, _ = self.pending.pop(next(iter(self.pending)))
+                    if not future.done():
+                        future.set_result((request_id, ''))
+                elif request_id in self.pending:
+                    self.pending[request_id][1].append(body)
+                    if len(body) < MAX_FRAGMENT_SIZE:
+                        self._resolve(request_id)
+                    elif request_id not in self.markers.values():
+                        # More parts may follow, the marker's answer comes after the last one
+                        marker_id = self._next_id()
+                        self.markers[marker_id] = request_id
+                        self.writer.write(self._packet(marker_id, PACKET_RESPONSE, ''))
+                # Responses nobody waits for any more (the request timed out) are dropped
+
+        except (RconError, OSError) as e:
+            error = e if isinstance(e, RconError) else RconError(f"The RCON connection failed: {e}")
+
+        finally:
+            for future, _ in self.pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self.pending.clear()
+            self.markers.clear()
+            self.writer.close()
+
+    async def request(self, packets):
+        """
+        Sends packets, as `(packet_type, body)` pairs, and returns the request id and body of the
+        response to each.
+
+        Each response is complete however many packets the server splits it into. When pipelining
+        the packets are sent in one go, otherwise one after the other.
+        """
+        self.requests += 1
+        try:
+            if self.pipelining:
+                return await self._send(packets)
+
+            responses = []
+            for packet in packets:
+                async with self.lock:
+                    responses += await self._send([packet])
+            return responses
+        finally:
+            self.requests -= 1
+
+    async def _send(self, packets):
+        loop = asyncio.get_running_loop()
+        request_ids = []
+        data = bytearray()
+        for packet_type, body in packets:
+            request_id = self._next_id()
+            data += self._packet(request_id, packet_type, body)
+            self.pending[request_id] = (loop.create_future(), [])
+            request_ids.append(request_id)
+
+        futures = [self.pending[request_id][0] for request_id in request_ids]
+        try:
+            self.writer.write(data)
+            await self.writer.drain()
+            return list(await asyncio.gather(*futures))
+        finally:
+            for request_id, future in zip(request_ids, futures):
+                self.pending.pop(request_id, None)
+                future.cancel()
+
+    @staticmethod
+    def _packet(request_id, packet_type, body):
+        payload = struct.pack('<ii', request_id, packet_type) + body.encode('utf-8') + b'\x00\x00'
+        return struct.pack('<i', len(payload)) + payload
+
+    async def commands(self, commands):
+        """Sends commands in order (at once when pipelining), and returns the server's response to each."""
+        return [response for _, response in await self.request([(PACKET_COMMAND, command) for command in commands])]
+
+    def close(self):
+        """Closes the connection."""
+        self.writer.close()
+        self.reader_task.cancel()
+
+
+class RconPool:
+    """
+    Keeps up to `size` logged in connections open, sending every command over the least busy one.
+
+    Connections are opened when needed, when all open ones have commands in flight, after that
+    commands wait for the connection they were given. Failed attempts are retried with
+    exponential backoff, until the command times out.
+    """
+
+    def __init__(self, host, port, password, size, pipelining=False):
+        self.host = host
+        self.port = port
+        self.password = password
+        self.size = size
+        self.pipelining = pipelining
+        self.connections = []
+        self.lock = asyncio.Lock()
+        self.last_error = None
+
+    async def _connect(self):
+        delay = BACKOFF_START
+        while True:
+            try:
+                connection = await RconConnection.open(self.host, self.port, self.password, self.pipelining)
+                self.last_error = None
+                return connection
+            except OSError as e:  # E.g. the server is still starting
+                self.last_error = e
+                logging.debug("Failed to connect over RCON, retrying in %.2f s: %s", delay, e)
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, BACKOFF_MAX)
+
+    async def _acquire(self):
+        async with self.lock:
+            # Closed by the server in the meantime, e.g. because it restarted
+            self.connections = [connection for connection in self.connections if not connection.closed]
+
+            least_busy = min(self.connections, key=lambda connection: connection.requests, default=None)
+            if least_busy is not None and (not least_busy.requests or len(self.connections) >= self.size):
+                return least_busy
+
+            connection = await self._connect()
+            self.connections.append(connection)
+            return connection
+
+    async def batch(self, commands, timeout):
+        """
+        Sends commands over a single connection and returns the response to each.
+
+        Raises an RconError when the server cannot be reached or drops the connection, and a
+        TimeoutError when it does not answer all commands within `timeout` seconds.
+        """
+        try:
+            connection = await asyncio.wait_for(self._acquire(), timeout)
+        except asyncio.TimeoutError as e:
+            raise RconError(f"Could not connect to the server over RCON: {self.last_error or 'timed out'}") from e
+
+        try:
+            return await asyncio.wait_for(connection.commands(commands), timeout)
+        except asyncio.TimeoutError as e:
+            if not connection.pipelining:
+                # The server may still be busy with the command, the next one must not arrive meanwhile
+                connection.close()
+            # Otherwise the connection stays usable, late responses are recognised by their request id and dropped
+            what = f'`{commands[0]}`' if len(commands) == 1 else f'{len(commands)} commands'
+            raise TimeoutError(f"The server did not answer {what} within {timeout} s") from e
+        except OSError as e:
+            connection.close()
+            raise RconError(f"The RCON connection failed: {e}") from e
+
+    async def command(self, command, timeout):
+        """Sends a single command and returns the response, raising like `batch`."""
+        return (await self.batch([command], timeout))[0]
+
+    def close(self):
+        """Closes every connection, new ones are opened when the next command is sent."""
+        for connection in self.connections:
+            connection.close()
+        self.connections = []
+
+
+pool = RconPool(RCON_HOST, RCON_PORT, RCON_PASSWORD, RCON_POOL_SIZE, RCON_PIPELINING)
+
+
+def parse_script(script):
+    """
+    Splits a script into the commands it holds, one per line.
+
+    Blank lines and lines starting with `#` are skipped, like in function files, and so are the
+    lines of a Discord code block's fences. A leading `/` is removed.
+    """
+    commands = []
+    for line in script.splitlines():
+        line = line.strip()
+        if not line or line.startswith(('#', '```')):
+            continue
+        commands.append(line[1:] if line.startswith('/') else line)
+    return commands
+
+
+async def send_command(command, timeout=None):
+    """
+    Sends a command to the Minecraft server over RCON and returns its response.
+
+    Raises an RconError when the server cannot be reached and a TimeoutError when it does not
+    answer within `timeout` seconds (`rcon_timeout` from config.cfg by default).
+    """
+    return await pool.command(command, timeout or RCON_TIMEOUT)
+
+
+async def send_batch(commands, timeout=None):
+    """
+    Sends several commands over a single RCON connection, in order, and returns the response to each.
+
+    With `rcon_pipelining` the commands are sent in one burst, so they take about one round trip together,
+    otherwise a round trip each. Raises like `send_command`, `timeout` applies to all of them together.
+    """
+    if not commands:
+        return []
+    return await pool.batch(list(commands), timeout or RCON_TIMEOUT)
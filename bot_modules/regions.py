@@ -0,0 +1,173 @@
+"""
+regions.py
+
+Version: 1.3.0
+
+This module houses the chunk level delta engine for Anvil region files (`.mca`).
+A region file holds up to 1024 chunks, and its 8 KiB header stores where every chunk
+lives and when it was last saved. Saving a single chunk changes the whole file, so
+incremental snapshots use this module to store only the chunks that were saved since
+the parent snapshot.
+
+Functions:
+    - make_delta(region_path, base_header): Extracts the chunks changed since `base_header`.
+    - apply_delta(base, delta): Rebuilds a valid region file from its base version and a delta.
+    - delta_header(delta): Returns the region header stored in a delta.
+    - packed_hash(region_path): Returns the hash of a region file as `apply_delta` would rebuild it.
+
+Attributes:
+    - HEADER_SIZE: The size of a region file header.
+    - DELTA_MAGIC: The first bytes of every delta, followed by the full header of the
+      new region file and the changed chunks.
+
+Notes:
+    - A chunk counts as unchanged when it existed in the base and its timestamp in the
+      header did not change. Minecraft updates the timestamp every time a chunk is saved.
+    - Rebuilt region files contain the same chunks and timestamps as the original, but
+      chunks are packed one after another, so the bytes may differ from the original file.
+      `packed_hash` gives the hash to check a rebuilt file against instead.
+"""
+
+
+# Standard library imports
+import hashlib
+import mmap
+import struct
+
+
+SECTOR_SIZE = 4096
+CHUNK_COUNT = 1024
+HEADER_SIZE = 2 * SECTOR_SIZE
+DELTA_MAGIC = b'MCAD\x01'
+
+
+def _parse_header(header):
+    """Returns the (sector offset, sector count) of every chunk and their timestamps."""
+    locations = [(entry >> 8, entry & 0xFF) for entry in struct.unpack_from('>1024I', header, 0)]
+    timestamps = struct.unpack_from('>1024I', header, SECTOR_SIZE)
+    return locations, timestamps
+
+
+def _chunk_payload(region, location):
+    """Returns the stored chunk (length, compression type and data) at a header location."""
+    offset = location[0] * SECTOR_SIZE
+    if offset < HEADER_SIZE or offset + 4 > len(region):
+        raise ValueError(f"Chunk location {location} lies outside the region file")
+
+    length = struct.unpack_from('>I', region, offset)[0]
+    if length == 0 or offset + 4 + length > len(region):
+        raise ValueError(f"Chunk at sector {location[0]} has an invalid length")
+
+    return bytes(region[offset:offset + 4 + length])
+
+
+def _pack(locations, timestamps, payload):
+    """
+    Packs the chunks of a region file one after another, in the order they had in the original.
+
+    `payload` returns the stored chunk of an index. Returns the parts of the new region file,
+    the header followed by every chunk padded to whole sectors.
+    """
+    present = sorted((location[0], index) for index, location in enumerate(locations) if location[0] != 0)
+    new_locations = [0] * CHUNK_COUNT
+    body = []
+    sector = HEADER_SIZE // SECTOR_SIZE
+
+    for _, index in present:
+        data = payload(index)
+        sector_count = -(-len(data) // SECTOR_SIZE)
+        if sector_count > 0xFF:
+            raise ValueError(f"Chunk {index} is too large for a region file")
+
+        new_locations[index] = (sector << 8) | sector_count
+        body.append(data.ljust(sector_count * SECTOR_SIZE, b'\0'))
+        sector += sector_count
+
+    return [struct.pack('>1024I', *new_locations), struct.pack('>1024I', *timestamps), *body]
+
+
+def make_delta(region_path, base_header):
+    """
+    Creates a delta holding only the chunks saved after `base_header` was written.
+
+    The region file is read through mmap, so only the header and the changed chunks are
+    touched. Returns None when the file is not a usable region file (e.g. still empty),
+    in which case it should be stored as a whole.
+    """
+    with open(region_path, 'rb') as file:
+        if file.seek(0, 2) < HEADER_SIZE or len(base_header) < HEADER_SIZE:
+            return None
+
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as region:
+            locations, timestamps = _parse_header(region)
+            base_locations, base_timestamps = _parse_header(base_header)
+            parts = [DELTA_MAGIC, bytes(region[:HEADER_SIZE])]
+
+            try:
+                for index in range(CHUNK_COUNT):
+                    if locations[index][0] == 0:
+                        continue  # Chunk was never generated, or has been removed
+                    if base_locations[index][0] != 0 and base_timestamps[index] == timestamps[index]:
+                        continue  # Chunk has not been saved since the base
+
+                    payload = _chunk_payload(region, locations[index])
+                    parts.append(struct.pack('>HI', index, len(payload)))
+                    parts.append(payload)
+            except ValueError:
+                return None
+
+    return b''.join(parts)
+
+
+def delta_header(delta):
+    """Returns the header of the new region file stored at the start of a delta."""
+    if not delta.startswith(DELTA_MAGIC):
+        raise ValueError("Not a region delta")
+    return delta[len(DELTA_MAGIC):len(DELTA_MAGIC) + HEADER_SIZE]
+
+
+def apply_delta(base, delta):
+    """
+    Rebuilds a region file from the bytes of its base version and a delta created by `make_delta`.
+
+    Chunks missing from the delta are taken from the base. The result is a valid region file
+    with a freshly packed location table and the timestamps of the delta.
+    """
+    header = delta_header(delta)
+    locations, timestamps = _parse_header(header)
+
+    changed = {}
+    position = len(DELTA_MAGIC) + HEADER_SIZE
+    while position < len(delta):
+        index, length = struct.unpack_from('>HI', delta, position)
+        position += 6
+        changed[index] = delta[position:position + length]
+        position += length
+
+    base_locations = _parse_header(base)[0] if base is not None and len(base) >= HEADER_SIZE else None
+
+    def payload(index):
+        if index in changed:
+            return changed[index]
+        if base_locations is None or base_locations[index][0] == 0:
+            raise ValueError(f"Chunk {index} is missing from both the delta and its base")
+        return _chunk_payload(base, base_locations[index])
+
+    return b''.join(_pack(locations, timestamps, payload))
+
+
+def packed_hash(region_path):
+    """
+    Returns the SHA-256 hash of a region file packed the way `apply_delta` rebuilds it.
+
+    A file rebuilt from a chain of deltas must match the hash of the original file taken
+    when the last delta was created, otherwise a chunk was lost or mixed up on the way.
+    """
+    file_hash = hashlib.sha256()
+    with open(region_path, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as region:
+            locations, timestamps = _parse_header(region)
+            for part in _pack(locations, timestamps, lambda index: _chunk_payload(region, locations[index])):
+                file_hash.update(part)
+
+    return file_hash.hexdigest()
\ No newline at end of file
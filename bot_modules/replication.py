@@ -0,0 +1,602 @@
+"""
+replication.py
+
+Version: 1.3.0
+
+This module copies snapshots to a second place, so they survive the disk (or machine)
+the world is on. The target is another folder, an SFTP server or an S3 compatible object
+store (AWS S3, MinIO, Backblaze B2, ...). Snapshots are uploaded as regular zip archives,
+in parts, several parts at a time and within a bandwidth limit. Every part is recorded
+once uploaded, so an interrupted upload resumes where it stopped. Whether and when every
+snapshot was replicated is recorded in the `snapshots` table, and `$snapshots replication`
+reports how far the target is behind.
+
+Functions:
+    - open_target(target): Opens the replication target a path or URL points at.
+    - _read_part(path, offset, size, throttle): (Internal) Reads a part of a file within the bandwidth limit.
+    - _upload_part(target, upload, source_path, number, offset, size, throttle): (Internal) Reads and uploads a part.
+    - _source_path(snapshot): (Internal) The zip archive a snapshot is uploaded from.
+    - _forget_upload(snapshot_id): (Internal) Removes the record of an upload and its parts.
+    - _abandon_upload(target, executor, snapshot_id): (Internal) Aborts an upload, so it is started over.
+    - _remove_orphans(target, executor): (Internal) Abandons the uploads and exports of deleted snapshots.
+    - _replicate_snapshot(target, snapshot, executor, throttle): (Internal) Uploads a snapshot, resuming an
+      earlier upload of it.
+    - replicate_pending(): Uploads every snapshot that has not been replicated yet, oldest first.
+    - manage_replication(ctx, *args): Reports how far the target is behind, or replicates right away.
+    - replication_job(): Background task replicating new snapshots every `interval` minutes.
+    - start_replication_job(): Starts the background task, unless it is disabled or already running.
+
+Classes:
+    - LocalTarget: Replicates to another folder, e.g. on a second disk or a network share.
+    - SFTPTarget: Replicates to a folder on an SFTP server.
+    - S3Target: Replicates to a bucket of an S3 compatible object store.
+
+Attributes:
+    - conn: The SQLite connection to the database.
+    - c: The cursor object for executing SQL commands.
+    - replication_path: The folder snapshots without an archive of their own are exported to.
+    - REPLICATION_ENABLED: Whether snapshots are replicated in the background.
+    - REPLICATION_TARGET: Where snapshots are replicated to, a folder, `sftp://` or `s3://` URL.
+    - REPLICATION_INTERVAL: How many minutes pass between background runs.
+    - REPLICATION_WORKERS: How many parts are uploaded in parallel.
+    - PART_SIZE: How many bytes are uploaded per part, at least.
+    - REPLICATION_BANDWIDTH: How many bytes per second may be uploaded, 0 for no limit.
+
+Notes:
+    - Deduplicated and incremental snapshots are exported to a self-contained zip archive
+      first, so every replica can be restored on its own, without this bot's database.
+    - Replicas are kept when snapshots are deleted here, the target is meant to outlive them.
+    - Targets raise a FileNotFoundError for uploads that are gone (e.g. a removed `.partial`
+      file or an aborted multipart upload), which are then started over.
+    - SFTP needs the optional `paramiko` package, and S3 the optional `boto3` package. The
+      host key of an SFTP server must be known already (connect to it with `ssh` once).
+"""
+
+
+# Standard library imports
+import asyncio
+import configparser
+import contextlib
+import logging
+import os
+import posixpath
+import sqlite3
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Third-party imports
+import discord
+from discord.ext import tasks
+
+try:
+    import paramiko
+except ImportError:  # Optional, only needed for SFTP targets
+    paramiko = None
+
+try:
+    import boto3
+except ImportError:  # Optional, only needed for S3 targets
+    boto3 = None
+
+# First-party imports
+from bot_modules import integrity, progress, snapshots
+
+
+script_path = Path(__file__).resolve().parent
+root_path = script_path.parent
+db_path = root_path / 'minecraft_manager.db'
+config_path = root_path / 'config.cfg'
+replication_path = root_path / 'snapshots' / 'replication'
+
+config = configparser.ConfigParser()
+config.read(config_path)
+
+REPLICATION_ENABLED = config.getboolean('Replication', 'enabled', fallback=False)
+REPLICATION_TARGET = config.get('Replication', 'target', fallback='')
+REPLICATION_INTERVAL = config.getint('Replication', 'interval', fallback=5)
+REPLICATION_WORKERS = max(1, config.getint('Replication', 'workers', fallback=4))
+PART_SIZE = max(1, config.getint('Replication', 'part_size', fallback=16)) * 1024 * 1024  # In MB
+REPLICATION_BANDWIDTH = config.getint('Replication', 'bandwidth', fallback=0) * 1024 * 1024  # In MB per second
+
+S3_ENDPOINT_URL = config.get('Replication', 'endpoint_url', fallback='')
+S3_REGION = config.get('Replication', 'region', fallback='')
+S3_ACCESS_KEY = config.get('Replication', 'access_key', fallback='')
+S3_SECRET_KEY = config.get('Replication', 'secret_key', fallback='')
+SFTP_PASSWORD = config.get('Replication', 'password', fallback='')
+SFTP_KEY_FILE = config.get('Replication', 'key_file', fallback='')
+
+# S3 allows at most this many parts per upload, larger files get larger parts
+MAX_PARTS = 10000
+READ_SIZE = 1024 * 1024
+
+conn = sqlite3.connect(db_path)
+conn.row_factory = sqlite3.Row
+c = conn.cursor()
+
+# Uploads in progress, so they can be resumed after the bot restarts
+c.execute('''CREATE TABLE IF NOT EXISTS replication_uploads (
+                snapshot_id INTEGER PRIMARY KEY,
+                target TEXT,
+                name TEXT,
+                upload_id TEXT,
+                part_size INTEGER
+            )''')
+c.execute('''CREATE TABLE IF NOT EXISTS replication_parts (
+                snapshot_id INTEGER,
+                part INTEGER,
+                etag TEXT,
+                PRIMARY KEY (snapshot_id, part)
+            )''')
+conn.commit()
+
+# Held while replicating, so the job and the command never upload at the same time
+replication_lock = asyncio.Lock()
+# The progress of the snapshots being uploaded right now, by name
+uploads_running = {}
+
+
+class LocalTarget:
+    """
+    Replicates to another folder, e.g. on a second disk or a network share.
+
+    Parts are written into a `.partial` file at their offset, which is renamed once complete.
+    """
+
+    min_part_size = 1
+
+    def __init__(self, folder):
+        self.folder = Path(folder)
+
+    def __str__(self):
+        return str(self.folder)
+
+    def begin(self, name, size):
+        """Starts uploading a file of `size` bytes, returning the id to upload its parts to."""
+        self.folder.mkdir(parents=True, exist_ok=True)
+        partial_path = self.folder / f'{name}.partial'
+        with open(partial_path, 'wb') as file:
+            file.truncate(size)
+        return str(partial_path)
+
+    def upload_part(self, upload_id, name, number, offset, data):  # pylint: disable=unused-argument
+        """Uploads a part of a file, returning what identifies it when completing the upload."""
+        with open(upload_id, 'r+b') as file:
+            file.seek(offset)
+            file.write(data)
+        return ''
+
+    def complete(self, upload_id, name, parts):  # pylint: disable=unused-argument
+        """Completes an upload once all parts have been uploaded."""
+        with open(upload_id, 'r+b') as file:
+            os.fsync(file.fileno())
+        os.replace(upload_id, self.folder / name)
+
+    def abort(self, upload_id, name):  # pylint: disable=unused-argument
+        """Removes what was uploaded of a file."""
+        Path(upload_id).unlink(missing_ok=True)
+
+    def close(self):
+        """Closes the connections to the target."""
+
+
+class SFTPTarget:
+    """
+    Replicates to a folder on an SFTP server, at `sftp://user@host:port/folder`.
+
+    Every uploading thread opens its own session. Parts are written into a `.partial` file at
+    their offset, which is renamed once complete.
+    """
+
+    min_part_size = 1
+
+    def __init__(self, url):
+        if paramiko is None:
+            raise ValueError("Replicating over SFTP requires the `paramiko` package (`pip install paramiko`)")
+
+        parsed = urllib.parse.urlsplit(url)
+        self.host, self.port, self.username = parsed.hostname, parsed.port or 22, parsed.username
+        self.folder = urllib.parse.unquote(parsed.path) or '.'
+        self.sessions = threading.local()
+        self.clients = []
+        self.lock = threading.Lock()
+
+    def __str__(self):
+        return f'sftp://{self.host}:{self.port}{self.folder}'
+
+    def _sftp(self):
+        sftp = getattr(self.sessions, 'sftp', None)
+        if sftp is None:
+            client = paramiko.SSHClient()
+            client.load_system_host_keys()  # Unknown hosts are rejected
+            with self.lock:
+                self.clients.append(client)
+            client.connect(self.host, self.port, self.username, password=SFTP_PASSWORD or None,
+                           key_filename=SFTP_KEY_FILE or None, timeout=30)
+            sftp = self.sessions.sftp = client.open_sftp()
+        return sftp
+
+    def begin(self, name, size):
+        """Starts uploading a file of `size` bytes, returning the id to upload its parts to."""
+        sftp = self._sftp()
+        with contextlib.suppress(OSError):  # Already exists
+            sftp.mkdir(self.folder)
+
+        partial_path = posixpath.join(self.folder, f'{name}.partial')
+        with sftp.open(partial_path, 'wb') as file:
+            file.truncate(size)
+        return partial_path
+
+    def upload_part(self, upload_id, name, number, offset, data):  # pylint: disable=unused-argument
+        """Uploads a part of a file, returning what identifies it when completing the upload."""
+        with self._sftp().open(upload_id, 'r+b') as file:
+            file.set_pipelined(True)  # Writes are sent without waiting for each one to be acknowledged
+            file.seek(offset)
+            file.write(data)
+        return ''
+
+    def complete(self, upload_id, name, parts):  # pylint: disable=unused-argument
+        """Completes an upload once all parts have been uploaded."""
+        self._sftp().posix_rename(upload_id, posixpath.join(self.folder, name))
+
+    def abort(self, upload_id, name):  # pylint: disable=unused-argument
+        """Removes what was uploaded of a file."""
+        with contextlib.suppress(OSError):  # Already gone
+            self._sftp().remove(upload_id)
+
+    def close(self):
+        """Closes the connections to the target."""
+        for client in self.clients:
+            client.close()
+
+
+class S3Target:
+    """
+    Replicates to a bucket of an S3 compatible object store, at `s3://bucket/prefix`.
+
+    Files are sent as multipart uploads, which S3 keeps (unfinished) until they are completed
+    or aborted.
+    """
+
+    min_part_size = 5 * 1024 * 1024  # S3 rejects smaller parts, except for the last one
+
+    def __init__(self, url):
+        if boto3 is None:
+            raise ValueError("Replicating to S3 requires the `boto3` package (`pip install boto3`)")
+
+        parsed = urllib.parse.urlsplit(url)
+        self.bucket, self.prefix = parsed.netloc, parsed.path.strip('/')
+        # Credentials left empty are looked up the usual AWS ways (environment variables, ~/.aws, ...)
+        self.client = boto3.client('s3', endpoint_url=S3_ENDPOINT_URL or None, region_name=S3_REGION or None,
+                                   aws_access_key_id=S3_ACCESS_KEY or None,
+                                   aws_secret_access_key=S3_SECRET_KEY or None)
+
+    def __str__(self):
+        return f's3://{self.bucket}/{self.prefix}'
+
+    def _key(self, name):
+        return f'{self.prefix}/{name}' if self.prefix else name
+
+    def begin(self, name, size):  # pylint: disable=unused-argument
+        """Starts uploading a file of `size` bytes, returning the id to upload its parts to."""
+        return self.client.create_multipart_upload(Bucket=self.bucket, Key=self._key(name))['UploadId']
+
+    @contextlib.contextmanager
+    def _upload_errors(self, name):
+        """Raises a FileNotFoundError for uploads that were aborted or expired, like the other targets."""
+        try:
+            yield
+        except self.client.exceptions.NoSuchUpload as e:
+            raise FileNotFoundError(f"The upload of {name} is gone from the bucket") from e
+
+    def upload_part(self, upload_id, name, number, offset, data):  # pylint: disable=unused-argument
+        """Uploads a part of a file, returning what identifies it when completing the upload."""
+        with self._upload_errors(name):
+            response = self.client.upload_part(Bucket=self.bucket, Key=self._key(name), UploadId=upload_id,
+                                               PartNumber=number, Body=data)
+        return response['ETag']
+
+    def complete(self, upload_id, name, parts):
+        """Completes an upload once all parts have been uploaded."""
+        with self._upload_errors(name):
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket, Key=self._key(name), UploadId=upload_id,
+                MultipartUpload={'Parts': [{'PartNumber': number, 'ETag': etag}
+                                           for number, etag in sorted(parts.items())]})
+
+    def abort(self, upload_id, name):
+        """Removes what was uploaded of a file."""
+        with contextlib.suppress(self.client.exceptions.ClientError):  # Already completed or aborted
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self._key(name), UploadId=upload_id)
+
+    def close(self):
+        """Closes the connections to the target."""
+        self.client.close()
+
+
+def open_target(target):
+    """Opens the replication target `target` points at, a folder or an `sftp://` or `s3://` URL."""
+    scheme = urllib.parse.urlsplit(target).scheme.lower()
+    if scheme == 'sftp':
+        return SFTPTarget(target)
+    if scheme == 's3':
+        return S3Target(target)
+    return LocalTarget(target)  # Also Windows paths, whose drive letter looks like a scheme
+
+
+def _read_part(path, offset, size, throttle):
+    """Reads `size` bytes of a file from `offset` on, a block at a time within the bandwidth limit."""
+    data = bytearray()
+    with open(path, 'rb') as file:
+        file.seek(offset)
+        while len(data) < size:
+            block = file.read(min(READ_SIZE, size - len(data)))
+            if not block:
+                raise ValueError(f"{path.name} changed while it was being replicated")
+            throttle(len(block))
+            data += block
+
+    return bytes(data)
+
+
+def _upload_part(target, upload, source_path, number, offset, size, throttle):
+    data = _read_part(source_path, offset, size, throttle)
+    return target.upload_part(upload['upload_id'], upload['name'], number, offset, data)
+
+
+def _source_path(snapshot):
+    """Returns the zip archive a snapshot is uploaded from, exported for snapshots that are not complete themselves."""
+    if snapshot['storage'] == 'store' or snapshot['kind'] == 'incremental':
+        return replication_path / f"{snapshot['id']}.zip"
+    return Path(snapshot['path'])
+
+
+def _forget_upload(snapshot_id):
+    c.execute("DELETE FROM replication_uploads WHERE snapshot_id=?", (snapshot_id,))
+    c.execute("DELETE FROM replication_parts WHERE snapshot_id=?", (snapshot_id,))
+    conn.commit()
+
+
+async def _abandon_upload(target, executor, snapshot_id):
+    """Aborts the upload of a snapshot (if it was started on this target), so it is started over."""
+    c.execute("SELECT * FROM replication_uploads WHERE snapshot_id=?", (snapshot_id,))
+    upload = c.fetchone()
+    if upload is not None and upload['target'] == REPLICATION_TARGET:
+        await asyncio.get_running_loop().run_in_executor(executor, target.abort, upload['upload_id'], upload['name'])
+    _forget_upload(snapshot_id)
+    (replication_path / f'{snapshot_id}.zip').unlink(missing_ok=True)
+
+
+async def _remove_orphans(target, executor):
+    """Abandons the uploads and removes the exports of snapshots that were deleted before they were replicated."""
+    c.execute("SELECT snapshot_id FROM replication_uploads WHERE snapshot_id NOT IN (SELECT id FROM snapshots)")
+    for row in c.fetchall():
+        await _abandon_upload(target, executor, row['snapshot_id'])
+
+    if replication_path.exists():
+        c.execute("SELECT id FROM snapshots WHERE replication_status IS NOT 'replicated'")
+        pending = {f"{row['id']}.zip" for row in c.fetchall()}
+        for export in replication_path.iterdir():
+            if export.name not in pending:  # Including exports interrupted halfway
+                export.unlink(missing_ok=True)
+
+
+async def _replicate_snapshot(target, snapshot, executor, throttle):
+    """
+    Uploads a snapshot to the target, resuming the earlier upload of it if there is one.
+
+    Every part is recorded once uploaded, so an interrupted upload only sends the parts still missing.
+    """
+    loop = asyncio.get_running_loop()
+    source_path = _source_path(snapshot)
+
+    c.execute("SELECT * FROM replication_uploads WHERE snapshot_id=?", (snapshot['id'],))
+    upload = c.fetchone()
+    if upload is not None and (upload['target'] != REPLICATION_TARGET or not source_path.exists()):
+        # Started on another target, or from an export that is gone (and would not come out the same)
+        await _abandon_upload(target, executor, snapshot['id'])
+        upload = None
+
+    with snapshots.using_snapshots([snapshot['id']]):
+        if not source_path.exists():
+            await snapshots.export_snapshot(snapshot, source_path)
+        size = source_path.stat().st_size
+
+        if upload is None:
+            name = f"{Path(snapshot['filename']).stem}.zip"
+            part_size = max(PART_SIZE, target.min_part_size, -(-size // MAX_PARTS))
+            upload_id = await loop.run_in_executor(executor, target.begin, name, size)
+            c.execute("INSERT INTO replication_uploads VALUES (?, ?, ?, ?, ?)",
+                      (snapshot['id'], REPLICATION_TARGET, name, upload_id, part_size))
+            conn.commit()
+            c.execute("SELECT * FROM replication_uploads WHERE snapshot_id=?", (snapshot['id'],))
+            upload = c.fetchone()
+
+        c.execute("SELECT part, etag FROM replication_parts WHERE snapshot_id=?", (snapshot['id'],))
+        parts = {row['part']: row['etag'] for row in c.fetchall()}
+        part_size = upload['part_size']
+        part_count = max(1, -(-size // part_size))
+
+        tracker = progress.Progress(size)
+        tracker(sum(min(part_size, size - (number - 1) * part_size) for number in parts))
+        if parts:
+            logging.info("Resuming the replication of snapshot %s, %d of %d parts were uploaded already",
+                         snapshot['fancy_name'], len(parts), part_count)
+
+        async def send(number):
+            offset = (number - 1) * part_size
+            part_length = min(part_size, size - offset)
+            parts[number] = await loop.run_in_executor(executor, _upload_part, target, upload, source_path, number,
+                                                       offset, part_length, throttle)
+            tracker(part_length)
+            c.execute("INSERT OR REPLACE INTO replication_parts VALUES (?, ?, ?)",
+                      (snapshot['id'], number, parts[number]))
+            conn.commit()
+
+        uploads_running[snapshot['fancy_name']] = tracker
+        try:
+            # Parts wait in the executor for a free worker, the ones that failed are retried on the next run
+            results = await asyncio.gather(*(send(number) for number in range(1, part_count + 1)
+                                             if number not in parts), return_exceptions=True)
+        finally:
+            tracker.end_time = time.monotonic()
+            del uploads_running[snapshot['fancy_name']]
+
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            raise errors[0]
+        await loop.run_in_executor(executor, target.complete, upload['upload_id'], upload['name'], parts)
+
+    _forget_upload(snapshot['id'])
+    if source_path.parent == replication_path:
+        source_path.unlink(missing_ok=True)
+    logging.info("Replicated snapshot %s to %s in %.1f s (%.2f MB/s)", snapshot['fancy_name'], target,
+                 tracker.seconds, (tracker.throughput or 0) / (1024 * 1024))
+
+
+async def replicate_pending():
+    """
+    Uploads every snapshot that has not been replicated yet, oldest first, returning how many were.
+
+    Stops at the first snapshot that fails, as the target is usually unreachable then. Uploads
+    that are gone from the target are started over the next time, others resume.
+    """
+    replicated = 0
+    async with replication_lock:
+        target = await asyncio.to_thread(open_target, REPLICATION_TARGET)
+        throttle = integrity.Throttle(REPLICATION_BANDWIDTH)
+
+        with ThreadPoolExecutor(max_workers=REPLICATION_WORKERS) as executor:
+            try:
+                await _remove_orphans(target, executor)
+                c.execute("SELECT * FROM snapshots WHERE replication_status IS NOT 'replicated' ORDER BY id")
+                for snapshot in c.fetchall():
+                    c.execute("UPDATE snapshots SET replication_status='uploading' WHERE id=?", (snapshot['id'],))
+                    conn.commit()
+
+                    try:
+                        await _replicate_snapshot(target, snapshot, executor, throttle)
+                    except Exception as e:
+                        error = str(e) or type(e).__name__
+                        c.execute("UPDATE snapshots SET replication_status='failed', replication_error=? WHERE id=?",
+                                  (error, snapshot['id']))
+                        conn.commit()
+                        logging.error("Failed to replicate snapshot %s: %s", snapshot['fancy_name'], error)
+                        if isinstance(e, FileNotFoundError):  # The upload is gone from the target
+                            await _abandon_upload(target, executor, snapshot['id'])
+                        break
+
+                    c.execute('''UPDATE snapshots SET replication_status='replicated', replicated_at=?,
+                                 replication_error=NULL WHERE id=?''',
+                              (time.strftime('%Y-%m-%d %H:%M:%S'), snapshot['id']))
+                    conn.commit()
+                    replicated += 1
+
+            finally:
+                await asyncio.to_thread(target.close)
+
+    return replicated
+
+
+def _timestamp(date):
+    """Turns a date from the database into a Discord timestamp, which shows how long ago it was."""
+    try:
+        return f"<t:{int(time.mktime(time.strptime(date, '%Y-%m-%d %H:%M:%S')))}:R>"
+    except (TypeError, ValueError):
+        return 'at an unknown time'
+
+
+async def manage_replication(ctx, *args):
+    if not REPLICATION_TARGET:
+        embed = discord.Embed(
+            title=':x: Replication Disabled',
+            description='Set a `target` under the `[Replication]` header of config.cfg to copy snapshots elsewhere.',
+            color=discord.Color.red()
+        )
+        await ctx.send(embed=embed)
+        return
+
+    if args and args[0] == 'now':
+        if replication_lock.locked():
+            embed = discord.Embed(
+                title=':x: Already Replicating!',
+                description='Snapshots are already being replicated, see `snapshots replication` for the progress.',
+                color=discord.Color.red())
+            await ctx.send(embed=embed)
+            return
+
+        embed = discord.Embed(
+            description=':satellite: Replicating the snapshots that have not been replicated yet...',
+            color=discord.Color.blue()
+        )
+        message = await ctx.send(embed=embed)
+        try:
+            replicated = await replicate_pending()
+            embed = discord.Embed(
+                description=f':white_check_mark: {replicated} snapshot(s) have been replicated.',
+                color=discord.Color.green()
+            )
+        except Exception as e:
+            embed = discord.Embed(
+                title=':x: Replication Failed!',
+                description=f'Failed to replicate snapshots: {str(e)}',
+                color=discord.Color.red()
+            )
+        await message.edit(embed=embed)
+
+    c.execute("SELECT * FROM snapshots ORDER BY id")
+    rows = c.fetchall()
+    pending = [row for row in rows if row['replication_status'] != 'replicated']
+    last_replicated = max((row['replicated_at'] for row in rows if row['replicated_at']), default=None)
+
+    description = f'{len(rows) - len(pending)} of {len(rows)} snapshot(s) have been replicated to ' \
+                  f'`{REPLICATION_TARGET}`'
+    description += f', the last one {_timestamp(last_replicated)}.' if last_replicated else '.'
+    if pending:
+        pending_size = sum(row['file_size'] or 0 for row in pending)
+        description += (f'\n:hourglass: Replication lag: {len(pending)} snapshot(s), about '
+                        f'{round(pending_size / (1024 * 1024), 2)} MB. The oldest of them was created '
+                        f'{_timestamp(pending[0]["date"])}.')
+    else:
+        description += '\n:white_check_mark: The target is up to date.'
+
+    embed = discord.Embed(
+        title=':satellite: Replication',
+        description=description,
+        color=discord.Color.green() if not pending else discord.Color.blue()
+    )
+    for name, tracker in list(uploads_running.items()):
+        embed.add_field(name=f'Uploading {name}'[:256], value=tracker.describe(), inline=False)
+
+    failed = [row for row in pending if row['replication_status'] == 'failed']
+    for row in failed[:10]:
+        embed.add_field(name=f':x: {row["fancy_name"]}'[:256], value=(row['replication_error'] or '')[:1024],
+                        inline=False)
+    if not REPLICATION_ENABLED:
+        embed.set_footer(text='Background replication is disabled, use `snapshots replication now` to replicate.')
+    await ctx.send(embed=embed)
+
+
+@tasks.loop(minutes=REPLICATION_INTERVAL or 5)
+async def replication_job():
+    """Uploads the snapshots that have not been replicated yet, in the background."""
+    if replication_lock.locked():
+        return  # Still busy with the previous run or one started by hand
+
+    try:
+        await replicate_pending()
+        c.execute("SELECT COUNT(*) FROM snapshots WHERE replication_status IS NOT 'replicated'")
+        behind = c.fetchone()[0]
+        if behind:
+            logging.warning("Replication is %d snapshot(s) behind", behind)
+
+    except Exception as e:
+        logging.error("Failed to replicate snapshots: %s", e)
+
+
+def start_replication_job():
+    """Starts replicating new snapshots every `interval` minutes, unless that is disabled or already running."""
+    if REPLICATION_ENABLED and REPLICATION_TARGET and REPLICATION_INTERVAL > 0 and not replication_job.is_running():
+        replication_job.start()
@@ -0,0 +1,555 @@
+"""
+restore.py
+
+Version: 1.3.0
+
+This module houses the logic for restoring the server from world snapshots. A snapshot,
+or only a part of it such as one dimension or a range of region files, is rebuilt in a
+staging folder next to the live world, checked, and then swapped in with renames, so a
+failed restore never leaves a half restored world behind.
+
+Functions:
+    - _parse_selection(args): (Internal) Splits the snapshot name from the `--dimension` and
+      `--regions` options.
+    - _selected_paths(dimension, region_range): (Internal) Lists the folders or region files a
+      partial restore replaces.
+    - _path_filter(paths): (Internal) Selects the manifest paths inside the given paths.
+    - _swap_paths(staging_folder, backup_folder, paths): (Internal) Swaps restored files and folders
+      in with renames, rolling back if any rename fails.
+    - _clean_restore_folder(): (Internal) Removes what a restore left behind.
+    - _already_restoring(ctx): (Internal) Refuses a restore while another one is running.
+    - _find_player(player): (Internal) Looks up the name and UUID of a player.
+    - _player_online(name): (Internal) Checks over RCON whether a player is online.
+    - restore_snapshot(ctx, bot, *args): Restores the server, or a part of it, from a snapshot,
+      creating a new snapshot beforehand. Refuses to start when the disk would run out of space.
+    - restore_player(ctx, bot, *args): Restores the inventory, stats and advancements of a single
+      player from a snapshot.
+
+Attributes:
+    - restore_path: The folder restores are rebuilt in, inside the server folder.
+    - restore_lock: Held by the restore using `restore_path`, only one restore runs at a time.
+    - DIMENSIONS: The folders that can hold each dimension, in the Bukkit and the vanilla layout.
+    - REGION_FOLDERS: The folders of a dimension holding region files.
+    - PLAYER_FILES: The files holding a player's data, relative to the main world folder.
+
+Notes:
+    - Ensure the Minecraft server is not running when restoring snapshots, as it keeps
+      region files cached in memory.
+    - Region coordinates are those in the region file names (`r.<x>.<z>.mca`), a region
+      covers 512 by 512 blocks.
+    - Players can be restored while the server is running, as long as they are offline.
+"""
+
+
+# Standard library imports
+import asyncio
+import json
+import logging
+import re
+import shutil
+import sqlite3
+import uuid
+from pathlib import Path
+
+# Third-party imports
+import discord
+
+# First-party imports
+from bot_modules import preflight, progress, rcon, snapshots, utils
+
+
+script_path = Path(__file__).resolve().parent
+root_path = script_path.parent
+db_path = root_path / 'minecraft_manager.db'
+
+conn = sqlite3.connect(db_path)
+c = conn.cursor()
+
+
+# Restores are rebuilt here first, on the same file system as the world so swapping it in is a rename
+restore_path = root_path.parent / '.restore'
+# Held while a restore rebuilds files in `restore_path` and swaps them in, as every restore shares it
+restore_lock = asyncio.Lock()
+
+DIMENSIONS = {
+    'overworld': ['world'],
+    'nether': ['world_nether/DIM-1', 'world/DIM-1'],
+    'end': ['world_the_end/DIM1', 'world/DIM1'],
+}
+DIMENSION_ALIASES = {'world': 'overworld', 'the_nether': 'nether', 'the_end': 'end'}
+REGION_FOLDERS = ['region', 'entities', 'poi']
+PLAYER_FILES = ['playerdata/{uuid}.dat', 'stats/{uuid}.json', 'advancements/{uuid}.json']
+
+# More region files than this are better restored by dimension
+MAX_REGIONS = 4096
+
+
+def _parse_regions(value):
+    try:
+        first, second = value.split(':')
+        x1, z1 = map(int, first.split(','))
+        x2, z2 = map(int, second.split(','))
+    except ValueError as e:
+        raise ValueError(f"`--regions` expects region coordinates like `-2,-2:1,1`, not `{value}`") from e
+
+    region_range = (range(min(x1, x2), max(x1, x2) + 1), range(min(z1, z2), max(z1, z2) + 1))
+    if len(region_range[0]) * len(region_range[1]) > MAX_REGIONS:
+        raise ValueError(f"`--regions` covers more than {MAX_REGIONS} regions, restore the dimension instead")
+    return region_range
+
+
+def _parse_selection(args):
+    """
+    Splits the arguments of a restore into the snapshot name, the dimension and the region range.
+
+    The dimension is None for a full restore. Raises a ValueError for options it cannot understand.
+    """
+    args = list(args)
+    name_parts = []
+    dimension = None
+    region_range = None
+
+    while args:
+        arg = args.pop(0)
+        if arg not in ('--dimension', '--regions'):
+            name_parts.append(arg)
+            continue
+
+        if not args:
+            raise ValueError(f"`{arg}` needs a value")
+        value = args.pop(0)
+
+        if arg == '--regions':
+            region_range = _parse_regions(value)
+        else:
+            dimension = DIMENSION_ALIASES.get(value.lower(), value.lower())
+            if dimension not in DIMENSIONS:
+                raise ValueError(f"Unknown dimension `{value}`, use one of: {', '.join(DIMENSIONS)}")
+
+    if region_range is not None and dimension is None:
+        dimension = 'overworld'
+
+    return ' '.join(name_parts), dimension, region_range
+
+
+def _selected_paths(dimension, region_range):
+    """Returns the paths (relative to the server folder) of the region folders or files a partial restore replaces."""
+    folders = [f"{root}/{folder}" for root in DIMENSIONS[dimension] for folder in REGION_FOLDERS]
+    if region_range is None:
+        return folders
+
+    x_range, z_range = region_range
+    return [f"{folder}/r.{x}.{z}.mca" for folder in folders for x in x_range for z in z_range]
+
+
+def _swap_paths(staging_folder, backup_folder, paths):
+    """
+    Replaces live world files or folders with the restored ones in `staging_folder`, using renames only.
+
+    Live paths are moved into `backup_folder` first. Paths missing from the staging folder are
+    only moved out, as they did not exist when the snapshot was taken. Renames within one file
+    system are atomic, and if any of them fails everything swapped so far is put back, so the
+    live world is either fully restored or left as it was.
+    """
+    server_path = root_path.parent
+    swapped = []
+
+    try:
+        for path in paths:
+            live_path = server_path / path
+            staged_path = staging_folder / path
+            backup_path = backup_folder / path
+            replaced = False
+
+            try:
+                if live_path.exists():
+                    backup_path.parent.mkdir(parents=True, exist_ok=True)
+                    live_path.rename(backup_path)
+                    replaced = True
+                if staged_path.exists():
+                    live_path.parent.mkdir(parents=True, exist_ok=True)
+                    staged_path.rename(live_path)
+            except OSError:
+                if replaced:
+                    backup_path.rename(live_path)
+                raise
+
+            swapped.append(path)
+
+    except OSError:
+        for path in reversed(swapped):
+            live_path = server_path / path
+            if live_path.exists():
+                live_path.rename(staging_folder / path)
+            if (backup_folder / path).exists():
+                (backup_folder / path).rename(live_path)
+        raise
+
+
+def _clean_restore_folder():
+    """
+    Removes what a restore left in `restore_path`.
+
+    World files that were replaced but could not be put back are never removed, in which case
+    this returns False and they have to be moved back by hand.
+    """
+    backup_folder = restore_path / 'replaced'
+    if backup_folder.exists() and any(path.is_file() for path in backup_folder.rglob('*')):
+        logging.error("World files from a failed restore are still in %s", backup_folder)
+        return False
+
+    shutil.rmtree(restore_path, ignore_errors=True)
+    return True
+
+
+def _path_filter(paths):
+    """Returns a function telling whether a manifest path is one of the given paths, or inside one of them."""
+    wanted = set(paths)
+    prefixes = tuple(f"{path}/" for path in paths)
+    return lambda path: path in wanted or path.startswith(prefixes)
+
+
+def _describe_selection(dimension, region_range):
+    if dimension is None:
+        return 'the whole world'
+    if region_range is None:
+        return f'the {dimension}'
+
+    x_range, z_range = region_range
+    return f'the region files r.{x_range[0]}.{z_range[0]} to r.{x_range[-1]}.{z_range[-1]} of the {dimension}'
+
+
+async def restore_snapshot(ctx, bot, *args):
+    if bot.server_running:
+        embed = discord.Embed(
+            title=':x: Server Running!',
+            description='Cannot restore a snapshot while the server is running.',
+            color=discord.Color.red())
+        await ctx.send(embed=embed)
+        return
+
+    if await _already_restoring(ctx):
+        return
+
+    # Partial restores only replace one dimension, or a range of its region files
+    try:
+        snapshot_name, dimension, region_range = _parse_selection(args)
+    except ValueError as e:
+        embed = discord.Embed(
+            title=':x: Invalid Arguments',
+            description=str(e),
+            color=discord.Color.red())
+        await ctx.send(embed=embed)
+        return
+
+    # Fetch the snapshot from the database
+    snapshot = await snapshots.get_snapshot(ctx, snapshot_name)
+    if not snapshot:
+        return
+
+    fancy_name = snapshot[2]
+    selection_text = _describe_selection(dimension, region_range)
+
+    # Only the matching entries are read from the snapshot
+    selected_paths = _selected_paths(dimension, region_range) if dimension is not None else None
+    select = _path_filter(selected_paths) if selected_paths is not None else None
+
+    # Refuse early rather than filling up the disk halfway through
+    source_folders = [root_path.parent / folder for folder in snapshots.world_folders]
+    frozen_method = snapshots.FREEZE_METHOD if snapshots.freezes_world(bot.server_running) else None
+    estimate = await preflight.estimate_restore(snapshot, source_folders, select, frozen_method)
+    missing = preflight.check_space(estimate)
+    if missing:
+        await ctx.send(embed=preflight.space_embed(estimate, missing))
+        return
+
+    # Prompt user for confirmation before restoring
+    embed = discord.Embed(
+        title=':tools: Restore Snapshot',
+        description=f'Are you sure you want to restore {selection_text} from the snapshot "{fancy_name}"?\n\
+                      This will create a new snapshot before restoring and overwrite the current world data.\n'
+                    f'{preflight.describe(estimate)}',
+        color=discord.Color.yellow()
+    )
+    message = await ctx.send(embed=embed)
+
+    # Use the utility function to handle reactions
+    reaction, _ = await utils.get_user_reaction(bot, message, ctx.author, ['✅', '❌'])
+
+    if reaction is None:
+        embed = discord.Embed(
+            description=f':x: Snapshot restoration process timed out for "{fancy_name}".',
+            color=discord.Color.red()
+        )
+        await message.edit(embed=embed)
+        await message.clear_reactions()
+        return
+
+    if str(reaction.emoji) == '✅':
+        if await _already_restoring(ctx):
+            await message.delete()
+            return
+
+        async with restore_lock:
+            await snapshots.create_snapshot(ctx, bot)
+            await message.delete()
+
+            # Prepare embed to update during the process
+            embed = discord.Embed(
+                description=f':rocket: Restoring {selection_text} from snapshot "{fancy_name}"...\n',
+                color=discord.Color.blue()
+            )
+            message = await ctx.send(embed=embed)
+
+            staging_folder = restore_path / 'staging'
+            backup_folder = restore_path / 'replaced'
+
+            try:
+                # Rebuild next to the live world, which stays untouched until everything checks out
+                if not await asyncio.to_thread(_clean_restore_folder):
+                    raise RuntimeError(f"World files from a failed restore are still in {backup_folder}, "
+                                       "move them back into the server folder first")
+                staging_folder.mkdir(parents=True)
+
+                async with progress.reporting(message, embed) as tracker:
+                    await snapshots.restore_files(snapshot, staging_folder, select, tracker)
+                if tracker.throughput:
+                    c.execute("UPDATE snapshots SET restore_throughput=? WHERE id=?",
+                              (tracker.throughput, snapshot['id']))
+                    conn.commit()
+
+                skipped_folders = []
+                if dimension is None:
+                    # Check if the main "world" folder exists in the snapshot
+                    main_world_folder = staging_folder / "world"
+                    if not main_world_folder.exists():
+                        embed = discord.Embed(
+                            title=':x: Snapshot Restoring Failed!',
+                            description='The main world folder is missing from the snapshot. Aborting restore.',
+                            color=discord.Color.red()
+                        )
+                        await message.edit(embed=embed)
+                        await asyncio.to_thread(_clean_restore_folder)
+                        return
+
+                    swap_paths = [folder for folder in snapshots.world_folders if (staging_folder / folder).exists()]
+                    skipped_folders = [folder for folder in snapshots.world_folders if folder not in swap_paths]
+                else:
+                    server_path = root_path.parent
+                    swap_paths = [path for path in selected_paths
+                                  if (staging_folder / path).exists() or (server_path / path).exists()]
+
+                await asyncio.to_thread(_swap_paths, staging_folder, backup_folder, swap_paths)
+
+                # Draft an embed with success message
+                embed = discord.Embed(
+                    title=':white_check_mark: Snapshot Restored!',
+                    description=f'Snapshot "{fancy_name}" has been successfully restored.',
+                    color=discord.Color.green()
+                )
+                if dimension is not None:
+                    embed.description += f'\n\nRestored only {selection_text}.'
+
+                # Set message for skipped folders
+                if skipped_folders:
+                    skipped_folders_text = "\n".join([f':warning: Skipping folder "{folder}"\
+                                                  as it was not found in the snapshot.' for folder in skipped_folders])
+                    embed.description += f'\n\n{skipped_folders_text}'  # Add skipped folder notifications
+
+                await asyncio.to_thread(shutil.rmtree, restore_path, ignore_errors=True)
+
+                await message.edit(embed=embed)  # Send Success Message
+
+            except Exception as e:
+                # Catch all exceptions and report them in Discord
+                embed = discord.Embed(
+                    title=':x: Snapshot Restoring Failed!',
+                    description=f'Failed to restore snapshot: {str(e)}',
+                    color=discord.Color.red()
+                )
+                await ctx.send(embed=embed)
+                await asyncio.to_thread(_clean_restore_folder)
+    else:
+        embed = discord.Embed(
+            title=':x: Restore Snapshot Aborted!',
+            description=f'Snapshot restoration process aborted for "{fancy_name}".',
+            color=discord.Color.red()
+        )
+        await message.edit(embed=embed)
+        await message.clear_reactions()
+
+
+async def _already_restoring(ctx):
+    """Tells the user and returns True when another restore is using the restore folder."""
+    if not restore_lock.locked():
+        return False
+
+    embed = discord.Embed(
+        title=':x: Already Restoring!',
+        description='Another restore is in progress, please try again once it is done.',
+        color=discord.Color.red())
+    await ctx.send(embed=embed)
+    return True
+
+
+def _find_player(player):
+    """
+    Looks up the name and UUID of a player in the server's usercache.json.
+
+    `player` can be a Minecraft name, a UUID or a Discord mention of a verified user.
+    Returns None for players that cannot be found.
+    """
+    mention = re.fullmatch(r'<@!?(\d+)>', player)
+    if mention:
+        c.execute("SELECT minecraft_name FROM verification WHERE discord_id=?", (int(mention.group(1)),))
+        result = c.fetchone()
+        if not result:
+            return None
+        player = result[0]
+
+    try:
+        users = json.loads((root_path.parent / 'usercache.json').read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        users = []
+
+    for user in users:
+        if player.lower() in (user['name'].lower(), user['uuid'].lower()):
+            return user['name'], user['uuid']
+
+    # Players that are not in the cache can still be restored by UUID
+    try:
+        return player, str(uuid.UUID(player))
+    except ValueError:
+        return None
+
+
+async def _player_online(name):
+    """Checks whether a player is online, using the `list` command over RCON."""
+    response = await rcon.send_command('list')
+
+    # E.g. "There are 2 of a max of 20 players online: Steve, Alex"
+    players = response.split(':', 1)[1] if ':' in response else ''
+    return name.lower() in (online.strip().lower() for online in players.split(','))
+
+
+async def restore_player(ctx, bot, *args):
+    if len(args) < 2:
+        embed = discord.Embed(
+            title=':x: Missing Arguments',
+            description='Usage: `player-restore <snapshot> <player>`',
+            color=discord.Color.red())
+        await ctx.send(embed=embed)
+        return
+
+    snapshot_name = ' '.join(args[:-1])
+    player = _find_player(args[-1])
+    if player is None:
+        embed = discord.Embed(
+            title=':x: Player Not Found!',
+            description=f'Could not find the player "{args[-1]}". Use their Minecraft name, UUID or Discord mention.',
+            color=discord.Color.red())
+        await ctx.send(embed=embed)
+        return
+
+    player_name, player_uuid = player
+    if await _already_restoring(ctx):
+        return
+
+    # Fetch the snapshot from the database
+    snapshot = await snapshots.get_snapshot(ctx, snapshot_name)
+    if not snapshot:
+        return
+
+    fancy_name = snapshot[2]
+
+    # Prompt user for confirmation before restoring
+    embed = discord.Embed(
+        title=':tools: Restore Player',
+        description=f'Are you sure you want to restore the inventory, stats and advancements of {player_name} '
+                    f'from the snapshot "{fancy_name}"?\nThis will overwrite their current player data.',
+        color=discord.Color.yellow()
+    )
+    message = await ctx.send(embed=embed)
+
+    # Use the utility function to handle reactions
+    reaction, _ = await utils.get_user_reaction(bot, message, ctx.author, ['✅', '❌'])
+
+    if reaction is None or str(reaction.emoji) != '✅':
+        embed = discord.Embed(
+            description=f':x: Player restoration process aborted for {player_name}.',
+            color=discord.Color.red()
+        )
+        await message.edit(embed=embed)
+        await message.clear_reactions()
+        return
+
+    await message.delete()
+
+    # The server only reads player data when they join, and overwrites it when they leave
+    if bot.server_running:
+        try:
+            online = await _player_online(player_name)
+        except (rcon.RconError, TimeoutError):
+            online = None
+
+        if online is not False:
+            embed = discord.Embed(
+                title=':x: Player Online!',
+                description=f'{player_name} has to be offline to restore their player data.'
+                if online else 'Could not check whether the player is online over RCON.',
+                color=discord.Color.red())
+            await ctx.send(embed=embed)
+            return
+
+    if await _already_restoring(ctx):
+        return
+
+    async with restore_lock:
+        embed = discord.Embed(
+            description=f':rocket: Restoring {player_name} from snapshot "{fancy_name}"...\n',
+            color=discord.Color.blue()
+        )
+        message = await ctx.send(embed=embed)
+
+        staging_folder = restore_path / 'staging'
+        backup_folder = restore_path / 'replaced'
+        player_paths = [f"{snapshots.world_folders[0]}/{path.format(uuid=player_uuid)}" for path in PLAYER_FILES]
+
+        try:
+            if not await asyncio.to_thread(_clean_restore_folder):
+                raise RuntimeError(f"World files from a failed restore are still in {backup_folder}, "
+                                   "move them back into the server folder first")
+            staging_folder.mkdir(parents=True)
+
+            # Only these few files are read from the snapshot
+            entries = await snapshots.restore_files(snapshot, staging_folder, lambda path: path in player_paths)
+            if not entries:
+                embed = discord.Embed(
+                    title=':x: Player Restoring Failed!',
+                    description=f'{player_name} has no player data in the snapshot "{fancy_name}".',
+                    color=discord.Color.red()
+                )
+                await message.edit(embed=embed)
+                await asyncio.to_thread(_clean_restore_folder)
+                return
+
+            await asyncio.to_thread(_swap_paths, staging_folder, backup_folder, player_paths)
+            await asyncio.to_thread(shutil.rmtree, restore_path, ignore_errors=True)
+
+            embed = discord.Embed(
+                title=':white_check_mark: Player Restored!',
+                description=f'{player_name} has been restored from the snapshot "{fancy_name}".',
+                color=discord.Color.green()
+            )
+            await message.edit(embed=embed)
+            logging.info("Restored player %s (%s) from snapshot %s", player_name, player_uuid, fancy_name)
+
+        except Exception as e:
+            # Catch all exceptions and report them in Discord
+            embed = discord.Embed(
+                title=':x: Player Restoring Failed!',
+                description=f'Failed to restore {player_name}: {str(e)}',
+                color=discord.Color.red()
+            )
+            await ctx.send(embed=embed)
+            await asyncio.to_thread(_clean_restore_folder)
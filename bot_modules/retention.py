@@ -0,0 +1,256 @@
+"""
+retention.py
+
+Version: 1.3.0
+
+This module decides which snapshots are kept and prunes the rest, following the rules
+under the `[Retention]` header of config.cfg. Snapshots are kept grandfather-father-son
+style (the newest snapshot of the last N hours, days, weeks and months), then the oldest
+ones are dropped until the count and size caps are met. Pruning runs in the background
+when enabled, and can be previewed (or run by hand) with `$snapshots prune`.
+
+Functions:
+    - _parse_date(date): (Internal) Parses the date a snapshot was created.
+    - _get_dependencies(): (Internal) Fetches which snapshots every incremental snapshot is based on.
+    - plan_retention(rows, dependencies, in_use): Decides which snapshots are kept, and why.
+    - _plan(): (Internal) Plans retention for all snapshots in the database.
+    - prune_snapshots(ctx, bot, *args): Previews or prunes the snapshots the retention rules do not keep.
+    - retention_job(): Background task pruning snapshots every `interval` minutes.
+    - start_retention_job(): Starts the background task, unless it is disabled or already running.
+
+Attributes:
+    - conn: The SQLite connection to the database.
+    - c: The cursor object for executing SQL commands.
+    - RETENTION_ENABLED: Whether snapshots are pruned in the background.
+    - RETENTION_INTERVAL: How many minutes pass between background prunes.
+    - KEEP_LAST: How many of the newest snapshots are always kept.
+    - KEEP_RULES: The time buckets snapshots are kept per, with how many buckets are kept.
+    - MAX_COUNT: The most snapshots to keep, 0 for no cap.
+    - MAX_SIZE: The most bytes all snapshots may take, 0 for no cap.
+
+Notes:
+    - Without any keep rules every snapshot is kept, only the caps remove snapshots.
+    - The newest snapshot, snapshots in use by a restore, download or check, and the
+      snapshots kept incremental snapshots are based on are never removed.
+"""
+
+
+# Standard library imports
+import configparser
+import datetime
+import logging
+import sqlite3
+from pathlib import Path
+
+# Third-party imports
+import discord
+from discord.ext import tasks
+
+# First-party imports
+from bot_modules import snapshots, utils
+
+
+script_path = Path(__file__).resolve().parent
+root_path = script_path.parent
+db_path = root_path / 'minecraft_manager.db'
+config_path = root_path / 'config.cfg'
+
+config = configparser.ConfigParser()
+config.read(config_path)
+
+RETENTION_ENABLED = config.getboolean('Retention', 'enabled', fallback=False)
+RETENTION_INTERVAL = config.getint('Retention', 'interval', fallback=60)
+KEEP_LAST = config.getint('Retention', 'keep_last', fallback=0)
+# The newest snapshot of every hour, day, ISO week and month is kept for the last N of them
+KEEP_RULES = {
+    'hourly': ('%Y-%m-%d %H', config.getint('Retention', 'keep_hourly', fallback=0)),
+    'daily': ('%Y-%m-%d', config.getint('Retention', 'keep_daily', fallback=0)),
+    'weekly': ('%G-W%V', config.getint('Retention', 'keep_weekly', fallback=0)),
+    'monthly': ('%Y-%m', config.getint('Retention', 'keep_monthly', fallback=0)),
+}
+MAX_COUNT = config.getint('Retention', 'max_count', fallback=0)
+MAX_SIZE = config.getint('Retention', 'max_size', fallback=0) * 1024 * 1024  # In MB
+
+conn = sqlite3.connect(db_path)
+conn.row_factory = sqlite3.Row
+c = conn.cursor()
+
+
+def _parse_date(date):
+    """Parses the date a snapshot was created, None if it cannot be read."""
+    try:
+        return datetime.datetime.strptime(date or '', '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        return None
+
+
+def _get_dependencies():
+    """Returns the ids of the snapshots every incremental snapshot reads files from, by snapshot id."""
+    c.execute('''SELECT DISTINCT snapshot_id, source_id AS base FROM snapshot_files
+                 WHERE source_id IS NOT NULL AND source_id != snapshot_id
+                 UNION
+                 SELECT DISTINCT snapshot_id, delta_base AS base FROM snapshot_files
+                 WHERE delta_base IS NOT NULL AND delta_base != snapshot_id''')
+    dependencies = {}
+    for row in c.fetchall():
+        dependencies.setdefault(row['snapshot_id'], set()).add(row['base'])
+    return dependencies
+
+
+def plan_retention(rows, dependencies, in_use):
+    """
+    Decides which of the given snapshots are kept.
+
+    Returns the reasons every kept snapshot is kept for by id, and the snapshots to remove,
+    newest first. `dependencies` holds the ids every snapshot is based on, `in_use` the ids
+    of the snapshots that must not be removed right now.
+    """
+    rows = sorted(rows, key=lambda row: (row['date'] or '', row['id']), reverse=True)
+    if not rows:
+        return {}, []
+
+    keep = {row['id']: [] for row in rows} if not KEEP_LAST and not any(
+        count for _, count in KEEP_RULES.values()) else {}
+
+    def mark(snapshot_id, reason):
+        keep.setdefault(snapshot_id, [])
+        if reason not in keep[snapshot_id]:
+            keep[snapshot_id].append(reason)
+
+    mark(rows[0]['id'], 'newest')
+    for row in rows[:KEEP_LAST]:
+        mark(row['id'], 'last')
+
+    for rule, (bucket_format, count) in KEEP_RULES.items():
+        last_bucket = None
+        for row in rows:
+            if count <= 0:
+                break
+            date = _parse_date(row['date'])
+            if date is None:
+                continue
+
+            bucket = date.strftime(bucket_format)
+            if bucket != last_bucket:
+                mark(row['id'], rule)
+                last_bucket = bucket
+                count -= 1
+
+    for row in rows:
+        if in_use.get(row['id'], 0) > 0:
+            mark(row['id'], 'in use')
+        if _parse_date(row['date']) is None:
+            mark(row['id'], 'unknown date')  # Rather kept than removed by mistake
+
+    # Incremental snapshots read unchanged files from the snapshots they are based on
+    names = {row['id']: row['fancy_name'] for row in rows}
+    pending = list(keep)
+    while pending:
+        snapshot_id = pending.pop()
+        for base in dependencies.get(snapshot_id, ()):
+            if base not in keep:
+                pending.append(base)
+            mark(base, f'base of {names.get(snapshot_id, snapshot_id)}')
+
+    # The caps drop the oldest snapshots nothing else relies on, until they are met
+    sizes = {row['id']: row['file_size'] or 0 for row in rows}
+    while (MAX_COUNT and len(keep) > MAX_COUNT) or (MAX_SIZE and sum(sizes.get(i, 0) for i in keep) > MAX_SIZE):
+        needed = {base for snapshot_id in keep for base in dependencies.get(snapshot_id, ())}
+        droppable = [row for row in reversed(rows[1:])
+                     if row['id'] in keep and row['id'] not in needed and in_use.get(row['id'], 0) <= 0]
+        if not droppable:
+            break
+        del keep[droppable[0]['id']]
+
+    return keep, [row for row in rows if row['id'] not in keep]
+
+
+def _plan():
+    """Plans retention for all snapshots in the database, returning the snapshots by id, what to keep and remove."""
+    c.execute("SELECT * FROM snapshots")
+    rows = c.fetchall()
+    keep, remove = plan_retention(rows, _get_dependencies(), snapshots.snapshots_in_use)
+    return {row['id']: row for row in rows}, keep, remove
+
+
+async def prune_snapshots(ctx, bot, *args):
+    dry_run = '--dry-run' in args
+    rows, keep, remove = _plan()
+
+    if not remove:
+        embed = discord.Embed(
+            title=':white_check_mark: Nothing To Prune',
+            description=f'All {len(rows)} snapshot(s) are kept by the retention rules.',
+            color=discord.Color.green()
+        )
+        await ctx.send(embed=embed)
+        return
+
+    freed = sum(row['file_size'] or 0 for row in remove)
+    embed = discord.Embed(
+        title=':scissors: Retention Preview' if dry_run else ':warning: Prune Snapshots',
+        description=f'{len(remove)} of {len(rows)} snapshot(s) would be removed, '
+                    f'freeing about {round(freed / (1024 * 1024), 2)} MB.',
+        color=discord.Color.blue() if dry_run else discord.Color.yellow()
+    )
+    removed_text = '\n'.join(f'{row["fancy_name"]} ({row["date"]})' for row in remove[:20])
+    if len(remove) > 20:
+        removed_text += f'\nAnd {len(remove) - 20} more'
+    embed.add_field(name='Removed', value=removed_text[:1024], inline=False)
+    kept_text = '\n'.join(f'{rows[snapshot_id]["fancy_name"]}: {", ".join(reasons) or "no rules"}'
+                          for snapshot_id, reasons in list(keep.items())[:20])
+    if len(keep) > 20:
+        kept_text += f'\nAnd {len(keep) - 20} more'
+    embed.add_field(name='Kept', value=kept_text[:1024], inline=False)
+
+    if dry_run:
+        await ctx.send(embed=embed)
+        return
+
+    embed.description += '\nAre you sure you want to delete them?'
+    message = await ctx.send(embed=embed)
+
+    reaction, _ = await utils.get_user_reaction(bot, message, ctx.author, ['✅', '❌'])
+
+    if reaction is None or str(reaction.emoji) != '✅':
+        embed = discord.Embed(
+            description=':x: Pruning snapshots cancelled.' if reaction else ':x: Pruning snapshots timed out.',
+            color=discord.Color.red()
+        )
+        await message.edit(embed=embed)
+        await message.clear_reactions()
+        return
+
+    # Planned again, snapshots may have been created or started being used while waiting
+    _, _, remove = _plan()
+    removed = await snapshots.remove_snapshots(remove)
+    logging.info("Pruned %d snapshots by hand", len(removed))
+
+    embed = discord.Embed(
+        title=':wastebasket: Snapshots Pruned',
+        description=f'{len(removed)} snapshot(s) have been deleted.',
+        color=discord.Color.green()
+    )
+    if len(removed) < len(remove):
+        embed.set_footer(text=f'{len(remove) - len(removed)} snapshot(s) were in use and have been kept.')
+    await message.edit(embed=embed)
+    await message.clear_reactions()
+
+
+@tasks.loop(minutes=RETENTION_INTERVAL or 60)
+async def retention_job():
+    """Removes the snapshots the retention rules do not keep, in the background."""
+    try:
+        _, _, remove = _plan()
+        if remove:
+            removed = await snapshots.remove_snapshots(remove)
+            logging.info("Pruned %d snapshots: %s", len(removed), ', '.join(row['fancy_name'] for row in removed))
+
+    except Exception as e:
+        logging.error("Failed to prune snapshots: %s", e)
+
+
+def start_retention_job():
+    """Starts pruning snapshots every `interval` minutes, unless that is disabled or already running."""
+    if RETENTION_ENABLED and RETENTION_INTERVAL > 0 and not retention_job.is_running():
+        retention_job.start()
@@ -0,0 +1,392 @@
+"""
+scheduler.py
+
+Version: 1.3.0
+
+This module creates snapshots automatically. Schedules are stored in the database
+with a cron expression (e.g. `0 * * * *` or `@nightly`), or `stop` to take a snapshot
+every time the server is stopped with `$stop`. A background task checks once a minute
+which schedules are due, and every run is recorded with its timing, so it shows how
+snapshots grow slower as the world grows.
+
+Functions:
+    - parse_cron(expression): Parses a cron expression into the values every field matches.
+    - next_run(expression, after): Calculates the next time a cron expression matches.
+    - _run_schedule(bot, schedule, target): (Internal) Creates the snapshot of a schedule.
+    - _record_run(schedule, snapshot_name, started, start_time, archiving): (Internal) Waits for a
+      scheduled snapshot to be archived and records how long it took.
+    - run_schedules(bot): Background task running all schedules that are due.
+    - run_stop_schedules(ctx, bot): Runs the schedules for `$stop`, before the server stops, returning
+      the ones that had to be skipped.
+    - manage_schedules(ctx, *args): Lists, adds or removes schedules, or shows the history of one.
+
+Attributes:
+    - conn: The SQLite connection to the database.
+    - c: The cursor object for executing SQL commands.
+    - CRON_ALIASES: The shorthands that can be used instead of a cron expression.
+    - SCHEDULE_CHANNEL_ID: The channel scheduled snapshots are reported in, the bot owner's DMs if 0.
+
+Notes:
+    - Runs missed while the bot was offline are caught up with a single run once it is back.
+    - Only one snapshot of a cron schedule is created at a time, the next one waits until the
+      previous one has been archived. Snapshots for `$stop` do not wait for that, so the server
+      stops as soon as the world is frozen.
+    - Cron expressions are in the local time of the machine running the bot.
+"""
+
+
+# Standard library imports
+import asyncio
+import configparser
+import datetime
+import logging
+import sqlite3
+import time
+from pathlib import Path
+
+# Third-party imports
+import discord
+from discord.ext import tasks
+
+# First-party imports
+from bot_modules import snapshots
+
+
+script_path = Path(__file__).resolve().parent
+root_path = script_path.parent
+db_path = root_path / 'minecraft_manager.db'
+config_path = root_path / 'config.cfg'
+
+config = configparser.ConfigParser()
+config.read(config_path)
+
+BOT_OWNER_ID = int(config.get('PythonConfig', 'bot_owner_id'))
+SCHEDULE_CHANNEL_ID = config.getint('Snapshots', 'schedule_channel_id', fallback=0)
+
+conn = sqlite3.connect(db_path)
+conn.row_factory = sqlite3.Row
+c = conn.cursor()
+
+c.execute('''CREATE TABLE IF NOT EXISTS snapshot_schedules (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT UNIQUE,
+                cron TEXT,
+                incremental INTEGER,
+                next_run TEXT
+            )''')
+c.execute('''CREATE TABLE IF NOT EXISTS schedule_runs (
+                schedule_id INTEGER,
+                started TEXT,
+                duration REAL,
+                archive_duration REAL,
+                world_size INTEGER,
+                result TEXT
+            )''')
+c.execute("CREATE INDEX IF NOT EXISTS schedule_runs_schedule_id ON schedule_runs(schedule_id)")
+conn.commit()
+
+CRON_ALIASES = {
+    '@hourly': '0 * * * *',
+    '@daily': '0 0 * * *',
+    '@nightly': '0 3 * * *',
+    '@weekly': '0 0 * * 0',
+    '@monthly': '0 0 1 * *',
+}
+CRON_FIELDS = [('minute', 0, 59), ('hour', 0, 23), ('day', 1, 31), ('month', 1, 12), ('weekday', 0, 7)]
+DATE_FORMAT = '%Y-%m-%d %H:%M'
+
+# Held from the start of a snapshot of a cron schedule until it has been archived
+job_lock = asyncio.Lock()
+background_tasks = set()
+
+
+def parse_cron(expression):
+    """
+    Parses a five field cron expression (or one of `CRON_ALIASES`).
+
+    Returns the sets of minutes, hours, days, months and weekdays (0 is Sunday) it matches,
+    followed by whether the day and weekday fields were restricted. Raises a ValueError for
+    expressions it cannot understand.
+    """
+    fields = CRON_ALIASES.get(expression.strip().lower(), expression).split()
+    if len(fields) != len(CRON_FIELDS):
+        raise ValueError(f"`{expression}` is not a cron expression, it needs 5 fields like `0 3 * * *`")
+
+    parsed = []
+    for field, (field_name, low, high) in zip(fields, CRON_FIELDS):
+        values = set()
+        for part in field.split(','):
+            part, _, step = part.partition('/')
+            try:
+                if part == '*':
+                    start, end = low, high
+                elif '-' in part:
+                    start, end = map(int, part.split('-', 1))
+                else:
+                    start = int(part)
+                    end = high if step else start
+                step = int(step) if step else 1
+            except ValueError as e:
+                raise ValueError(f"Cannot read the {field_name} field `{field}` of `{expression}`") from e
+
+            if not low <= start <= end <= high or step < 1:
+                raise ValueError(f"The {field_name} field `{field}` of `{expression}` is out of range ({low}-{high})")
+            values.update(range(start, end + 1, step))
+        parsed.append(values)
+
+    weekdays = parsed[4]
+    if 7 in weekdays:  # Sunday can be written as 0 or 7
+        weekdays.discard(7)
+        weekdays.add(0)
+
+    return parsed[0], parsed[1], parsed[2], parsed[3], weekdays, fields[2] != '*', fields[4] != '*'
+
+
+def next_run(expression, after):
+    """Returns the first minute after the datetime `after` that a cron expression matches."""
+    minutes, hours, days, months, weekdays, days_restricted, weekdays_restricted = parse_cron(expression)
+    moment = after.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+    limit = moment + datetime.timedelta(days=366 * 4)  # E.g. the 29th of February
+
+    while moment < limit:
+        weekday = (moment.weekday() + 1) % 7  # Cron weeks start on Sunday
+        if days_restricted and weekdays_restricted:
+            # Like cron, a day matches if either the day or the weekday field matches
+            day_matches = moment.day in days or weekday in weekdays
+        else:
+            day_matches = moment.day in days and weekday in weekdays
+
+        if moment.month not in months or not day_matches:
+            moment = moment.replace(hour=0, minute=0) + datetime.timedelta(days=1)
+        elif moment.hour not in hours:
+            moment = moment.replace(minute=0) + datetime.timedelta(hours=1)
+        elif moment.minute not in minutes:
+            moment += datetime.timedelta(minutes=1)
+        else:
+            return moment
+
+    raise ValueError(f"`{expression}` never matches")
+
+
+async def _get_target(bot):
+    """Returns where scheduled snapshots are reported, the configured channel or the bot owner's DMs."""
+    if SCHEDULE_CHANNEL_ID:
+        channel = bot.get_channel(SCHEDULE_CHANNEL_ID)
+        if channel is not None:
+            return channel
+        logging.error("Schedule channel %d not found, reporting to the bot owner instead", SCHEDULE_CHANNEL_ID)
+
+    return await bot.fetch_user(BOT_OWNER_ID)
+
+
+async def _run_schedule(bot, schedule, target):
+    """
+    Creates the snapshot of a schedule, reporting it to `target`, and returns once the world is frozen.
+
+    The snapshot is archived in the background and recorded in the schedule's history once
+    it is done, by the task that is returned.
+    """
+    started = time.strftime('%Y-%m-%d %H:%M:%S')
+    start_time = time.monotonic()
+    snapshot_name = f"{schedule['name']} {started}"
+    args = [f"{snapshot_name} | Scheduled snapshot ({schedule['cron']})"]
+    if schedule['incremental']:
+        args.insert(0, '--incremental')
+
+    before = set(snapshots.background_tasks)
+    await snapshots.create_snapshot(target, bot, *args)
+    archiving = snapshots.background_tasks - before
+
+    task = asyncio.create_task(_record_run(schedule, snapshot_name, started, start_time, archiving))
+    background_tasks.add(task)  # Keep a reference until it is done
+    task.add_done_callback(background_tasks.discard)
+    return task
+
+
+async def _record_run(schedule, snapshot_name, started, start_time, archiving):
+    """Waits until a scheduled snapshot has been archived, then records the run in the schedule's history."""
+    if archiving:
+        await asyncio.wait(archiving)
+    duration = time.monotonic() - start_time
+
+    # The size of the whole world, incremental snapshots only compress what changed
+    snapshots.c.execute("""SELECT duration, (SELECT SUM(size) FROM snapshot_files WHERE snapshot_id=snapshots.id)
+                           AS world_size FROM snapshots WHERE fancy_name=?""", (snapshot_name,))
+    snapshot = snapshots.c.fetchone()
+    result = 'ok' if snapshot is not None else 'failed'
+
+    c.execute("INSERT INTO schedule_runs(schedule_id, started, duration, archive_duration, world_size, result) \
+               VALUES (?, ?, ?, ?, ?, ?)",
+              (schedule['id'], started, duration, snapshot['duration'] if snapshot else None,
+               snapshot['world_size'] if snapshot else None, result))
+    conn.commit()
+    logging.info("Scheduled snapshot %s: %s in %.1f s", snapshot_name, result, duration)
+
+
+@tasks.loop(minutes=1)
+async def run_schedules(bot):
+    """Runs every schedule whose next run has come, including runs missed while the bot was offline."""
+    try:
+        now = datetime.datetime.now()
+        c.execute("SELECT * FROM snapshot_schedules WHERE cron != 'stop' AND next_run <= ? ORDER BY next_run",
+                  (now.strftime(DATE_FORMAT),))
+
+        for schedule in c.fetchall():
+            if schedule['next_run'] < (now - datetime.timedelta(minutes=2)).strftime(DATE_FORMAT):
+                logging.info("Catching up on schedule %s, missed at %s", schedule['name'], schedule['next_run'])
+
+            # Moved on first, so a run that fails is not retried every minute
+            c.execute("UPDATE snapshot_schedules SET next_run=? WHERE id=?",
+                      (next_run(schedule['cron'], now).strftime(DATE_FORMAT), schedule['id']))
+            conn.commit()
+
+            # Released once the snapshot has been archived (or failed), which the next run waits for
+            await job_lock.acquire()
+            try:
+                task = await _run_schedule(bot, schedule, await _get_target(bot))
+            except BaseException:
+                job_lock.release()
+                raise
+            task.add_done_callback(lambda _: job_lock.release())
+
+    except Exception as e:
+        logging.error("Failed to run snapshot schedules: %s", e)
+
+
+async def run_stop_schedules(ctx, bot):
+    """
+    Creates the snapshots of all `stop` schedules, returning once the world is frozen for each of them.
+
+    They do not wait for snapshots of cron schedules to be archived. Returns the names of the
+    schedules that were skipped, as snapshots cannot be created while the server runs when
+    `hot_snapshots` is disabled.
+    """
+    c.execute("SELECT * FROM snapshot_schedules WHERE cron = 'stop' ORDER BY id")
+    schedules = c.fetchall()
+    if schedules and bot.server_running and not snapshots.HOT_SNAPSHOTS:
+        logging.warning("Skipped the snapshots of %d stop schedules, hot snapshots are disabled", len(schedules))
+        return [schedule['name'] for schedule in schedules]
+
+    for schedule in schedules:
+        await _run_schedule(bot, schedule, ctx)
+    return []
+
+
+async def _list_schedules(ctx):
+    c.execute('''SELECT snapshot_schedules.*, COUNT(schedule_runs.started) AS runs,
+                        AVG(schedule_runs.duration) AS average_duration,
+                        MAX(schedule_runs.started) AS last_started
+                 FROM snapshot_schedules LEFT JOIN schedule_runs ON schedule_runs.schedule_id = snapshot_schedules.id
+                 GROUP BY snapshot_schedules.id ORDER BY snapshot_schedules.name''')
+    schedules = c.fetchall()
+
+    embed = discord.Embed(title=':calendar: Snapshot Schedules', color=discord.Color.green())
+    if not schedules:
+        embed.description = 'No snapshots are scheduled. Add one with ' \
+                            '`schedule add <name> "<cron>|stop" [--incremental]`.'
+
+    for schedule in schedules[:25]:  # Discord embeds hold at most 25 fields
+        when_text = 'Before every `$stop`' if schedule['cron'] == 'stop' else \
+            f"`{schedule['cron']}`, next at {schedule['next_run']}"
+        kind_text = 'Incremental' if schedule['incremental'] else 'Full'
+        if schedule['runs']:
+            runs_text = f"{schedule['runs']} runs, last at {schedule['last_started']}, " \
+                        f"{schedule['average_duration']:.1f} s on average"
+        else:
+            runs_text = 'Not run yet'
+
+        embed.add_field(name=schedule['name'], value=f'**When:** {when_text}\n**Type:** {kind_text}\n'
+                                                     f'**Runs:** {runs_text}', inline=False)
+
+    await ctx.send(embed=embed)
+
+
+async def _schedule_history(ctx, name):
+    c.execute("SELECT * FROM snapshot_schedules WHERE name=?", (name,))
+    schedule = c.fetchone()
+    if schedule is None:
+        embed = discord.Embed(
+            title=':x: Not Found',
+            description=f'Schedule with the name "{name}" not found.',
+            color=discord.Color.red()
+        )
+        await ctx.send(embed=embed)
+        return
+
+    c.execute("SELECT * FROM schedule_runs WHERE schedule_id=? ORDER BY started DESC LIMIT 20", (schedule['id'],))
+    lines = []
+    for run in c.fetchall():
+        if run['result'] == 'ok':
+            world_size_mb = round(run['world_size'] / (1024 * 1024), 2)
+            lines.append(f"`{run['started']}` {run['duration']:.1f} s (archiving {run['archive_duration']:.1f} s), "
+                         f"{world_size_mb} MB world")
+        else:
+            lines.append(f"`{run['started']}` :x: Failed after {run['duration']:.1f} s")
+
+    embed = discord.Embed(
+        title=f':stopwatch: History of "{name}"',
+        description='\n'.join(lines) if lines else 'This schedule has not run yet.',
+        color=discord.Color.green()
+    )
+    embed.set_footer(text='The last 20 runs, newest first')
+    await ctx.send(embed=embed)
+
+
+async def manage_schedules(ctx, *args):
+    action = args[0] if args else 'list'
+
+    if action == 'list':
+        await _list_schedules(ctx)
+        return
+
+    if action == 'history' and len(args) == 2:
+        await _schedule_history(ctx, args[1])
+        return
+
+    if action == 'remove' and len(args) == 2:
+        c.execute("SELECT id FROM snapshot_schedules WHERE name=?", (args[1],))
+        schedule = c.fetchone()
+        if schedule is not None:
+            c.execute("DELETE FROM snapshot_schedules WHERE id=?", (schedule['id'],))
+            c.execute("DELETE FROM schedule_runs WHERE schedule_id=?", (schedule['id'],))
+            conn.commit()
+
+        embed = discord.Embed(
+            title=':wastebasket: Schedule Removed' if schedule else ':x: Not Found',
+            description=f'Schedule "{args[1]}" has been removed.' if schedule
+            else f'Schedule with the name "{args[1]}" not found.',
+            color=discord.Color.green() if schedule else discord.Color.red()
+        )
+        await ctx.send(embed=embed)
+        return
+
+    if action == 'add' and len(args) in (3, 4) and list(args[3:]) in ([], ['--incremental']):
+        name, cron = args[1], args[2].strip()
+        try:
+            next_run_text = None if cron == 'stop' else next_run(cron, datetime.datetime.now()).strftime(DATE_FORMAT)
+            c.execute("INSERT INTO snapshot_schedules(name, cron, incremental, next_run) VALUES (?, ?, ?, ?)",
+                      (name, cron, len(args) == 4, next_run_text))
+            conn.commit()
+        except (ValueError, sqlite3.IntegrityError) as e:
+            reason = f'A schedule with the name "{name}" already exists.' if isinstance(e, sqlite3.IntegrityError) \
+                else str(e)
+            embed = discord.Embed(title=':x: Invalid Schedule', description=reason, color=discord.Color.red())
+            await ctx.send(embed=embed)
+            return
+
+        embed = discord.Embed(
+            title=':white_check_mark: Schedule Added!',
+            description=f'Schedule "{name}" will create a snapshot '
+                        + ('before every `$stop`.' if next_run_text is None else f'next at {next_run_text}.'),
+            color=discord.Color.green()
+        )
+        await ctx.send(embed=embed)
+        return
+
+    embed = discord.Embed(
+        title=':x: Invalid Arguments',
+        description='Usage: `schedule [list]`, `schedule add <name> "<cron>|stop" [--incremental]`, '
+                    '`schedule remove <name>` or `schedule history <name>`',
+        color=discord.Color.red()
+    )
+    await ctx.send(embed=embed)
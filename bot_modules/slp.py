@@ -0,0 +1,158 @@
+"""
+slp.py
+
+Version: 1.3.0
+
+This module asks the Minecraft server for its status with the Server List Ping protocol,
+the same way the multiplayer screen of the game does. Unlike just connecting to the port,
+this tells whether the server is actually accepting players, and reports its version, the
+number of players online and the latency of a ping over the same connection.
+
+Functions:
+    - pack_varint(value): Encodes a number as a VarInt.
+    - unpack_varint(data, offset): Decodes a VarInt from a packet's data.
+    - pack_string(text): Encodes text as a String.
+    - unpack_string(data, offset): Decodes a String from a packet's data.
+    - pack_packet(packet_id, *fields): Encodes a packet from its id and encoded fields.
+    - read_packet(reader): Reads a packet from a stream, returning its id and data.
+    - query_status(host, port, timeout): Asks the server for its status and measures the latency.
+
+Attributes:
+    - STATE_STATUS: The state the handshake asks for to get the status.
+    - STATE_LOGIN: The state the handshake asks for to join the server.
+
+Notes:
+    - VarInts are the protocol's variable length numbers, 7 bits per byte, least significant
+      first, with the highest bit set on every byte but the last. Negative numbers take 5 bytes.
+"""
+
+
+# Standard library imports
+import asyncio
+import json
+import struct
+import time
+
+
+# Packet ids of the status state, the handshake and the ping are sent by the client
+PACKET_HANDSHAKE = 0x00
+PACKET_STATUS = 0x00
+PACKET_PING = 0x01
+STATE_STATUS = 1
+STATE_LOGIN = 2
+# The protocol version sent when asking for the status, -1 means any version
+ANY_PROTOCOL = -1
+# Protects against a broken server making us read endlessly
+MAX_PACKET_SIZE = 2 * 1024 * 1024
+
+
+def pack_varint(value):
+    """Encodes a number as a VarInt."""
+    value &= 0xFFFFFFFF
+    data = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        data.append(byte | 0x80 if value else byte)
+        if not value:
+            return bytes(data)
+
+
+def unpack_varint(data, offset=0):
+    """Decodes the VarInt at `offset` in `data`, returning its value and the offset after it."""
+    value = 0
+    for shift in range(0, 35, 7):
+        if offset >= len(data):
+            raise ValueError("The packet ends in the middle of a VarInt")
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value - (1 << 32) if value & (1 << 31) else value, offset
+
+    raise ValueError("The packet holds a VarInt longer than 5 bytes")
+
+
+def pack_string(text):
+    """Encodes text as a String, its length in bytes followed by the text in UTF-8."""
+    data = text.encode('utf-8')
+    return pack_varint(len(data)) + data
+
+
+def unpack_string(data, offset=0):
+    """Decodes the String at `offset` in `data`, returning the text and the offset after it."""
+    length, offset = unpack_varint(data, offset)
+    if length < 0 or offset + length > len(data):
+        raise ValueError("The packet ends in the middle of a String")
+    return data[offset:offset + length].decode('utf-8'), offset + length
+
+
+def pack_packet(packet_id, *fields):
+    """Encodes a packet, its length followed by its id and its (already encoded) fields."""
+    payload = pack_varint(packet_id) + b''.join(fields)
+    return pack_varint(len(payload)) + payload
+
+
+async def read_packet(reader):
+    """Reads a packet from a stream, returning its id and the data after it."""
+    length = 0
+    for shift in range(0, 35, 7):
+        byte = (await reader.readexactly(1))[0]
+        length |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            break
+    else:
+        raise ValueError("The packet length is longer than 5 bytes")
+
+    if not 0 < length <= MAX_PACKET_SIZE:
+        raise ValueError(f"Invalid packet length ({length} bytes)")
+    payload = await reader.readexactly(length)
+    packet_id, offset = unpack_varint(payload)
+    return packet_id, payload[offset:]
+
+
+async def _query_status(host, port):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        handshake = pack_packet(PACKET_HANDSHAKE, pack_varint(ANY_PROTOCOL), pack_string(host),
+                                struct.pack('>H', port), pack_varint(STATE_STATUS))
+        writer.write(handshake + pack_packet(PACKET_STATUS))
+        await writer.drain()
+
+        packet_id, data = await read_packet(reader)
+        if packet_id != PACKET_STATUS:
+            raise ValueError(f"The server answered the status request with packet {packet_id:#x}")
+        status = json.loads(unpack_string(data)[0])
+
+        # The latency is measured like the game does, with a ping after the status
+        token = time.time_ns() & 0x7FFFFFFFFFFFFFFF
+        start_time = time.perf_counter()
+        writer.write(pack_packet(PACKET_PING, struct.pack('>q', token)))
+        await writer.drain()
+        packet_id, data = await read_packet(reader)
+        if packet_id != PACKET_PING or data != struct.pack('>q', token):
+            raise ValueError("The server answered the ping with something else than the pong")
+        status['latency'] = round((time.perf_counter() - start_time) * 1000, 2)
+
+        return status
+
+    except asyncio.IncompleteReadError as e:
+        raise ValueError("The server closed the connection before answering") from e
+
+    finally:
+        writer.close()
+
+
+async def query_status(host, port, timeout=3):
+    """
+    Asks the server for its status with the Server List Ping protocol.
+
+    Returns the status as the server sends it (with `version`, `players` and `description`),
+    with the round trip time of a ping in milliseconds added as `latency`. Raises an OSError
+    when the server cannot be reached, a TimeoutError when it does not answer within
+    `timeout` seconds and a ValueError when it does not answer like a Minecraft server.
+    """
+    try:
+        return await asyncio.wait_for(_query_status(host, int(port)), timeout)
+    except asyncio.TimeoutError as e:
+        raise TimeoutError(f"The server did not answer the status request within {timeout} s") from e
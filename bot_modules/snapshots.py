@@ -4,37 +4,66 @@ snapshots.py
 Version: 1.3.0
 
 This module houses all logic for managing Minecraft world snapshots within
-the Discord bot. It includes functions to create, list, restore, delete,
-and download snapshots, allowing users to manage their Minecraft server
-worlds effectively.
+the Discord bot. It includes functions to create and delete
+snapshots, allowing users to manage their Minecraft server worlds effectively.
+Listing snapshots is handled in catalog.py, restoring them in restore.py and
+downloading them in downloads.py.
 
 Functions:
+    - _saving_paused(): (Internal) Pauses world saving over RCON while frozen.
+    - _freeze_world(source_folders, snapshot_filename, hot): (Internal) Freezes the world into
+      a copy-on-write copy (see freeze.py) to archive from.
+    - _archive_snapshot(job): (Internal) Archives and records a snapshot, reporting the result
+      in Discord. Runs in the background for frozen snapshots.
+    - _write_snapshot(snapshot_filename, source_folders, incremental, base_path): (Internal)
+      Writes the world folders using the configured storage backend (zip archive or deduplicated
+      object store), optionally only storing what changed since the last snapshot.
+    - setup_snapshots(): Creates or upgrades the snapshot tables and detects the freeze method,
+      once when the bot starts.
+    - freezes_world(server_running): Whether a new snapshot freezes the world before archiving it.
+    - using_snapshots(snapshot_ids): Marks snapshots as in use while reading them, so they are not removed.
+    - get_sources(snapshot): Fetches a snapshot's manifest and the archives holding its data.
+    - restore_files(snapshot, destination, select, tracker): Rebuilds and checks (a part of) a snapshot's
+      world folders, applying the chain of archives for incremental snapshots (see restore.py).
+    - export_snapshot(snapshot, export_path, tracker): Rebuilds a deduplicated or incremental
+      snapshot into a regular zip archive.
     - get_snapshot(ctx, snapshot_name): (Internal) Fetches a snapshot from the database.
-    - list_snapshots(ctx): Fetches and displays a list of all snapshots.
-    - create_snapshot(ctx, bot, suppress_success_message):
+    - remove_snapshots(rows): Deletes snapshots with their archives, unless they are in use.
+    - create_snapshot(ctx, bot, *args):
       Creates a new snapshot of the world, handling user input and warnings.
+      Passing `--incremental` only stores the files changed since the last snapshot.
+      Refuses to start when the disk would run out of space (see preflight.py).
     - delete_snapshot(ctx, bot, snapshot_name): Deletes a specified snapshot
       after user confirmation.
-    - restore_snapshot(ctx, bot, snapshot_name): Restores the
-      server from a specified snapshot, creating a new snapshot beforehand.
-    - download_snapshot(ctx, snapshot_name): Downloads a specified snapshot
-      to the Discord channel.
 
 Attributes:
     - db_path: The path to the SQLite database for snapshot management.
     - conn: The SQLite connection to the database.
     - c: The cursor object for executing SQL commands.
+    - STORAGE: The storage backend for new snapshots, `zip` or `store` (see store.py).
+      Both compress with the codec and level configured in config.cfg (see compression.py).
+    - HOT_SNAPSHOTS: Whether snapshots may be created while the server is running, by pausing
+      saving over RCON while the world is frozen.
+    - FREEZE_METHOD: How the world is frozen into `frozen_path`, `reflink`, `hardlink` or `copy`
+      (see freeze.py), detected when the bot starts unless set in config.cfg.
+    - BACKGROUND_ARCHIVING: Whether frozen snapshots are archived in the background. By default
+      only when the world is frozen with reflinks.
 
 Notes:
     - The module interacts with the SQLite database to store snapshot details.
     - It uses Discord's embed functionality to communicate with users in
       a visually appealing manner.
-    - Ensure the Minecraft server is not running when creating or restoring snapshots.
+    - Ensure the Minecraft server is not running when restoring snapshots. Snapshots of a
+      running server are created hot, unless `hot_snapshots` is disabled in config.cfg.
 """
 
 
 # Standard library imports
 import asyncio
+import collections
+import configparser
+import contextlib
+import logging
 import shutil
 import sqlite3
 import time
@@ -44,80 +73,566 @@ from pathlib import Path
 import discord
 
 # First-party imports
-from bot_modules import utils
+from bot_modules import archive, compression, freeze, preflight, progress, rcon, store, utils
 
 
 script_path = Path(__file__).resolve().parent
 root_path = script_path.parent
 
 db_path = root_path / 'minecraft_manager.db'
+config_path = root_path / 'config.cfg'
+world_folders = ["world", "world_nether", "world_the_end"]
+
+config = configparser.ConfigParser()
+config.read(config_path)
+
+STORAGE = config.get('Snapshots', 'storage', fallback='zip')
+STORE_CHUNK_SIZE = config.getint('Snapshots', 'store_chunk_size', fallback=1024 * 1024)
+HOT_SNAPSHOTS = config.getboolean('Snapshots', 'hot_snapshots', fallback=True)
+SAVE_TIMEOUT = config.getint('Snapshots', 'save_timeout', fallback=60)
+BACKGROUND_ARCHIVING = config.get('Snapshots', 'background_archiving', fallback='auto')
+FREEZE_METHOD = config.get('Snapshots', 'freeze_method', fallback='auto')
+
+# The world is frozen here (with saving paused if the server runs), and archived from here afterwards
+frozen_path = root_path / 'snapshots' / 'frozen'
+# Held open by the running server (and locked on Windows), it is recreated on start anyway
+FREEZE_EXCLUDE = ('session.lock',)
+
+# What `save-all flush` answers once the world has been written to disk
+SAVE_CONFIRMATIONS = ('Saved the game', 'Saved the world')
+
 conn = sqlite3.connect(db_path)
+conn.row_factory = sqlite3.Row  # Rows stay indexable by position, but can also be accessed by column name
 c = conn.cursor()
 
-c.execute('''CREATE TABLE IF NOT EXISTS snapshots (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                filename TEXT,
-                fancy_name TEXT,
-                path TEXT,
-                file_size INTEGER,
-                date TEXT,
-                notes TEXT
-            )''')
 
+def _add_column(table, column, definition):
+    """Adds a column to an existing table, so databases from older versions keep working."""
+    columns = [row['name'] for row in c.execute(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        c.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def setup_snapshots():
+    """
+    Creates or upgrades the snapshot tables and detects how the world can be frozen.
+
+    Called once by bot.py when the bot starts. This is not done on import, as every worker
+    process compressing a snapshot (see compression.py) imports this package again.
+    """
+    global FREEZE_METHOD, BACKGROUND_ARCHIVING  # pylint: disable=global-statement
+
+    c.execute('''CREATE TABLE IF NOT EXISTS snapshots (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    filename TEXT,
+                    fancy_name TEXT,
+                    path TEXT,
+                    file_size INTEGER,
+                    date TEXT,
+                    notes TEXT
+                )''')
+
+    c.execute('''CREATE TABLE IF NOT EXISTS snapshot_files (
+                    snapshot_id INTEGER,
+                    path TEXT,
+                    size INTEGER,
+                    mtime INTEGER,
+                    hash TEXT,
+                    chunks TEXT
+                )''')
+
+    _add_column('snapshots', 'storage', "TEXT DEFAULT 'zip'")
+    _add_column('snapshots', 'kind', "TEXT DEFAULT 'full'")
+    _add_column('snapshots', 'parent_id', "INTEGER")
+    _add_column('snapshots', 'delta_size', "INTEGER")
+    _add_column('snapshots', 'bytes_in', "INTEGER")
+    _add_column('snapshots', 'bytes_out', "INTEGER")
+    _add_column('snapshots', 'duration', "REAL")
+    _add_column('snapshots', 'pause_seconds', "REAL")
+    _add_column('snapshots', 'verified_at', "TEXT")
+    _add_column('snapshots', 'verify_result', "TEXT")  # 'ok', or what was found damaged (see integrity.py)
+    # Bytes per second processed when it was archived, and when it was last restored, for capacity planning
+    _add_column('snapshots', 'throughput', "REAL")
+    _add_column('snapshots', 'restore_throughput', "REAL")
+    # Whether it has been copied to the replication target yet (see replication.py), and when or why not
+    _add_column('snapshots', 'replication_status', "TEXT")  # NULL until tried, 'uploading', 'replicated' or 'failed'
+    _add_column('snapshots', 'replicated_at', "TEXT")
+    _add_column('snapshots', 'replication_error', "TEXT")
+    _add_column('snapshot_files', 'source_id', "INTEGER")
+    _add_column('snapshot_files', 'delta_base', "INTEGER")
+    # How many deltas a region file is rebuilt from, and the hash of the rebuilt file (see archive.py)
+    _add_column('snapshot_files', 'delta_depth', "INTEGER")
+    _add_column('snapshot_files', 'packed_hash', "TEXT")
+    # How much every compression rule saved, kept after snapshots are deleted so rules can be tuned from it
+    c.execute('''CREATE TABLE IF NOT EXISTS compression_stats (
+                    snapshot_id INTEGER,
+                    rule TEXT,
+                    codec TEXT,
+                    files INTEGER,
+                    bytes_in INTEGER,
+                    bytes_out INTEGER
+                )''')
+    c.execute("CREATE INDEX IF NOT EXISTS snapshot_files_snapshot_id ON snapshot_files(snapshot_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS snapshot_files_snapshot_path ON snapshot_files(snapshot_id, path)")
+    c.execute("CREATE INDEX IF NOT EXISTS snapshot_files_source_id ON snapshot_files(source_id)")
+    # Snapshots are looked up by name, older versions did not enforce unique names so duplicates get their id appended
+    c.execute('''UPDATE snapshots SET fancy_name = fancy_name || ' (' || id || ')'
+                 WHERE id NOT IN (SELECT MIN(id) FROM snapshots GROUP BY fancy_name)''')
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS snapshots_fancy_name ON snapshots(fancy_name)")
+    c.execute("CREATE INDEX IF NOT EXISTS snapshots_file_size ON snapshots(file_size)")
+    conn.commit()
+
+    if FREEZE_METHOD == 'auto':
+        FREEZE_METHOD = freeze.detect_method(root_path.parent, frozen_path)
+    if BACKGROUND_ARCHIVING == 'auto':
+        # Only a copy-on-write freeze is cheap enough to freeze a stopped server just to archive in the background
+        BACKGROUND_ARCHIVING = FREEZE_METHOD == 'reflink'
+    else:
+        BACKGROUND_ARCHIVING = config.getboolean('Snapshots', 'background_archiving')
+    logging.info("Snapshots freeze the world using %s, background archiving is %s", FREEZE_METHOD,
+                 'on' if BACKGROUND_ARCHIVING else 'off')
+
+
+def freezes_world(server_running):
+    """
+    Returns whether a new snapshot freezes the world before archiving it.
+
+    A running server is always frozen, so saving only pauses briefly. A stopped server is
+    only frozen with reflinks, otherwise its world is streamed straight into the archive
+    rather than copied first.
+    """
+    return server_running or FREEZE_METHOD == 'reflink'
+
+
+# Held while a snapshot is written and recorded, or while collecting garbage from the object store
+store_lock = asyncio.Lock()
+# Held while freezing the world, as every frozen copy is linked against the previous one
+freeze_lock = asyncio.Lock()
+
+# Snapshots which are frozen but not archived yet, by filename
+pending_snapshots = {}
+background_tasks = set()
+# How many restores, downloads or checks are reading every snapshot, by id. These are never removed.
+snapshots_in_use = collections.Counter()
+
+
+def _manifest_entry(row):
+    return {'path': row['path'], 'size': row['size'], 'mtime': row['mtime'], 'hash': row['hash'],
+            'chunks': row['chunks'].split() if row['chunks'] else [], 'source_id': row['source_id'],
+            'delta_base': row['delta_base'], 'delta_depth': row['delta_depth'], 'packed_hash': row['packed_hash']}
+
+
+def _get_manifest(snapshot_id):
+    c.execute("SELECT * FROM snapshot_files WHERE snapshot_id=? ORDER BY rowid", (snapshot_id,))
+    return [_manifest_entry(row) for row in c.fetchall()]
+
+
+def _save_manifest(snapshot_id, entries):
+    c.executemany("INSERT INTO snapshot_files(snapshot_id, path, size, mtime, hash, chunks, source_id, delta_base, \
+                   delta_depth, packed_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                  [(snapshot_id, entry['path'], entry['size'], entry['mtime'], entry['hash'],
+                    ' '.join(entry.get('chunks', [])), entry.get('source_id', snapshot_id), entry.get('delta_base'),
+                    entry.get('delta_depth'), entry.get('packed_hash'))
+                   for entry in entries])
+
+
+def _resolve_delta_bases(entries):
+    """Links every region delta in a manifest to the file version it applies to, down to a full copy."""
+    for entry in entries:
+        version = entry
+        while version.get('delta_base') is not None:
+            c.execute("SELECT * FROM snapshot_files WHERE snapshot_id=? AND path=?",
+                      (version['delta_base'], version['path']))
+            row = c.fetchone()
+            if row is None:
+                raise FileNotFoundError(f'The base version of {entry["path"]} no longer exists')
+            version['base'] = _manifest_entry(row)
+            version = version['base']
+
+    return entries
+
+
+def _find_parent():
+    """Returns the latest snapshot with a manifest in the configured storage, the base for an incremental snapshot."""
+    c.execute("""SELECT * FROM snapshots WHERE storage=?
+                 AND EXISTS (SELECT 1 FROM snapshot_files WHERE snapshot_id=snapshots.id)
+                 ORDER BY id DESC LIMIT 1""", (STORAGE,))
+    return c.fetchone()
+
+
+def _get_archive_paths(entries):
+    """Maps the ids of all snapshots holding data for the given manifest to their archive paths."""
+    source_ids = set()
+    for entry in entries:
+        version = entry
+        while version is not None:
+            if version['source_id'] is not None:
+                source_ids.add(version['source_id'])
+            version = version.get('base')
+
+    archives = {}
+
+    for source_id in source_ids:
+        c.execute("SELECT path FROM snapshots WHERE id=?", (source_id,))
+        source = c.fetchone()
+        if source is None or not Path(source['path']).exists():
+            raise FileNotFoundError('A snapshot this incremental snapshot is based on no longer exists')
+        archives[source_id] = Path(source['path'])
+
+    return archives
+
+
+def _new_snapshot_filename():
+    """Returns a `snapshot_<timestamp>` name no other snapshot uses, even when several are taken within a second."""
+    timestamp = int(time.time())
+    while True:
+        snapshot_filename = f"snapshot_{timestamp}"
+        c.execute("SELECT 1 FROM snapshots WHERE filename IN (?, ?)", (snapshot_filename, f"{snapshot_filename}.zip"))
+        if c.fetchone() is None and not (root_path / "snapshots" / f"{snapshot_filename}.zip").exists() \
+                and snapshot_filename not in pending_snapshots:
+            return snapshot_filename
+        timestamp += 1
+
+
+@contextlib.asynccontextmanager
+async def _saving_paused():
+    """
+    Pauses world saving over RCON while the block runs, once the server has flushed the world to disk.
+
+    Sends `save-off` and `save-all flush`, waits for the server to confirm the flush and sends
+    `save-on` again when the block is left, whatever happened. Yields a dict whose `seconds`
+    are set to how long saving was paused for.
+    """
+    pause = {'seconds': None}
+
+    await rcon.send_command('save-off', SAVE_TIMEOUT)
+    pause_start = time.monotonic()
 
-async def get_snapshot(ctx, snapshot_name):
-    c.execute("SELECT * FROM snapshots WHERE fancy_name=?", (snapshot_name,))
-    snapshot = c.fetchone()
+    try:
+        response = await rcon.send_command('save-all flush', SAVE_TIMEOUT)
+        if not any(confirmation in response for confirmation in SAVE_CONFIRMATIONS):
+            raise RuntimeError(f"The server did not confirm saving the world: {response or 'no response'}")
+        yield pause
 
-    if not snapshot:
+    finally:
+        await rcon.send_command('save-on', SAVE_TIMEOUT)
+        pause['seconds'] = time.monotonic() - pause_start
+        logging.info("World saving was paused for %.2f s", pause['seconds'])
+
+
+async def _freeze_world(source_folders, snapshot_filename, hot):
+    """
+    Freezes the world folders into a copy named after the snapshot (see freeze.py).
+
+    When the server is running (`hot`), saving is paused while freezing. Returns the frozen
+    folders and how many seconds saving was paused for (None for a stopped server).
+    """
+    destination = frozen_path / snapshot_filename
+    partial_path = frozen_path / f"{snapshot_filename}.partial"
+
+    async with freeze_lock:
+        previous = freeze.latest_tree(frozen_path)
+        freeze_start = time.monotonic()
+
+        def freeze_copy():
+            return asyncio.to_thread(freeze.freeze_tree, source_folders, partial_path, previous, FREEZE_METHOD,
+                                     FREEZE_EXCLUDE)
+
+        if hot:
+            async with _saving_paused() as pause:
+                linked, copied = await freeze_copy()
+        else:
+            pause = {'seconds': None}
+            linked, copied = await freeze_copy()
+
+        partial_path.rename(destination)
+
+    logging.info("Froze the world in %.2f s using %s (%d files linked, %d copied)",
+                 time.monotonic() - freeze_start, FREEZE_METHOD, linked, copied)
+    return [destination / folder.name for folder in source_folders], pause['seconds']
+
+
+def _remove_frozen_copies():
+    """Removes frozen copies which are archived, keeping only the newest one to link the next copy against."""
+    if not frozen_path.exists():
+        return
+
+    keep = freeze.latest_tree(frozen_path) if FREEZE_METHOD != 'copy' else None
+    for tree in frozen_path.iterdir():
+        if tree.is_dir() and tree != keep and tree.name.split('.')[0] not in pending_snapshots:
+            shutil.rmtree(tree, ignore_errors=True)
+
+
+async def _archive_snapshot(job):
+    """
+    Writes and records a snapshot, then reports the result by editing the job's Discord message.
+
+    `job` holds the snapshot's `filename`, `name`, `description`, the `source_folders` (frozen or
+    live) with their `base_path`, whether it is `incremental`, the saving `pause`, the `embed`
+    drafted for the success `message` and the `status` embed the progress is reported below.
+    """
+    embed = job['embed']
+
+    try:
+        async with store_lock, progress.reporting(job['message'], job['status']) as tracker:
+            start_time = time.monotonic()
+            details, entries = await _write_snapshot(job['filename'], job['source_folders'], job['incremental'],
+                                                     job['base_path'], tracker)
+            duration = time.monotonic() - start_time
+            bytes_in = sum(rule_stats['bytes_in'] for rule_stats in details['compression'].values())
+            bytes_out = sum(rule_stats['bytes_out'] for rule_stats in details['compression'].values())
+            current_date = time.strftime('%Y-%m-%d %H:%M:%S')
+
+            c.execute("INSERT INTO snapshots(filename, fancy_name, path, file_size, date, notes, \
+                                             storage, kind, parent_id, delta_size, bytes_in, bytes_out, duration, \
+                                             pause_seconds, throughput) \
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                      (details['filename'], job['name'], str(details['path']), details['file_size'], current_date,
+                       job['description'], details['storage'], details['kind'], details['parent_id'],
+                       details['delta_size'], bytes_in, bytes_out, duration, job['pause'], tracker.throughput))
+            snapshot_id = c.lastrowid
+            _save_manifest(snapshot_id, entries)
+            c.executemany("INSERT INTO compression_stats(snapshot_id, rule, codec, files, bytes_in, bytes_out) \
+                           VALUES (?, ?, ?, ?, ?, ?)",
+                          [(snapshot_id, rule, rule_stats['codec'], rule_stats['files'], rule_stats['bytes_in'],
+                            rule_stats['bytes_out']) for rule, rule_stats in details['compression'].items()])
+            conn.commit()
+
+        logging.info("Snapshot %s: compressed %d bytes into %d bytes in %.1f s", job['name'], bytes_in, bytes_out,
+                     duration)
+        for rule, rule_stats in details['compression'].items():
+            logging.info("Compression rule %s (%s): %d files, %d bytes into %d bytes", rule, rule_stats['codec'],
+                         rule_stats['files'], rule_stats['bytes_in'], rule_stats['bytes_out'])
+        embed.description += (f"\n\n:package: Compressed {round(bytes_in / (1024 * 1024), 2)} MB into "
+                              f"{round(bytes_out / (1024 * 1024), 2)} MB in {duration:.1f} s")
+        if tracker.throughput:
+            embed.description += f" ({round(tracker.throughput / (1024 * 1024), 2)} MB/s)"
+        embed.description += "."
+        if job['pause'] is not None:
+            embed.description += f"\n:pause_button: World saving was paused for {job['pause']:.2f} s."
+
+        if job['incremental'] and details['kind'] != 'incremental':
+            embed.description += '\n\n:information_source: No earlier snapshot to build on, created a full snapshot.'
+
+        await job['message'].edit(embed=embed)  # Send success message
+
+    except Exception as e:
+        logging.error("Failed to archive snapshot %s: %s", job['name'], e)
         embed = discord.Embed(
-            title=':x: Not Found',
-            description=f'Snapshot with the name "{snapshot_name}" not found.',
+            title=":x: Snapshot Failed!",
+            description=f'Failed to create snapshot: {str(e)}',
             color=discord.Color.red()
         )
-        await ctx.send(embed=embed)
-        return None
+        await job['message'].edit(embed=embed)
 
-    return snapshot
+    finally:
+        pending_snapshots.pop(job['filename'], None)
+        if job['base_path'] is not None:
+            await asyncio.to_thread(_remove_frozen_copies)
+
+
+async def _write_snapshot(snapshot_filename, source_folders, incremental=False, base_path=None, tracker=None):
+    """
+    Writes the world folders using the configured storage backend.
+
+    Incremental snapshots only store the files whose size or modification time changed
+    since the parent snapshot. Paths are recorded relative to `base_path`, the server folder
+    by default. The bytes to store are counted by `tracker` (see progress.py), if given.
+    Returns the details to record for the snapshot (including the per-rule compression
+    statistics) and its manifest.
+    """
+    compression.check_settings()
+    entries = await asyncio.to_thread(archive.scan_tree, source_folders, base_path)
+    details = {'storage': STORAGE, 'kind': 'full', 'parent_id': None}
+
+    parent = _find_parent() if incremental else None
+    parent_archives = None
+    if parent is not None:
+        parent_entries = _get_manifest(parent['id'])
+        changed = archive.split_changes(entries, parent_entries)
+        details.update(kind='incremental', parent_id=parent['id'])
+        if STORAGE != 'store':
+            # Region deltas are checked against their rebuilt base, which may need the whole chain
+            parent_archives = _get_archive_paths(_resolve_delta_bases(parent_entries))
+    else:
+        changed = [entry for entry in entries if not entry['path'].endswith('/')]
+
+    if tracker is not None:
+        tracker.total = sum(entry['size'] for entry in (entries if STORAGE == 'store' else changed))
+
+    if STORAGE == 'store':
+        stats = await asyncio.to_thread(store.store_tree, entries, STORE_CHUNK_SIZE, tracker)
+        for entry in entries:
+            entry['source_id'] = None  # The data lives in the object store, not in another snapshot
+        new_bytes = sum(rule_stats['bytes_out'] for rule_stats in stats.values())
+        details.update(filename=snapshot_filename, path=store.objects_path, file_size=new_bytes,
+                       delta_size=sum(entry['size'] for entry in changed), compression=stats)
+        return details, entries
+
+    snapshot_path = root_path / "snapshots" / f"{snapshot_filename}.zip"
+    snapshot_path.parent.mkdir(exist_ok=True)
+
+    # Incremental archives only hold the changed files (and only the changed chunks of region files),
+    # folders are recreated from the manifest. Archive on a worker thread so the event loop keeps
+    # the gateway heartbeat going.
+    stats = await asyncio.to_thread(archive.write_archive, snapshot_path, changed if parent is not None else entries,
+                                    parent_archives, details['parent_id'], tracker)
+    details.update(filename=snapshot_path.name, path=snapshot_path, file_size=snapshot_path.stat().st_size,
+                   delta_size=sum(entry['size'] for entry in changed), compression=stats)
+    return details, entries
+
+
+@contextlib.contextmanager
+def using_snapshots(snapshot_ids):
+    """Marks snapshots as in use while the block runs, so they are not removed while being read."""
+    snapshot_ids = list(snapshot_ids)
+    snapshots_in_use.update(snapshot_ids)
+    try:
+        yield
+    finally:
+        snapshots_in_use.subtract(snapshot_ids)
+
+
+def get_sources(snapshot):
+    """
+    Returns the manifest entries of a snapshot and the archives holding their data, by snapshot id.
+
+    Raises a FileNotFoundError when a snapshot an incremental snapshot is based on is gone.
+    """
+    entries = _get_manifest(snapshot['id'])
+    if snapshot['storage'] == 'store' or not entries:
+        return entries, {}
+
+    _resolve_delta_bases(entries)
+    return entries, _get_archive_paths(entries)
+
+
+async def restore_files(snapshot, destination, select=None, tracker=None):
+    """
+    Rebuilds the world folders of a snapshot inside `destination`, whatever way it was stored.
+
+    `select` can be a function taking a manifest path, to only rebuild the entries it returns
+    True for. The bytes rebuilt are counted by `tracker` (see progress.py), if given. Returns
+    the manifest entries that were rebuilt.
+    """
+    entries = _get_manifest(snapshot['id'])
+    if select is not None:
+        if not entries:
+            raise ValueError("This snapshot is too old to restore only a part of it")
+        entries = [entry for entry in entries if select(entry['path'])]
+    if tracker is not None:
+        tracker.total = sum(entry['size'] for entry in entries) or None
+
+    if snapshot['storage'] == 'store':
+        with using_snapshots([snapshot['id']]):
+            await asyncio.to_thread(store.restore_tree, entries, destination, tracker)
+    elif entries:
+        _resolve_delta_bases(entries)
+        archives = _get_archive_paths(entries)
+        with using_snapshots([snapshot['id'], *archives]):
+            await asyncio.to_thread(archive.extract_manifest, entries, archives, destination, None, tracker)
+    else:
+        # Snapshots from before manifests were recorded
+        with using_snapshots([snapshot['id']]):
+            await asyncio.to_thread(shutil.unpack_archive, snapshot['path'], destination)
+        return entries
 
+    await asyncio.to_thread(archive.check_extracted, entries, destination)
+    return entries
 
-async def list_snapshots(ctx):
-    c.execute("SELECT * FROM snapshots")
-    snapshots = c.fetchall()
 
-    normal_embed = discord.Embed(color=discord.Color.green())
-    excluded_entries = []
+async def export_snapshot(snapshot, export_path, tracker=None):
+    """
+    Rebuilds a deduplicated or incremental snapshot into a regular zip archive at `export_path`.
 
-    for snapshot in snapshots:
-        file_path = Path(snapshot[3])
+    The archive is written next to it first and only moved into place once complete. The bytes
+    written are counted by `tracker` (see progress.py), if given.
+    """
+    partial_path = export_path.with_name(f'{export_path.name}.partial')
+    export_path.parent.mkdir(parents=True, exist_ok=True)
 
-        if not file_path.exists():
-            excluded_entries.append(snapshot[0])
-            continue
+    try:
+        entries, archives = get_sources(snapshot)
+        if tracker is not None:
+            tracker.total = sum(entry['size'] for entry in entries)
+        with using_snapshots([snapshot['id'], *archives]):
+            if snapshot['storage'] == 'store':
+                await asyncio.to_thread(store.export_zip, entries, partial_path, tracker)
+            else:
+                await asyncio.to_thread(archive.export_manifest, entries, archives, partial_path, tracker)
+        partial_path.replace(export_path)
 
-        file_size_mb = round(snapshot[4] / (1024 * 1024), 2)
-        normal_embed.add_field(
-            name=f'{snapshot[1]} - {snapshot[2]}',
-            value=f'**Date:** {snapshot[5]}\n**File Size:** {file_size_mb} MB\n**Notes:** {snapshot[6]}',
-            inline=False
-        )
+    finally:
+        partial_path.unlink(missing_ok=True)
+
+
+async def _collect_store_garbage():
+    """Removes all objects from the store which are no longer used by any snapshot."""
+    async with store_lock:
+        c.execute("SELECT chunks FROM snapshot_files WHERE chunks != ''")
+        referenced = set()
+        for row in c.fetchall():
+            referenced.update(row['chunks'].split())
+
+        removed, freed = await asyncio.to_thread(store.collect_garbage, referenced)
+
+    logging.info("Removed %d unused objects from the snapshot store (%d bytes)", removed, freed)
+
+
+async def remove_snapshots(rows):
+    """
+    Deletes snapshots with their archives and database rows, returning the ones that were deleted.
+
+    Snapshots in use by a restore, download or check are skipped, and so are the ones a snapshot
+    that is kept is based on. The store lock is held, so no incremental snapshot is built on top
+    of them meanwhile.
+    """
+    removed = []
+    removing = {snapshot['id'] for snapshot in rows}
+
+    async with store_lock:
+        # Newest first, incremental snapshots are always newer than the ones they are based on
+        for snapshot in sorted(rows, key=lambda row: row['id'], reverse=True):
+            c.execute('''SELECT DISTINCT snapshot_id FROM snapshot_files
+                         WHERE (source_id=? OR delta_base=?) AND snapshot_id!=?''',
+                      (snapshot['id'], snapshot['id'], snapshot['id']))
+            dependents = {row['snapshot_id'] for row in c.fetchall()}
+            if snapshots_in_use[snapshot['id']] > 0 or dependents - removing:
+                removing.discard(snapshot['id'])
+                continue
+
+            if snapshot['storage'] != 'store':
+                Path(snapshot['path']).unlink(missing_ok=True)
+            c.execute("DELETE FROM snapshots WHERE id=?", (snapshot['id'],))
+            c.execute("DELETE FROM snapshot_files WHERE snapshot_id=?", (snapshot['id'],))
+            removed.append(snapshot)
 
-    if excluded_entries:
-        c.executemany("DELETE FROM snapshots WHERE id=?", [(entry_id,) for entry_id in excluded_entries])
         conn.commit()
-        normal_embed.set_footer(text=f"Removed {len(excluded_entries)} entries that could not be found.", icon_url="")
 
-    normal_embed.title = '📸 World Snapshots'
+    if any(snapshot['storage'] == 'store' for snapshot in removed):
+        await _collect_store_garbage()
 
-    if normal_embed.fields:
-        await ctx.send(embed=normal_embed)
-    else:
-        normal_embed.description = 'No snapshots available.'
-        await ctx.send(embed=normal_embed)
+    return removed
+
+
+async def get_snapshot(ctx, snapshot_name):
+    c.execute("SELECT * FROM snapshots WHERE fancy_name=?", (snapshot_name,))
+    snapshot = c.fetchone()
+
+    if not snapshot:
+        embed = discord.Embed(
+            title=':x: Not Found',
+            description=f'Snapshot with the name "{snapshot_name}" not found.',
+            color=discord.Color.red()
+        )
+        await ctx.send(embed=embed)
+        return None
+
+    return snapshot
 
 
 async def create_snapshot(ctx, bot, *args):
-    if bot.server_running:
+    if bot.server_running and not HOT_SNAPSHOTS:
         embed = discord.Embed(
             title=':x: Server Running!',
             description='Cannot create a snapshot while the server is running.',
@@ -135,6 +650,10 @@ async def create_snapshot(ctx, bot, *args):
         await ctx.send(embed=embed)
         return
 
+    # Incremental snapshots only store what changed since the last snapshot
+    incremental = '--incremental' in args
+    args = [arg for arg in args if arg != '--incremental']
+
     # Join all arguments into a single string
     args_str = ' '.join(args)
 
@@ -171,7 +690,7 @@ async def create_snapshot(ctx, bot, *args):
 
     # Check if a snapshot with the given name doesn't exist already
     c.execute("SELECT * FROM snapshots WHERE fancy_name=?", (snapshot_name,))
-    if c.fetchone() is not None:
+    if c.fetchone() is not None or snapshot_name in pending_snapshots.values():
         embed = discord.Embed(
             title=':x: Already Exists!',
             description=f'A snapshot with the name "{snapshot_name}" already exists. Snapshot aborted.',
@@ -207,24 +726,34 @@ async def create_snapshot(ctx, bot, *args):
         color=discord.Color.blue()
     )
     waitembed = await ctx.send(embed=embed)
-
-    temp_folder = Path("temp_snapshot")
-    temp_folder.mkdir(exist_ok=True)
+    snapshot_filename = None
 
     try:
-        snapshots_folder = root_path / "snapshots"
-        world_folders = ["world", "world_nether", "world_the_end"]
+        source_folders = []
         skipped_folders = []
 
         for folder in world_folders:
             source_folder = root_path.parent / folder
-            destination_folder = temp_folder / folder
 
             if source_folder.exists():
-                shutil.copytree(str(source_folder), str(destination_folder))
+                source_folders.append(source_folder)
             else:
                 skipped_folders.append(folder)
 
+        # Refuse early rather than filling up the disk halfway through
+        frozen = freezes_world(bot.server_running)
+        parent = _find_parent() if incremental else None
+        estimate = await preflight.estimate_create(source_folders, parent['id'] if parent else None,
+                                                   FREEZE_METHOD if frozen else None)
+        missing = preflight.check_space(estimate)
+        if missing:
+            await waitembed.edit(embed=preflight.space_embed(estimate, missing))
+            return
+
+        embed.description += preflight.describe(estimate)
+        await waitembed.edit(embed=embed)
+        status_embed = embed
+
         # Draft a success message
         embed = discord.Embed(
             title=':white_check_mark: Snapshot Created!',
@@ -238,21 +767,36 @@ async def create_snapshot(ctx, bot, *args):
                                              for folder in skipped_folders])
             embed.description += f'\n\n{skipped_folders_text}'  # Add skipped folder notifications
 
-        snapshot_filename = f"snapshot_{int(time.time())}"
-        snapshot_path = snapshots_folder / snapshot_filename
-
-        shutil.make_archive(str(snapshot_path), 'zip', str(temp_folder))
-        file_size = snapshot_path.with_suffix('.zip').stat().st_size
-        current_date = time.strftime('%Y-%m-%d %H:%M:%S')
+        snapshot_filename = _new_snapshot_filename()
+        pending_snapshots[snapshot_filename] = snapshot_name
+        job = {'filename': snapshot_filename, 'name': snapshot_name, 'description': snapshot_description,
+               'source_folders': source_folders, 'base_path': None, 'incremental': incremental, 'pause': None,
+               'embed': embed, 'message': waitembed, 'status': status_embed}
+
+        if frozen:
+            # Freeze the world first, a running server only has to pause saving for as long as that takes
+            job['source_folders'], job['pause'] = await _freeze_world(source_folders, snapshot_filename,
+                                                                      bot.server_running)
+            job['base_path'] = frozen_path / snapshot_filename
+
+        if frozen and BACKGROUND_ARCHIVING:
+            frozen_embed = discord.Embed(
+                title=':ice_cube: Snapshot Frozen',
+                description=f'The world is frozen for snapshot "{snapshot_name}", archiving it in the background...',
+                color=discord.Color.blue()
+            )
+            await waitembed.edit(embed=frozen_embed)
+            job['status'] = frozen_embed
 
-        c.execute("INSERT INTO snapshots(filename, fancy_name, path, file_size, date, notes) VALUES (?, ?, ?, ?, ?, ?)",
-                  (f"{snapshot_filename}.zip", snapshot_name, str(snapshot_path.with_suffix('.zip')),
-                   file_size, current_date, snapshot_description))
-        conn.commit()
+            task = asyncio.create_task(_archive_snapshot(job))
+            background_tasks.add(task)  # Keep a reference until it is done
+            task.add_done_callback(background_tasks.discard)
+            return
 
-        await waitembed.edit(embed=embed)  # Send success message
+        await _archive_snapshot(job)
 
     except Exception as e:
+        pending_snapshots.pop(snapshot_filename, None)
         embed = discord.Embed(
             title=":x: Snapshot Failed!",
             description=f'Failed to create snapshot: {str(e)}',
@@ -260,9 +804,6 @@ async def create_snapshot(ctx, bot, *args):
         )
         await waitembed.edit(embed=embed)
 
-    finally:
-        shutil.rmtree(temp_folder, ignore_errors=True)
-
 
 async def delete_snapshot(ctx, bot, snapshot_name):
     snapshot = await get_snapshot(ctx, snapshot_name)
@@ -271,82 +812,38 @@ async def delete_snapshot(ctx, bot, snapshot_name):
 
     snapshot_id = snapshot[0]
     fancy_name = snapshot[2]
-    file_path = Path(snapshot[3])
-
-    embed = discord.Embed(
-        title=':warning: Snapshot Deletion',
-        description=f'Are you sure you want to delete the snapshot "{fancy_name}"?',
-        color=discord.Color.yellow()
-    )
-
-    message = await ctx.send(embed=embed)
-
-    # Use the utility function to get user reaction
-    reaction, _ = await utils.get_user_reaction(bot, message, ctx.author, ['✅', '❌'])
 
-    if reaction is None:
+    # Incremental snapshots still read unchanged files from the archives they are based on
+    c.execute('''SELECT DISTINCT snapshots.fancy_name FROM snapshot_files
+                 JOIN snapshots ON snapshots.id = snapshot_files.snapshot_id
+                 WHERE (snapshot_files.source_id=? OR snapshot_files.delta_base=?)
+                 AND snapshot_files.snapshot_id!=?''', (snapshot_id, snapshot_id, snapshot_id))
+    dependents = [row['fancy_name'] for row in c.fetchall()]
+    if dependents:
+        dependents_text = ', '.join(f'"{name}"' for name in dependents)
         embed = discord.Embed(
-            description=f':x: Snapshot deletion process timed out for "{fancy_name}".',
-            color=discord.Color.red()
-        )
-        await message.edit(embed=embed)
-        await message.clear_reactions()
-        return
-
-    if str(reaction.emoji) == '✅':
-        file_path.unlink()  # Use Path.unlink() to delete the file
-        c.execute("DELETE FROM snapshots WHERE id=?", (snapshot_id,))
-        conn.commit()
-
-        embed = discord.Embed(
-            title=':wastebasket: Snapshot Deleted',
-            description=f'Snapshot "{fancy_name}" has been deleted.',
-            color=discord.Color.green()
-        )
-        await message.edit(embed=embed)
-        await message.clear_reactions()
-    else:
-        embed = discord.Embed(
-            title=':x: Snapshot Deletion',
-            description=f'Snapshot deletion process aborted for "{fancy_name}".',
+            title=':x: Snapshot In Use',
+            description=f'Snapshot "{fancy_name}" cannot be deleted, '
+                        f'the incremental snapshot(s) {dependents_text} are based on it.',
             color=discord.Color.red()
         )
-        await message.edit(embed=embed)
-        await message.clear_reactions()
-
-
-async def restore_snapshot(ctx, bot, snapshot_name):
-    if bot.server_running:
-        embed = discord.Embed(
-            title=':x: Server Running!',
-            description='Cannot restore a snapshot while the server is running.',
-            color=discord.Color.red())
         await ctx.send(embed=embed)
         return
 
-    # Fetch the snapshot from the database
-    snapshot = await get_snapshot(ctx, snapshot_name)
-    if not snapshot:
-        return
-
-    fancy_name = snapshot[2]
-    snapshot_path = Path(snapshot[3])
-
-    # Prompt user for confirmation before restoring
     embed = discord.Embed(
-        title=':tools: Restore Snapshot',
-        description=f'Are you sure you want to restore the snapshot "{fancy_name}"?\n\
-                      This will create a new snapshot before restoring and overwrite the current world data.',
+        title=':warning: Snapshot Deletion',
+        description=f'Are you sure you want to delete the snapshot "{fancy_name}"?',
         color=discord.Color.yellow()
     )
+
     message = await ctx.send(embed=embed)
 
-    # Use the utility function to handle reactions
+    # Use the utility function to get user reaction
     reaction, _ = await utils.get_user_reaction(bot, message, ctx.author, ['✅', '❌'])
 
     if reaction is None:
         embed = discord.Embed(
-            description=f':x: Snapshot restoration process timed out for "{fancy_name}".',
+            description=f':x: Snapshot deletion process timed out for "{fancy_name}".',
             color=discord.Color.red()
         )
         await message.edit(embed=embed)
@@ -354,121 +851,25 @@ async def restore_snapshot(ctx, bot, snapshot_name):
         return
 
     if str(reaction.emoji) == '✅':
-        await create_snapshot(ctx, bot)
-        await message.delete()
-
-        # Prepare embed to update during the process
-        embed = discord.Embed(
-            description=f':rocket: Restoring snapshot "{fancy_name}"...\n',
-            color=discord.Color.blue()
-        )
-        message = await ctx.send(embed=embed)
-
-        world_folders = ["world", "world_nether", "world_the_end"]
-        temp_folder = Path("temp_restore")
-        temp_folder.mkdir(exist_ok=True)
-
-        try:
-            # Unpack the snapshot archive
-            shutil.unpack_archive(str(snapshot_path), str(temp_folder))
-
-            # Check if the main "world" folder exists in the snapshot
-            main_world_folder = temp_folder / "world"
-            if not main_world_folder.exists():
-                embed = discord.Embed(
-                    title=':x: Snapshot Restoring Failed!',
-                    description='The main world folder is missing from the snapshot. Aborting restore.',
-                    color=discord.Color.red()
-                )
-                await message.edit(embed=embed)
-                shutil.rmtree(temp_folder, ignore_errors=True)
-                return
-
-            skipped_folders = []
-            for folder in world_folders:
-                source_folder = temp_folder / folder
-                dest_folder = root_path.parent / folder
-
-                if source_folder.exists():
-                    # Remove the old folder and replace it
-                    shutil.rmtree(dest_folder, ignore_errors=True)
-                    shutil.move(str(source_folder), str(dest_folder))
-                else:
-                    skipped_folders.append(folder)
-
-            # Draft an embed with success message
+        if await remove_snapshots([snapshot]):
             embed = discord.Embed(
-                title=':white_check_mark: Snapshot Restored!',
-                description=f'Snapshot "{fancy_name}" has been successfully restored.',
+                title=':wastebasket: Snapshot Deleted',
+                description=f'Snapshot "{fancy_name}" has been deleted.',
                 color=discord.Color.green()
             )
-
-            # Set message for skipped folders
-            if skipped_folders:
-                skipped_folders_text = "\n".join([f':warning: Skipping folder "{folder}"\
-                                                  as it was not found in the snapshot.' for folder in skipped_folders])
-                embed.description += f'\n\n{skipped_folders_text}'  # Add skipped folder notifications
-
-            shutil.rmtree(temp_folder, ignore_errors=True)
-
-            await message.edit(embed=embed)  # Send Success Message
-
-        except Exception as e:
-            # Catch all exceptions and report them in Discord
+        else:
             embed = discord.Embed(
-                title=':x: Snapshot Restoring Failed!',
-                description=f'Failed to restore snapshot: {str(e)}',
+                title=':x: Snapshot In Use',
+                description=f'Snapshot "{fancy_name}" is being restored, downloaded or checked, try again later.',
                 color=discord.Color.red()
             )
-            await ctx.send(embed=embed)
-            shutil.rmtree(temp_folder, ignore_errors=True)
-    else:
-        embed = discord.Embed(
-            title=':x: Restore Snapshot Aborted!',
-            description=f'Snapshot restoration process aborted for "{fancy_name}".',
-            color=discord.Color.red()
-        )
         await message.edit(embed=embed)
         await message.clear_reactions()
-
-
-async def download_snapshot(ctx, snapshot_name):
-    snapshot = await get_snapshot(ctx, snapshot_name)
-    if not snapshot:
-        return
-
-    snapshot_path = Path(snapshot[3])
-    if not snapshot_path.exists():
-        embed = discord.Embed(
-            title=':x: Not Found',
-            description=f'Snapshot file for "{snapshot_name}" not found.',
-            color=discord.Color.red()
-        )
-        await ctx.send(embed=embed)
-        return
-
-    embed = discord.Embed(
-        title=':hourglass: Uploading Snapshot...',
-        description=f'Starting upload for snapshot "{snapshot_name}", please wait...',
-        color=discord.Color.blue()
-        )
-    message = await ctx.send(embed=embed)
-
-    try:
-        file = discord.File(str(snapshot_path), filename=snapshot_path.name)
-
-        embed = discord.Embed(
-            title=':cloud: Snapshot Uploaded',
-            description=f'Snapshot "{snapshot_name}" has been successfully uploaded.',
-            color=discord.Color.green()
-        )
-        await ctx.send(embed=embed, file=file)
-        await message.delete()
-
-    except Exception as e:
+    else:
         embed = discord.Embed(
-            title=':x: Snapshot Upload Failed!',
-            description=f'Failed to upload snapshot "{snapshot_name}": {str(e)}',
+            title=':x: Snapshot Deletion',
+            description=f'Snapshot deletion process aborted for "{fancy_name}".',
             color=discord.Color.red()
         )
-        await message.edit(embed=embed)
\ No newline at end of file
+        await message.edit(embed=embed)
+        await message.clear_reactions()
\ No newline at end of file
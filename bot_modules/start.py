@@ -4,7 +4,8 @@ start.py
 Version 1.3.0
 
 This modules houses all logic for starting the Minecraft server with the assigned configuration,
-starting the Ngrok tunnel and sending the IP in chat.
+starting the Ngrok tunnel and sending the IP in chat. The server runs as a child process of the
+bot (see supervisor.py), which is ready as soon as the server logs that it is done starting.
 
 Functions
     - fetch_ngrok_url(): (Internal) Fetches the public Ngrok tunnel IP to send in chat.
@@ -14,11 +15,14 @@ Functions
 Notes:
     - The module uses Discord's embed functionality to communicate with users in
       a visually appealing manner.
+    - A start that takes longer than `startup_timeout` is reported as failed, but the server
+      keeps starting, and counts as running once it is ready.
 """
 
 # Standard library imports
 import asyncio
 import logging
+import statistics
 import subprocess
 import configparser
 from pathlib import Path
@@ -27,7 +31,7 @@ from pathlib import Path
 import discord
 
 # First-party imports
-from bot_modules import utils
+from bot_modules import supervisor, utils
 
 
 logging.basicConfig(
@@ -52,10 +56,10 @@ NGROK_PATH = root_path.parent / 'ngrok.exe'
 
 # Function to start the Minecraft server
 async def start_server(ctx, bot):
-    if bot.server_running:
+    if bot.server_running or supervisor.running_server():
         embed = discord.Embed(
             title=':x: Server Running',
-            description='The Minecraft server is already running.',
+            description='The Minecraft server is already running (or still starting).',
             color=discord.Color.red())
         await ctx.send(embed=embed)
         return
@@ -78,29 +82,45 @@ async def start_server(ctx, bot):
     message = await ctx.send(embed=embed)
 
     # Prepare the command to start the server
-    COMMAND = f'java -Xmx{MAXRAM} -Xms{MINRAM} -DIReallyKnowWhatIAmDoingISwear -jar "{JAR}"'
-    logging.info("Starting server with command: %s", COMMAND)
-
-    # Start the server process
-    subprocess.Popen(
-        COMMAND,
-        shell=True,
-        stdout=subprocess.DEVNULL,  # Suppress standard logs
-        stderr=subprocess.DEVNULL,   # Suppress error logs
-        cwd=root_path.parent  # Make sure it uses the actual server directory rather than scripts
-    )
-    # Wait for the server to be ready
-    await asyncio.sleep(10)
-
-    # Check if the server is reachable
-    for attempt in range(5):
-        logging.debug("Checking server state... Attempt %d/5", attempt + 1)
-        bot.server_running = utils.check_server_running(host='localhost', port=PORT)
-
-        if bot.server_running:
-            logging.info("Local server started successfully")
-            break
-        await asyncio.sleep(2)  # Wait before the next check
+    COMMAND = ['java', f'-Xmx{MAXRAM}', f'-Xms{MINRAM}', '-DIReallyKnowWhatIAmDoingISwear', '-jar', str(JAR)]
+    logging.info("Starting server with command: %s", ' '.join(COMMAND))
+
+    # Start the server process, in the actual server directory rather than scripts
+    try:
+        server = await supervisor.launch_server(COMMAND, root_path.parent, bot)
+    except FileNotFoundError:
+        logging.error("Java could not be found")
+        embed = discord.Embed(
+            title=':x: Fatal Error',
+            description='Java could not be found, failed to start server.',
+            color=discord.Color.red())
+        await message.edit(embed=embed)
+        return False
+
+    # Previous startup times, to compare this one with
+    previous_times = supervisor.startup_times()
+
+    # Wait for the server to log that it is ready
+    if not await server.wait_until_ready():
+        if server.exited:
+            logging.error("Server stopped while starting")
+            output = server.last_output()[-1500:]
+            description = f'The server stopped while starting, its last output:\n```\n{output}\n```'
+        else:
+            logging.error("Server did not start within %d seconds", supervisor.STARTUP_TIMEOUT)
+            description = (f'The server did not finish starting within {supervisor.STARTUP_TIMEOUT} seconds. '
+                           'It keeps starting in the background, check `$status` in a while.')
+        embed = discord.Embed(
+            title=':x: Server Error!',
+            description=description,
+            color=discord.Color.red())
+        await message.edit(embed=embed)
+        return bot.server_running
+
+    logging.info("Local server started successfully")
+    startup_time = f'Started in {server.startup_time:.1f} seconds'
+    if previous_times:
+        startup_time += f' (usually {statistics.median(previous_times):.1f} seconds)'
 
     # Notify users if the server is up
     if bot.server_running:
@@ -124,7 +144,7 @@ async def start_server(ctx, bot):
             embed = discord.Embed(
                 title=':white_check_mark: Server Started!',
                 description=f"The Minecraft server has started successfully.\n\
-                                The server is now accessible at: **{public_ip}**",
+                                The server is now accessible at: **{public_ip}**\n{startup_time}.",
                 color=discord.Color.green()
             )
             await message.edit(embed=embed)
@@ -143,3 +163,4 @@ async def start_server(ctx, bot):
             color=discord.Color.red())
 
     await message.edit(embed=embed)
+    return bot.server_running
@@ -0,0 +1,258 @@
+"""
+store.py
+
+Version: 1.3.0
+
+This module houses the content-addressed object store used for deduplicated
+world snapshots. Files are split into fixed-size chunks, every chunk is stored
+once under the SHA-256 hash of its contents, and a snapshot is nothing more than
+a manifest listing which chunks make up which file.
+
+Functions:
+    - store_tree(entries, chunk_size, progress): Stores the files of a scanned manifest and
+      returns the amount of new data written per compression rule.
+    - restore_tree(entries, destination, progress): Rebuilds the files of a manifest into a folder in parallel.
+    - export_zip(entries, zip_path, progress): Rebuilds the files of a manifest into a zip archive.
+    - verify_tree(entries, throttle, workers): Reads back the objects of a manifest and checks their hashes.
+    - collect_garbage(referenced): Removes all objects no manifest refers to anymore.
+
+Attributes:
+    - objects_path: The folder holding all stored objects.
+
+Notes:
+    - All functions in this module block on disk I/O and are meant to be run
+      in a worker thread (`asyncio.to_thread`).
+    - Objects are stored with a one byte header telling whether the payload is
+      zlib compressed (`Z`), zstd compressed (`S`) or stored as-is (`N`), so incompressible
+      chunks such as region file sectors don't grow. New objects use the codec of their
+      file's compression rule (see compression.py); objects of any kind can always be read back.
+"""
+
+
+# Standard library imports
+import concurrent.futures
+import hashlib
+import os
+import threading
+import zipfile
+import zlib
+from pathlib import Path
+
+# First-party imports
+from bot_modules import compression
+
+
+script_path = Path(__file__).resolve().parent
+root_path = script_path.parent
+
+objects_path = root_path / 'snapshots' / 'objects'
+
+
+def _object_path(chunk_hash):
+    return objects_path / chunk_hash[:2] / chunk_hash
+
+
+def _write_object(chunk_hash, data, codec):
+    """Writes a chunk to the store unless it is already there. Returns the number of bytes written."""
+    object_path = _object_path(chunk_hash)
+    if object_path.exists():
+        return 0
+
+    if codec == 'zstd':
+        payload = b'S' + compression.zstandard.ZstdCompressor(level=compression.level_for(codec)).compress(data)
+    elif codec == 'deflate':
+        payload = b'Z' + zlib.compress(data, compression.level_for(codec))
+    else:
+        payload = b'N' + data
+    if len(payload) > len(data):
+        payload = b'N' + data
+
+    object_path.parent.mkdir(parents=True, exist_ok=True)
+    # Files are stored in parallel, and two of them may share a chunk
+    partial_path = object_path.with_name(f"{chunk_hash}.{threading.get_ident()}.partial")
+    partial_path.write_bytes(payload)
+    partial_path.replace(object_path)
+    return len(payload)
+
+
+def _read_object(chunk_hash):
+    payload = _object_path(chunk_hash).read_bytes()
+    if payload[:1] == b'Z':
+        data = zlib.decompress(payload[1:])
+    elif payload[:1] == b'S':
+        if compression.zstandard is None:
+            raise ValueError(f"Object {chunk_hash} is zstd compressed, which requires the `zstandard` package")
+        data = compression.zstandard.ZstdDecompressor().decompress(payload[1:])
+    else:
+        data = payload[1:]
+
+    if hashlib.sha256(data).hexdigest() != chunk_hash:
+        raise ValueError(f"Object {chunk_hash} is corrupted")
+    return data
+
+
+def store_file(file_path, chunk_size, codec=compression.CODEC):
+    """
+    Stores a single file in chunks of `chunk_size` bytes, compressed with `codec`.
+
+    Returns a tuple of the SHA-256 hash of the whole file, the list of chunk hashes
+    and the number of bytes that were new to the store.
+    """
+    file_hash = hashlib.sha256()
+    chunks = []
+    new_bytes = 0
+
+    with open(file_path, 'rb') as file:
+        while data := file.read(chunk_size):
+            file_hash.update(data)
+            chunk_hash = hashlib.sha256(data).hexdigest()
+            new_bytes += _write_object(chunk_hash, data, codec)
+            chunks.append(chunk_hash)
+
+    return file_hash.hexdigest(), chunks, new_bytes
+
+
+def store_tree(entries, chunk_size, progress=None):
+    """
+    Stores the files of scanned manifest entries (see `archive.scan_tree`).
+
+    Entries which already carry their chunks, because they are unchanged since the parent
+    snapshot, are not read again. Files are stored by a pool of threads (the compressors release
+    the GIL), each with the codec of its compression rule. The hash, size and chunks of every
+    stored file are recorded in its entry, and `progress` (if given) is called with the size of
+    every file stored. Returns the bytes read and the new bytes stored per
+    compression rule (see `compression.add_stats`).
+    """
+    stats = {}
+    pending = {}
+
+    with concurrent.futures.ThreadPoolExecutor(compression.WORKERS) as pool:
+        for entry in entries:
+            if entry['path'].endswith('/'):
+                entry['chunks'] = []
+                continue
+
+            if entry.get('chunks'):
+                continue
+
+            rule, codec = compression.choose_codec(entry['path'])
+            pending[pool.submit(store_file, entry['full_path'], chunk_size, codec)] = (entry, rule, codec)
+
+        for future, (entry, rule, codec) in pending.items():
+            entry['hash'], entry['chunks'], new_bytes = future.result()
+            compression.add_stats(stats, rule, codec, entry['size'], new_bytes)
+            if progress is not None:
+                progress(entry['size'])
+
+    return stats
+
+
+def _write_entry(entry, file):
+    file_hash = hashlib.sha256()
+    for chunk_hash in entry['chunks']:
+        data = _read_object(chunk_hash)
+        file_hash.update(data)
+        file.write(data)
+
+    if file_hash.hexdigest() != entry['hash']:
+        raise ValueError(f"File {entry['path']} does not match its manifest")
+
+
+def _restore_file(entry, destination):
+    target = Path(destination) / entry['path']
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with open(target, 'wb') as file:
+        _write_entry(entry, file)
+    os.utime(target, ns=(entry['mtime'], entry['mtime']))
+
+
+def restore_tree(entries, destination, progress=None):
+    """Rebuilds all files of a manifest inside `destination`, using a pool of threads, calling `progress` per file."""
+    files = []
+    for entry in entries:
+        if entry['path'].endswith('/'):
+            (Path(destination) / entry['path']).mkdir(parents=True, exist_ok=True)
+        else:
+            files.append(entry)
+
+    def restore(entry):
+        _restore_file(entry, destination)
+        if progress is not None:
+            progress(entry['size'])
+
+    with concurrent.futures.ThreadPoolExecutor(compression.WORKERS) as pool:
+        for future in [pool.submit(restore, entry) for entry in files]:
+            future.result()
+
+
+def verify_tree(entries, throttle=None, workers=None):
+    """
+    Reads back every object a manifest uses, checking it against its hash.
+
+    Objects shared by several files are only read once. Objects are read by a pool of threads,
+    and `throttle` (if given) is called with the size of every object read so it can limit the
+    read rate. Returns the number of objects and bytes checked, or raises a ValueError naming the
+    first few damaged or missing objects.
+    """
+    chunk_hashes = {chunk_hash for entry in entries for chunk_hash in entry['chunks']}
+    problems = []
+
+    def check(chunk_hash):
+        try:
+            size = _object_path(chunk_hash).stat().st_size
+            if throttle is not None:
+                throttle(size)
+            _read_object(chunk_hash)
+        except (OSError, ValueError, zlib.error) as e:
+            problems.append(f"{chunk_hash} ({e})")
+            return 0
+        return size
+
+    with concurrent.futures.ThreadPoolExecutor(workers or compression.WORKERS) as pool:
+        checked_bytes = sum(pool.map(check, chunk_hashes))
+
+    if problems:
+        raise ValueError(f"{len(problems)} objects are damaged or missing: {', '.join(sorted(problems)[:5])}")
+    return len(chunk_hashes), checked_bytes
+
+
+def export_zip(entries, zip_path, progress=None):
+    """Rebuilds all files of a manifest into a zip archive, e.g. for downloading, calling `progress` per file."""
+    with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+        for entry in entries:
+            if entry['path'].endswith('/'):
+                archive.writestr(entry['path'], b'')
+                continue
+
+            with archive.open(entry['path'], 'w', force_zip64=entry['size'] > zipfile.ZIP64_LIMIT) as file:
+                _write_entry(entry, file)
+            if progress is not None:
+                progress(entry['size'])
+
+
+def collect_garbage(referenced):
+    """
+    Removes every object whose hash is not in `referenced`.
+
+    Returns a tuple of the number of objects removed and the bytes freed.
+    """
+    removed = 0
+    freed = 0
+
+    if not objects_path.exists():
+        return removed, freed
+
+    with os.scandir(objects_path) as prefixes:
+        for prefix in prefixes:
+            if not prefix.is_dir():
+                continue
+
+            with os.scandir(prefix.path) as objects:
+                for stored_object in objects:
+                    if stored_object.name in referenced:
+                        continue
+                    freed += stored_object.stat().st_size
+                    os.unlink(stored_object.path)
+                    removed += 1
+
+    return removed, freed
\ No newline at end of file
@@ -0,0 +1,193 @@
+"""
+supervisor.py
+
+Version: 1.3.0
+
+This module runs the Minecraft server as a child process of the bot. It keeps the process
+handle and reads everything the server logs line by line, so it knows the server is ready
+the moment it logs `Done (12.345s)! For help, type "help"`, instead of waiting a fixed
+time and guessing from the port, and knows right away when the server stops or crashes.
+The startup time of every run is recorded in the database.
+
+Functions:
+    - launch_server(command, cwd, bot): Starts the server process and returns it.
+    - running_server(): Returns the server process the bot started, while it runs.
+    - startup_times(count): Returns how long the last runs took to start, newest first.
+
+Classes:
+    - ServerProcess: The server running as a child process, whose output is read line by line.
+
+Attributes:
+    - conn: The SQLite connection to the database.
+    - c: The cursor object for executing SQL commands.
+    - STARTUP_TIMEOUT: How many seconds the server may take to start.
+    - STOP_TIMEOUT: How many seconds the server may take to stop.
+    - DONE_PATTERN: Matches the line the server logs once it is ready, with the time it took.
+
+Notes:
+    - The output has to be read for as long as the server runs, otherwise the server blocks
+      once the pipe is full. The last OUTPUT_LINES lines are kept, to show why a start failed.
+    - Java formats the time in the `Done` line in the system's locale, e.g. `12,345s`.
+"""
+
+
+# Standard library imports
+import asyncio
+import collections
+import configparser
+import logging
+import re
+import sqlite3
+import time
+from pathlib import Path
+
+
+script_path = Path(__file__).resolve().parent
+root_path = script_path.parent
+db_path = root_path / 'minecraft_manager.db'
+config_path = root_path / 'config.cfg'
+
+config = configparser.ConfigParser()
+config.read(config_path)
+
+STARTUP_TIMEOUT = config.getint('PythonConfig', 'startup_timeout', fallback=300)
+# Saving a large world when stopping can take a while
+STOP_TIMEOUT = 60
+OUTPUT_LINES = 200
+# Lines longer than this (e.g. a huge stack trace on one line) are partly dropped
+LINE_LIMIT = 1024 * 1024
+
+DONE_PATTERN = re.compile(r'\bDone \((\d+(?:[.,]\d+)?)s\)!')
+
+conn = sqlite3.connect(db_path)
+c = conn.cursor()
+
+c.execute('''CREATE TABLE IF NOT EXISTS server_runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at INTEGER NOT NULL,
+    startup_time REAL,
+    reported_time REAL,
+    stopped_at INTEGER,
+    exit_code INTEGER
+)''')
+conn.commit()
+
+# The server process started by the bot, while it runs
+processes = []
+
+
+class ServerProcess:
+    """
+    The Minecraft server running as a child process of the bot.
+
+    `ready` is set once the server logged that it is done starting, `startup_time` is how many
+    seconds that took since the process was started (`reported_time` is what the server logged).
+    `bot.server_running` is kept up to date, including when the server stops or crashes.
+    """
+
+    def __init__(self, process, bot):
+        self.process = process
+        self.bot = bot
+        self.start_time = time.monotonic()
+        self.ready = asyncio.Event()
+        self.startup_time = None
+        self.reported_time = None
+        self.output = collections.deque(maxlen=OUTPUT_LINES)
+
+        c.execute("INSERT INTO server_runs (started_at) VALUES (?)", (int(time.time()),))
+        conn.commit()
+        self.run_id = c.lastrowid
+        self.reader_task = asyncio.create_task(self._read_output())
+
+    @property
+    def exited(self):
+        """Whether the server process has exited."""
+        return self.reader_task.done()
+
+    def _check_ready(self, line):
+        match = DONE_PATTERN.search(line)
+        if match is None:
+            return
+
+        self.startup_time = round(time.monotonic() - self.start_time, 3)
+        self.reported_time = float(match[1].replace(',', '.'))
+        c.execute("UPDATE server_runs SET startup_time=?, reported_time=? WHERE id=?",
+                  (self.startup_time, self.reported_time, self.run_id))
+        conn.commit()
+
+        self.bot.server_running = True
+        self.ready.set()
+        logging.info("Server ready after %.1f s (it reported %.3f s)", self.startup_time, self.reported_time)
+
+    async def _read_output(self):
+        """Reads the server's output line by line until the process exits, then records how it exited."""
+        while True:
+            try:
+                line = await self.process.stdout.readline()
+            except ValueError:
+                continue  # Longer than LINE_LIMIT, what was buffered of it is dropped
+            if not line:
+                break
+
+            line = line.decode('utf-8', errors='replace').rstrip()
+            self.output.append(line)
+            if not self.ready.is_set():
+                self._check_ready(line)
+
+        exit_code = await self.process.wait()
+        c.execute("UPDATE server_runs SET stopped_at=?, exit_code=? WHERE id=?",
+                  (int(time.time()), exit_code, self.run_id))
+        conn.commit()
+
+        processes.remove(self)
+        self.bot.server_running = False
+        logging.log(logging.INFO if exit_code == 0 else logging.ERROR,
+                    "Server process exited with code %d after %.0f s", exit_code, time.monotonic() - self.start_time)
+
+    async def wait_until_ready(self, timeout=STARTUP_TIMEOUT):
+        """Waits until the server is ready and returns True, or False when it exits or `timeout` passes first."""
+        ready_task = asyncio.create_task(self.ready.wait())
+        await asyncio.wait([ready_task, self.reader_task], timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        ready_task.cancel()
+        return self.ready.is_set()
+
+    async def wait_until_stopped(self, timeout=STOP_TIMEOUT):
+        """Waits until the server process exits, returning whether it did within `timeout` seconds."""
+        await asyncio.wait([self.reader_task], timeout=timeout)
+        return self.exited
+
+    def last_output(self, lines=10):
+        """Returns the last lines the server logged."""
+        return '\n'.join(list(self.output)[-lines:])
+
+
+async def launch_server(command, cwd, bot):
+    """
+    Starts the server with `command` (a list of arguments) in the folder `cwd` and returns its ServerProcess.
+
+    Raises a FileNotFoundError when the program (e.g. `java`) cannot be found.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdin=asyncio.subprocess.PIPE,  # Left open, like an idle console
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        cwd=cwd,
+        limit=LINE_LIMIT
+    )
+    server = ServerProcess(process, bot)
+    processes.append(server)
+    logging.info("Started server process %d", process.pid)
+    return server
+
+
+def running_server():
+    """Returns the ServerProcess the bot started, while it runs, otherwise None."""
+    return processes[-1] if processes else None
+
+
+def startup_times(count=10):
+    """Returns how many seconds the last `count` runs that got ready took to start, newest first."""
+    c.execute("SELECT startup_time FROM server_runs WHERE startup_time IS NOT NULL ORDER BY id DESC LIMIT ?",
+              (count,))
+    return [row[0] for row in c.fetchall()]
@@ -14,38 +14,33 @@ Functions:
       including sending DMs, handling user input, and updating the database.
 
 Attributes:
-    - RCON_HOST: The host address for the Minecraft server RCON.
-    - RCON_PORT: The port for the Minecraft server RCON.
-    - RCON_PASSWORD: The password for the Minecraft server RCON.
     - BOT_VERSION: The current version of the bot.
 
 Notes:
     - The verification process requires that the Minecraft server is running.
     - Users must provide their Minecraft username, which is checked against
       the server's online players before verification.
-    - The module uses the `mcrcon` library to interact with the Minecraft server.
+    - The module sends commands to the Minecraft server over the shared RCON
+      connection pool (see rcon.py).
 """
 
 
 # Standard library imports
 import asyncio
-import configparser
 import random
 import sqlite3
 from pathlib import Path
 
 # Third-party imports
 import discord
-import mcrcon
 
 # First-party imports
-from bot_modules import utils
+from bot_modules import rcon, utils
 
 
 script_path = Path(__file__).resolve().parent
 root_path = script_path.parent
 db_path = root_path / 'minecraft_manager.db'
-config_path = root_path / 'config.cfg'
 
 conn = sqlite3.connect(db_path)
 c = conn.cursor()
@@ -54,13 +49,6 @@ c.execute('''CREATE TABLE IF NOT EXISTS verification (
                 minecraft_name TEXT
             )''')
 
-config = configparser.ConfigParser()
-config.read(config_path)
-
-RCON_HOST = config.get('PythonConfig', 'rcon_host')
-RCON_PORT = int(config.get('PythonConfig', 'rcon_port'))
-RCON_PASSWORD = config.get('PythonConfig', 'rcon_password')
-
 
 async def verify(ctx, bot):
     if not bot.server_running:
@@ -134,9 +122,8 @@ async def verify(ctx, bot):
         return
 
     try:
-        with mcrcon.MCRcon(RCON_HOST, RCON_PASSWORD, port=RCON_PORT) as rcon:
-            response = rcon.command('list')
-    except mcrcon.MCRconException:
+        response = await rcon.send_command('list')
+    except (rcon.RconError, TimeoutError):
         embed = discord.Embed(
             description=':x: An error occurred while executing the "list" command in the Minecraft server.',
             color=discord.Color.red()
@@ -155,9 +142,8 @@ async def verify(ctx, bot):
     verification_code = ''.join(random.choices('0123456789', k=6))
 
     try:
-        with mcrcon.MCRcon(RCON_HOST, RCON_PASSWORD, port=RCON_PORT) as rcon:
-            rcon.command(f'w {minecraft_username} Discord verification code: {verification_code}')
-    except mcrcon.MCRconException:
+        await rcon.send_command(f'w {minecraft_username} Discord verification code: {verification_code}')
+    except (rcon.RconError, TimeoutError):
         embed = discord.Embed(
             description=':x: An error occurred while sending the verification code to the Minecraft server.',
             color=discord.Color.red()
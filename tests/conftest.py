@@ -0,0 +1,44 @@
+"""
+conftest.py
+
+Version: 1.3.0
+
+Sets up the bot for the tests the way it is installed next to a server: the bot_modules
+package is copied into a temporary folder with a config.cfg and database of its own, so
+importing it neither needs the owner's settings nor touches the real database or snapshots.
+
+Notes:
+    - The modules read config.cfg when they are imported, both from the folder above the
+      package and from the working directory, so both are set up before the first import.
+"""
+
+
+# Standard library imports
+import configparser
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+
+repo_path = Path(__file__).resolve().parent.parent
+bot_path = Path(tempfile.mkdtemp(prefix='minecraft-manager-tests-'))
+
+shutil.copytree(repo_path / 'bot_modules', bot_path / 'bot_modules',
+                ignore=shutil.ignore_patterns('__pycache__'))
+
+config = configparser.ConfigParser()
+config.read(repo_path / 'config.cfg')
+config.set('PythonConfig', 'bot_owner_id', '0')
+config.set('PythonConfig', 'rcon_password', 'password')
+with open(bot_path / 'config.cfg', 'w', encoding='utf-8') as config_file:
+    config.write(config_file)
+
+os.chdir(bot_path)
+sys.path.insert(0, str(bot_path))
+
+
+def pytest_sessionfinish():
+    os.chdir(repo_path)
+    shutil.rmtree(bot_path, ignore_errors=True)
@@ -0,0 +1,48 @@
+"""
+test_compression.py
+
+Version: 1.3.0
+
+Tests that archives written block by block (see compression.py and archive.py) can be read
+back by zipfile, with the right CRC-32 and contents, whatever codec and size a file has.
+"""
+
+
+# Standard library imports
+import random
+import zipfile
+
+# First-party imports
+from bot_modules import archive, compression
+
+
+def test_blocks_join_into_valid_members(tmp_path):
+    rng = random.Random(0)
+    world = tmp_path / 'world'
+    (world / 'region').mkdir(parents=True)
+    (world / 'empty').mkdir()
+    files = {
+        # Several blocks, stored as they are by the default rules
+        'world/region/r.0.0.mca': rng.randbytes(2 * compression.BLOCK_SIZE + 12345),
+        # Several blocks, compressed with the configured codec
+        'world/level.bin': b'level data ' * (compression.BLOCK_SIZE // 5),
+        'world/exact.bin': bytes(compression.BLOCK_SIZE),
+        'world/small.bin': b'x',
+        'world/nothing.bin': b'',
+    }
+    for path, data in files.items():
+        (tmp_path / path).write_bytes(data)
+
+    entries = archive.scan_tree([world], tmp_path)
+    snapshot_path = tmp_path / 'snapshot.zip'
+    archive.write_archive(snapshot_path, entries)
+
+    with zipfile.ZipFile(snapshot_path) as snapshot:
+        assert snapshot.testzip() is None  # Checks the CRC-32 of every member
+        for path, data in files.items():
+            assert snapshot.getinfo(path).file_size == len(data)
+            with compression.open_member(snapshot, path) as member:
+                assert member.read() == data
+        assert 'world/empty/' in snapshot.namelist()
+
+    assert archive.verify_archive(snapshot_path, entries) == (len(files), sum(map(len, files.values())))
@@ -0,0 +1,171 @@
+"""
+test_mockserver.py
+
+Version: 1.3.0
+
+Tests the RCON client and the Server List Ping client against the stand-in server of
+mockserver.py: logging in, responses split over several packets, timeouts and dropped
+connections, and the vanilla server's rule of a single packet per read.
+"""
+
+
+# Standard library imports
+import asyncio
+
+# Third-party imports
+import pytest
+
+# First-party imports
+from bot_modules import rcon, slp
+from bot_modules.mockserver import FRAGMENT_SIZE, MockServer
+
+
+PASSWORD = 'password'
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, 30))
+
+
+def test_login_with_the_right_password():
+    async def scenario():
+        async with MockServer(PASSWORD, players=['Steve', 'Alex']) as server:
+            connection = await rcon.RconConnection.open(server.host, server.rcon_port, PASSWORD)
+            try:
+                responses = await connection.commands(['list', 'say hi'])
+            finally:
+                connection.close()
+            return server, responses
+
+    server, responses = run(scenario())
+    assert responses == ['There are 2 of a max of 20 players online: Steve, Alex', '']
+    assert server.commands == ['list', 'say hi']
+    assert server.rcon_logins == 1
+
+
+def test_login_with_a_wrong_password():
+    async def scenario():
+        async with MockServer(PASSWORD) as server:
+            pool = rcon.RconPool(server.host, server.rcon_port, 'wrong', 1)
+            try:
+                with pytest.raises(rcon.RconError, match='refused the RCON password'):
+                    await pool.command('list', 5)
+            finally:
+                pool.close()
+            return server
+
+    server = run(scenario())
+    assert server.rcon_logins == 0
+    assert server.commands == []
+
+
+@pytest.mark.parametrize('size', [FRAGMENT_SIZE - 1, FRAGMENT_SIZE, FRAGMENT_SIZE + 1, 3 * FRAGMENT_SIZE, 50000])
+def test_split_response_is_joined(size):
+    # Characters of two bytes, so a part ends in the middle of one when split by bytes
+    response = ('é' * 39 + '\n') * (size // 40) + 'x' * (size % 40)
+
+    async def scenario():
+        async with MockServer(PASSWORD, responses={'data': response}) as server:
+            pool = rcon.RconPool(server.host, server.rcon_port, PASSWORD, 1)
+            try:
+                return await pool.batch(['data get entity @p', 'list'], 5), server
+            finally:
+                pool.close()
+
+    (joined, after), server = run(scenario())
+    assert len(joined) == size
+    assert joined == response
+    assert after.startswith('There are 0 of a max of 20 players online')
+    assert server.rejected_reads == 0
+
+
+def test_timeout():
+    async def scenario():
+        async with MockServer(PASSWORD, latency=0.5) as server:
+            pool = rcon.RconPool(server.host, server.rcon_port, PASSWORD, 1)
+            try:
+                await pool.command('list', 5)
+                with pytest.raises(TimeoutError, match='did not answer `list`'):
+                    await pool.command('list', 0.1)
+                # The late response must not be taken for the answer to the next command
+                return await pool.command('say hi', 5)
+            finally:
+                pool.close()
+
+    assert run(scenario()) == ''
+
+
+def test_dropped_connection_is_reopened():
+    async def scenario():
+        async with MockServer(PASSWORD, failure_rate=1) as server:
+            pool = rcon.RconPool(server.host, server.rcon_port, PASSWORD, 1)
+            try:
+                with pytest.raises(rcon.RconError):
+                    await pool.command('list', 5)
+
+                server.failure_rate = 0
+                response = await pool.command('list', 5)
+                server.drop_connections()  # Like a restarting server
+                await asyncio.sleep(0.05)
+                return response, await pool.command('list', 5), server
+            finally:
+                pool.close()
+
+    before, after, server = run(scenario())
+    assert before == after
+    assert server.rcon_logins == 3
+
+
+def test_vanilla_drops_commands_sent_at_once():
+    async def scenario():
+        async with MockServer(PASSWORD) as server:
+            connection = await rcon.RconConnection.open(server.host, server.rcon_port, PASSWORD, pipelining=True)
+            try:
+                with pytest.raises(rcon.RconError):
+                    await connection.commands(['list', 'list', 'list'])
+            finally:
+                connection.close()
+            return server
+
+    server = run(scenario())
+    assert server.rejected_reads == 1
+
+
+def test_pipelining_server_accepts_commands_sent_at_once():
+    async def scenario():
+        async with MockServer(PASSWORD, pipelining=True, responses={'data': 'x' * 10000}) as server:
+            pool = rcon.RconPool(server.host, server.rcon_port, PASSWORD, 1, pipelining=True)
+            try:
+                return await asyncio.gather(*(pool.batch(['list', 'data', f'say {i}'], 5) for i in range(20)))
+            finally:
+                pool.close()
+
+    for responses in run(scenario()):
+        assert responses[1:] == ['x' * 10000, '']
+
+
+def test_query_status():
+    async def scenario():
+        async with MockServer(PASSWORD, players=['Steve'], motd='Hello', version='1.21.1') as server:
+            return await slp.query_status(server.host, server.port), server
+
+    status, server = run(scenario())
+    assert status['version'] == {'name': '1.21.1', 'protocol': 767}
+    assert status['players']['online'] == 1
+    assert status['players']['max'] == 20
+    assert status['players']['sample'][0]['name'] == 'Steve'
+    assert status['description'] == {'text': 'Hello'}
+    assert status['latency'] >= 0
+    assert server.status_requests == 1
+
+
+def test_query_status_of_a_closed_port():
+    async def scenario():
+        server = MockServer(PASSWORD)
+        await server.start()
+        port = server.port
+        await server.close()
+        with pytest.raises(OSError):
+            await slp.query_status('127.0.0.1', port)
+
+    run(scenario())
@@ -0,0 +1,259 @@
+"""
+test_regions.py
+
+Version: 1.3.0
+
+Tests the chunk level delta engine of regions.py on synthetic region files: every rebuilt
+file must hold exactly the chunks and timestamps of the original, through a chain of deltas
+with chunks changed, added and removed, large chunks and chunks stored in `.mcc` files.
+Also tests how archive.py stores region files of incremental snapshots as such chains.
+"""
+
+
+# Standard library imports
+import hashlib
+import os
+import random
+import struct
+
+# Third-party imports
+import pytest
+
+# First-party imports
+from bot_modules import archive, regions
+
+
+SECTOR_SIZE = regions.SECTOR_SIZE
+# Compression types of a stored chunk, 128 is added when the chunk lives in its own `.mcc` file
+ZLIB = 2
+EXTERNAL = 128
+
+
+def chunk(index, version, size=300):
+    """A stored chunk, its length, compression type and (stand-in) compressed data."""
+    data = f'chunk {index} version {version} '.encode('ascii')
+    data = (data * (size // len(data) + 1))[:size]
+    return struct.pack('>IB', len(data) + 1, ZLIB) + data
+
+
+def external_chunk():
+    """The stub a region file holds for a chunk too large for it, stored in `c.<x>.<z>.mcc` instead."""
+    return struct.pack('>IB', 1, ZLIB | EXTERNAL)
+
+
+def write_region(path, chunks, seed=0):
+    """
+    Writes a region file holding `chunks` (payload and timestamp by index), laid out like a
+    file the server has been saving to for a while: chunks in no particular order, free
+    sectors in between and some chunks with more sectors reserved than they need.
+    """
+    rng = random.Random(seed)
+    locations = [0] * regions.CHUNK_COUNT
+    timestamps = [0] * regions.CHUNK_COUNT
+    body = bytearray()
+    sector = regions.HEADER_SIZE // SECTOR_SIZE
+
+    indexes = list(chunks)
+    rng.shuffle(indexes)
+    for index in indexes:
+        payload, timestamp = chunks[index]
+        sector += rng.choice([0, 0, 1, 3])  # Sectors freed by chunks that moved
+        sector_count = -(-len(payload) // SECTOR_SIZE) + rng.choice([0, 0, 1])
+
+        body += b'\0' * ((sector - regions.HEADER_SIZE // SECTOR_SIZE) * SECTOR_SIZE - len(body))
+        body += payload.ljust(sector_count * SECTOR_SIZE, bytes([rng.randrange(256)]))
+        locations[index] = (sector << 8) | sector_count
+        timestamps[index] = timestamp
+        sector += sector_count
+
+    path.write_bytes(struct.pack('>1024I', *locations) + struct.pack('>1024I', *timestamps) + body)
+    return path
+
+
+def read_timestamps(region):
+    return regions._parse_header(region)[1]  # pylint: disable=protected-access
+
+
+def read_chunks(region):
+    """Returns the payload and timestamp of every chunk in a region file, by index."""
+    locations, timestamps = regions._parse_header(region)  # pylint: disable=protected-access
+    return {index: (regions._chunk_payload(region, location), timestamps[index])  # pylint: disable=protected-access
+            for index, location in enumerate(locations) if location[0] != 0}
+
+
+def versions():
+    """The chunks of a region file over five saves, each changing, adding and removing some."""
+    first = {index: (chunk(index, 0), 1000) for index in range(0, 600, 3)}
+
+    second = dict(first)
+    for index in range(0, 90, 3):
+        second[index] = (chunk(index, 1), 2000)  # Saved again
+    for index in range(1, 40, 3):
+        second[index] = (chunk(index, 1), 2000)  # Generated
+    for index in range(501, 600, 3):
+        del second[index]  # Removed, e.g. trimmed with an editor
+
+    third = dict(second)
+    third[3] = (chunk(3, 2, size=200 * SECTOR_SIZE), 3000)  # Grown to many sectors
+    third[6] = (external_chunk(), 3000)  # Grown too large, moved to its own file
+    third[1023] = (chunk(1023, 2), 3000)
+    third[0] = (chunk(0, 2, size=5), 3000)
+
+    fourth = dict(third)
+    fourth[3] = (chunk(3, 3), 4000)  # Shrunk back
+    fourth[6] = (chunk(6, 3), 4000)  # Back from its own file
+    del fourth[1023]
+    fourth[1023] = (chunk(1023, 3), 4000)  # Removed and generated again
+
+    fifth = dict(fourth)
+    fifth[9] = (external_chunk(), 5000)
+    del fifth[0]
+
+    return [first, second, third, fourth, fifth]
+
+
+def test_delta_chain_rebuilds_every_version(tmp_path):
+    chain = versions()
+    paths = [write_region(tmp_path / f'r.0.0.mca.{number}', chunks, seed=number)
+             for number, chunks in enumerate(chain)]
+
+    rebuilt = paths[0].read_bytes()
+    for previous, path, chunks in zip(paths, paths[1:], chain[1:]):
+        delta = regions.make_delta(path, previous.read_bytes()[:regions.HEADER_SIZE])
+        assert delta is not None
+        assert regions.delta_header(delta) == path.read_bytes()[:regions.HEADER_SIZE]
+
+        rebuilt = regions.apply_delta(rebuilt, delta)
+        assert read_chunks(rebuilt) == chunks
+        assert read_timestamps(rebuilt) == read_timestamps(path.read_bytes())
+        assert hashlib.sha256(rebuilt).hexdigest() == regions.packed_hash(path)
+
+
+def test_delta_only_holds_changed_chunks(tmp_path):
+    first, second = versions()[:2]
+    base = write_region(tmp_path / 'base.mca', first)
+    path = write_region(tmp_path / 'r.0.0.mca', second, seed=1)
+
+    delta = regions.make_delta(path, base.read_bytes()[:regions.HEADER_SIZE])
+    unchanged = regions.make_delta(path, path.read_bytes()[:regions.HEADER_SIZE])
+
+    changed = [index for index in second if second[index] != first.get(index)]
+    assert len(delta) == len(unchanged) + sum(6 + len(second[index][0]) for index in changed)
+    assert len(unchanged) == len(regions.DELTA_MAGIC) + regions.HEADER_SIZE
+
+
+def test_rebuilding_a_file_without_delta_keeps_it(tmp_path):
+    chunks = versions()[2]
+    path = write_region(tmp_path / 'r.0.0.mca', chunks)
+    header = path.read_bytes()[:regions.HEADER_SIZE]
+
+    rebuilt = regions.apply_delta(path.read_bytes(), regions.make_delta(path, header))
+    assert read_chunks(rebuilt) == chunks
+    # Packing is deterministic, so packing the rebuilt file again changes nothing
+    assert regions.apply_delta(rebuilt, regions.make_delta(path, header)) == rebuilt
+
+
+def test_file_that_is_not_a_region_file_is_stored_whole(tmp_path):
+    empty = tmp_path / 'empty.mca'
+    empty.write_bytes(b'')
+    short = tmp_path / 'short.mca'
+    short.write_bytes(b'\0' * 100)
+    assert regions.make_delta(empty, b'\0' * regions.HEADER_SIZE) is None
+    assert regions.make_delta(short, b'\0' * regions.HEADER_SIZE) is None
+
+    broken = write_region(tmp_path / 'broken.mca', {5: (chunk(5, 0), 1000)})
+    data = bytearray(broken.read_bytes())
+    data[5 * 4:5 * 4 + 4] = struct.pack('>I', (500 << 8) | 1)  # Points past the end of the file
+    broken.write_bytes(bytes(data))
+    assert regions.make_delta(broken, b'\0' * regions.HEADER_SIZE) is None
+
+
+def test_missing_base_chunk_is_an_error(tmp_path):
+    first, second = versions()[:2]
+    base = write_region(tmp_path / 'base.mca', first)
+    path = write_region(tmp_path / 'r.0.0.mca', second, seed=1)
+    delta = regions.make_delta(path, base.read_bytes()[:regions.HEADER_SIZE])
+
+    with pytest.raises(ValueError, match='missing from both'):
+        regions.apply_delta(None, delta)
+    with pytest.raises(ValueError, match='Not a region delta'):
+        regions.apply_delta(base.read_bytes(), b'MCA' + delta)
+
+
+def test_archive_chain_is_capped_and_checked(tmp_path):
+    world = tmp_path / 'world'
+    region_path = world / 'region' / 'r.0.0.mca'
+    region_path.parent.mkdir(parents=True)
+    chunks = {index: (chunk(index, 0), 1000) for index in range(0, 300, 2)}
+
+    archives = {}
+    manifests = {}
+    depths = []
+    for snapshot_id in range(1, archive.MAX_DELTA_DEPTH + 5):
+        if snapshot_id > 1:
+            chunks = dict(chunks)
+            for index in range(snapshot_id, 300, 25):
+                chunks[index] = (chunk(index, snapshot_id), 1000 + snapshot_id)
+        write_region(region_path, chunks, seed=snapshot_id)
+        os.utime(region_path, ns=(snapshot_id * 10 ** 9, snapshot_id * 10 ** 9))
+
+        entries = archive.scan_tree([world], tmp_path)
+        parent_id = snapshot_id - 1 if snapshot_id > 1 else None
+        changed = archive.split_changes(entries, manifests[parent_id]) if parent_id else entries
+        archives[snapshot_id] = tmp_path / f'{snapshot_id}.zip'
+        archive.write_archive(archives[snapshot_id], changed, archives if parent_id else None, parent_id)
+
+        for entry in entries:
+            entry.setdefault('source_id', snapshot_id)
+            entry.pop('base_version', None)
+            if entry.get('delta_base') is not None:
+                # Like snapshots.get_sources, the version of the parent the delta applies to
+                entry['base'] = next(base for base in manifests[entry['delta_base']] if base['path'] == entry['path'])
+        manifests[snapshot_id] = entries
+
+        region_entry = next(entry for entry in entries if entry['path'] == 'world/region/r.0.0.mca')
+        depths.append(region_entry.get('delta_depth') or 0)
+
+        destination = tmp_path / f'restore{snapshot_id}'
+        archive.extract_manifest(entries, archives, destination)
+        archive.check_extracted(entries, destination)
+        assert read_chunks((destination / region_entry['path']).read_bytes()) == chunks
+
+    assert depths == [*range(archive.MAX_DELTA_DEPTH + 1), 0, 1, 2]
+
+    # A rebuilt file that does not match the original is refused
+    region_entry['packed_hash'] = hashlib.sha256(b'something else').hexdigest()
+    with pytest.raises(ValueError, match='does not match its manifest'):
+        archive.extract_manifest(manifests[snapshot_id], archives, tmp_path / 'broken')
+
+
+def test_chunk_saved_within_the_same_second_is_not_lost(tmp_path):
+    world = tmp_path / 'world'
+    region_path = world / 'region' / 'r.0.0.mca'
+    region_path.parent.mkdir(parents=True)
+    first = {index: (chunk(index, 0), 1000) for index in range(0, 100, 2)}
+    # Saved again before the timestamp moved on, so the header looks the same for chunk 4
+    second = {**first, 4: (chunk(4, 1), 1000), 6: (chunk(6, 1), 2000)}
+
+    archives = {}
+    write_region(region_path, first)
+    entries = archive.scan_tree([world], tmp_path)
+    archives[1] = tmp_path / '1.zip'
+    archive.write_archive(archives[1], entries)
+    for entry in entries:
+        entry['source_id'] = 1
+
+    write_region(region_path, second, seed=1)
+    os.utime(region_path, ns=(2 * 10 ** 9, 2 * 10 ** 9))
+    manifest = archive.scan_tree([world], tmp_path)
+    changed = archive.split_changes(manifest, entries)
+    archives[2] = tmp_path / '2.zip'
+    archive.write_archive(archives[2], changed, archives, 1)
+
+    region_entry = next(entry for entry in manifest if entry['path'] == 'world/region/r.0.0.mca')
+    assert region_entry.get('delta_base') is None  # Stored whole instead of as a delta
+
+    for entry in manifest:
+        entry.setdefault('source_id', 2)
+    archive.extract_manifest(manifest, archives, tmp_path / 'restore')
+    assert read_chunks((tmp_path / 'restore' / region_entry['path']).read_bytes()) == second
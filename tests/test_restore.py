@@ -0,0 +1,88 @@
+"""
+test_restore.py
+
+Version: 1.3.0
+
+Tests how restore.py swaps a restored world in on a temporary server folder: the restored
+folders replace the live ones, and a rename failing midway puts the original world back.
+"""
+
+
+# Standard library imports
+from pathlib import Path
+
+# Third-party imports
+import pytest
+
+# First-party imports
+from bot_modules import restore
+
+
+FOLDERS = ['world', 'world_nether', 'world_the_end']
+
+
+@pytest.fixture(name='server_path')
+def server_path_fixture(tmp_path, monkeypatch):
+    """A server folder with a live world, and a restored world staged next to it."""
+    server_path = tmp_path / 'server'
+    monkeypatch.setattr(restore, 'root_path', server_path / 'bot')
+
+    for folder in FOLDERS:
+        for root, version in ((server_path, 'live'), (tmp_path / 'staging', 'restored')):
+            (root / folder / 'region').mkdir(parents=True)
+            (root / folder / 'level.dat').write_text(f'{version} {folder}', encoding='utf-8')
+            (root / folder / 'region' / 'r.0.0.mca').write_text(f'{version} region', encoding='utf-8')
+    (server_path / 'world' / 'region' / 'r.5.5.mca').write_text('generated after the snapshot', encoding='utf-8')
+    return server_path
+
+
+def read_tree(path):
+    return {file.relative_to(path).as_posix(): file.read_text(encoding='utf-8')
+            for file in path.rglob('*') if file.is_file()}
+
+
+def fail_rename(monkeypatch, failing_path):
+    """Makes renaming `failing_path` fail, like a file held open by another process on Windows."""
+    rename = Path.rename
+
+    def flaky_rename(self, target):
+        if self == failing_path:
+            raise PermissionError(f"{self} is in use")
+        return rename(self, target)
+
+    monkeypatch.setattr(Path, 'rename', flaky_rename)
+
+
+def test_swap_replaces_the_live_world(tmp_path, server_path):
+    staged = read_tree(tmp_path / 'staging')
+    live = read_tree(server_path)
+
+    restore._swap_paths(tmp_path / 'staging', tmp_path / 'replaced', FOLDERS)  # pylint: disable=protected-access
+    assert read_tree(server_path) == staged
+    assert read_tree(tmp_path / 'replaced') == live
+
+
+def test_swap_of_paths_missing_from_the_snapshot(tmp_path, server_path):
+    paths = ['world/region/r.0.0.mca', 'world/region/r.5.5.mca', 'world/region/r.9.9.mca']
+    restore._swap_paths(tmp_path / 'staging', tmp_path / 'replaced', paths)  # pylint: disable=protected-access
+
+    assert (server_path / 'world' / 'region' / 'r.0.0.mca').read_text(encoding='utf-8') == 'restored region'
+    # Did not exist when the snapshot was taken, so it is only moved out
+    assert not (server_path / 'world' / 'region' / 'r.5.5.mca').exists()
+    assert (tmp_path / 'replaced' / 'world' / 'region' / 'r.5.5.mca').exists()
+    assert not (server_path / 'world' / 'region' / 'r.9.9.mca').exists()
+
+
+@pytest.mark.parametrize('failing', ['staging/world_the_end', 'server/world_the_end', 'staging/world_nether'])
+def test_failed_swap_puts_the_world_back(tmp_path, server_path, monkeypatch, failing):
+    staged = read_tree(tmp_path / 'staging')
+    live = read_tree(server_path)
+    fail_rename(monkeypatch, tmp_path / failing)
+
+    with pytest.raises(PermissionError):
+        restore._swap_paths(tmp_path / 'staging', tmp_path / 'replaced', FOLDERS)  # pylint: disable=protected-access
+
+    assert read_tree(server_path) == live
+    # The restored world is still staged, nothing was lost in between
+    assert read_tree(tmp_path / 'staging') == staged
+    assert not read_tree(tmp_path / 'replaced')
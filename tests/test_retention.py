@@ -0,0 +1,130 @@
+"""
+test_retention.py
+
+Version: 1.3.0
+
+Tests the retention plan of retention.py: which snapshots the keep rules and caps keep,
+and that the newest snapshot, snapshots in use and the bases of kept incremental snapshots
+are never removed.
+"""
+
+
+# Standard library imports
+import datetime
+
+# Third-party imports
+import pytest
+
+# First-party imports
+from bot_modules import retention
+
+
+@pytest.fixture(name='rules')
+def rules_fixture(monkeypatch):
+    """Sets the retention rules, no keep rules and no caps unless given."""
+    def configure(keep_last=0, max_count=0, max_size=0, **keep):
+        monkeypatch.setattr(retention, 'KEEP_LAST', keep_last)
+        monkeypatch.setattr(retention, 'KEEP_RULES', {rule: (bucket_format, keep.get(rule, 0))
+                                                      for rule, (bucket_format, _) in retention.KEEP_RULES.items()})
+        monkeypatch.setattr(retention, 'MAX_COUNT', max_count)
+        monkeypatch.setattr(retention, 'MAX_SIZE', max_size)
+
+    configure()
+    return configure
+
+
+def snapshot_rows(count, hours=1, file_size=100):
+    """Snapshots taken every `hours` hours, the newest one last, with ids 1 to `count`."""
+    start = datetime.datetime(2024, 1, 1)
+    return [{'id': number, 'fancy_name': f'Snapshot {number}', 'file_size': file_size,
+             'date': (start + datetime.timedelta(hours=hours * number)).strftime('%Y-%m-%d %H:%M:%S')}
+            for number in range(1, count + 1)]
+
+
+def removed_ids(rows, dependencies=None, in_use=None):
+    keep, remove = retention.plan_retention(rows, dependencies or {}, in_use or {})
+    assert set(keep).isdisjoint(row['id'] for row in remove)
+    return [row['id'] for row in remove]
+
+
+@pytest.mark.usefixtures('rules')
+def test_no_rules_keeps_everything():
+    assert not removed_ids(snapshot_rows(10))
+    assert retention.plan_retention([], {}, {}) == ({}, [])
+
+
+def test_count_cap_drops_the_oldest_first(rules):
+    rules(max_count=3)
+    assert removed_ids(snapshot_rows(6)) == [3, 2, 1]
+
+
+def test_size_cap_drops_the_oldest_first(rules):
+    rules(max_size=250)
+    rows = snapshot_rows(5)
+    assert removed_ids(rows) == [3, 2, 1]
+
+    # Only the sizes of the snapshots kept count
+    rows[4]['file_size'] = 240
+    assert removed_ids(rows) == [4, 3, 2, 1]
+
+
+def test_newest_is_never_dropped(rules):
+    rules(max_count=1, max_size=1)
+    rows = snapshot_rows(4, file_size=1000)
+    keep, remove = retention.plan_retention(rows, {}, {})
+    assert list(keep) == [4]
+    assert 'newest' in keep[4]
+    assert [row['id'] for row in remove] == [3, 2, 1]
+
+    # Also when snapshots are given out of order
+    assert removed_ids(list(reversed(rows))) == [3, 2, 1]
+
+
+def test_keep_last(rules):
+    rules(keep_last=2)
+    assert removed_ids(snapshot_rows(5)) == [3, 2, 1]
+
+
+def test_keeps_the_newest_snapshot_per_bucket(rules):
+    # Four snapshots a day, from Jan 1st 06:00 to Jan 6th 00:00, the last one of a day at 18:00
+    rules(daily=3)
+    rows = snapshot_rows(20, hours=6)
+    keep, _ = retention.plan_retention(rows, {}, {})
+    assert sorted(keep) == [15, 19, 20]
+    assert keep[20] == ['newest', 'daily']
+
+    rules(daily=2, weekly=2)
+    keep, _ = retention.plan_retention(snapshot_rows(40, hours=12), {}, {})
+    # Up to Jan 21st 00:00, the second ISO week ends with the snapshot of Jan 14th 12:00
+    assert {snapshot_id for snapshot_id, reasons in keep.items() if 'weekly' in reasons} == {27, 40}
+
+
+def test_base_of_a_kept_snapshot_is_never_dropped(rules):
+    rules(max_count=2)
+    rows = snapshot_rows(6)
+    # 6 is based on 4, which in turn is based on 1
+    dependencies = {6: {4}, 4: {1}}
+    keep, remove = retention.plan_retention(rows, dependencies, {})
+    assert sorted(keep) == [1, 4, 6]
+    assert keep[4] == ['base of Snapshot 6']
+    assert keep[1] == ['base of Snapshot 4']
+    assert [row['id'] for row in remove] == [5, 3, 2]
+
+    rules(daily=1)
+    assert removed_ids(rows, dependencies) == [5, 3, 2]
+
+
+def test_snapshot_in_use_is_never_dropped(rules):
+    rules(max_count=1)
+    rows = snapshot_rows(5)
+    keep, remove = retention.plan_retention(rows, {3: {2}}, {3: 1, 1: 0})
+    assert sorted(keep) == [2, 3, 5]
+    assert keep[3] == ['in use']
+    assert [row['id'] for row in remove] == [4, 1]
+
+
+def test_snapshot_with_unknown_date_is_kept(rules):
+    rules(keep_last=1)
+    rows = snapshot_rows(3)
+    rows[0]['date'] = None
+    assert removed_ids(rows) == [2]
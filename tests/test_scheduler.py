@@ -0,0 +1,108 @@
+"""
+test_scheduler.py
+
+Version: 1.3.0
+
+Tests the cron expressions of scheduler.py: parsing ranges, steps, lists and aliases,
+refusing expressions it cannot understand, and finding the next time one matches,
+including how the day and weekday fields combine.
+"""
+
+
+# Standard library imports
+import datetime
+
+# Third-party imports
+import pytest
+
+# First-party imports
+from bot_modules import scheduler
+
+
+def at(text):
+    return datetime.datetime.strptime(text, '%Y-%m-%d %H:%M')
+
+
+def runs(expression, after, count=3):
+    """The next `count` times an expression matches after `after`, as text."""
+    moments = []
+    moment = at(after)
+    for _ in range(count):
+        moment = scheduler.next_run(expression, moment)
+        moments.append(moment.strftime('%Y-%m-%d %H:%M'))
+    return moments
+
+
+def test_parse_ranges_steps_and_lists():
+    minutes, hours, days, months, weekdays, days_restricted, weekdays_restricted = \
+        scheduler.parse_cron('*/15 9-17 1,15,28-31 */3 1-5')
+    assert minutes == {0, 15, 30, 45}
+    assert hours == set(range(9, 18))
+    assert days == {1, 15, 28, 29, 30, 31}
+    assert months == {1, 4, 7, 10}
+    assert weekdays == {1, 2, 3, 4, 5}
+    assert days_restricted and weekdays_restricted
+
+    minutes, hours, *_ = scheduler.parse_cron('5/20 0-12/6 * * *')
+    assert minutes == {5, 25, 45}
+    assert hours == {0, 6, 12}
+
+
+def test_parse_aliases_and_sunday():
+    assert scheduler.parse_cron('@nightly') == scheduler.parse_cron('0 3 * * *')
+    assert scheduler.parse_cron(' @Hourly ') == scheduler.parse_cron('0 * * * *')
+    # Sunday can be written as 0 or 7
+    assert scheduler.parse_cron('0 0 * * 7')[4] == {0}
+    assert scheduler.parse_cron('0 0 * * 5-7')[4] == {0, 5, 6}
+
+    *_, days_restricted, weekdays_restricted = scheduler.parse_cron('@weekly')
+    assert not days_restricted and weekdays_restricted
+
+
+@pytest.mark.parametrize('expression', [
+    '', '* * * *', '* * * * * *', '@sometimes',   # Wrong number of fields
+    '60 * * * *', '* 24 * * *', '* * 0 * *', '* * * 13 *', '* * * * 8',  # Out of range
+    '5-1 * * * *', '*/0 * * * *', '*/-1 * * * *',  # Backwards range, zero or negative step
+    'a * * * *', '1- * * * *', '1,,2 * * * *', '*/x * * * *', '1.5 * * * *',  # Not numbers
+])
+def test_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        scheduler.parse_cron(expression)
+
+
+def test_next_run_is_strictly_after():
+    assert runs('*/15 * * * *', '2024-01-01 10:00') == ['2024-01-01 10:15', '2024-01-01 10:30', '2024-01-01 10:45']
+    # Seconds are ignored, but the minute itself is never the next run
+    assert scheduler.next_run('* * * * *', at('2024-01-01 10:00').replace(second=59)) == at('2024-01-01 10:01')
+
+
+def test_next_run_rolls_over_hours_days_months_and_years():
+    assert runs('30 9-10 * * *', '2024-01-31 10:45') == ['2024-02-01 09:30', '2024-02-01 10:30', '2024-02-02 09:30']
+    assert runs('@monthly', '2024-11-15 12:00') == ['2024-12-01 00:00', '2025-01-01 00:00', '2025-02-01 00:00']
+    # Months without a 31st are skipped
+    assert runs('0 0 31 * *', '2024-01-31 00:00', 2) == ['2024-03-31 00:00', '2024-05-31 00:00']
+    # Only leap years have a 29th of February
+    assert runs('0 12 29 2 *', '2024-03-01 00:00', 1) == ['2028-02-29 12:00']
+
+
+def test_next_run_weekdays():
+    # January 1st 2024 is a Monday
+    assert runs('0 18 * * 1-5', '2024-01-05 19:00') == ['2024-01-08 18:00', '2024-01-09 18:00', '2024-01-10 18:00']
+    assert runs('@weekly', '2024-01-01 00:00', 2) == ['2024-01-07 00:00', '2024-01-14 00:00']
+    assert runs('0 0 * * 7', '2024-01-01 00:00', 1) == runs('0 0 * * 0', '2024-01-01 00:00', 1)
+
+
+def test_next_run_day_or_weekday():
+    # Like cron, when both the day and the weekday are restricted either one matching is enough:
+    # the 13th of every month and every Friday
+    assert runs('0 0 13 * 5', '2024-01-01 00:00', 4) == [
+        '2024-01-05 00:00', '2024-01-12 00:00', '2024-01-13 00:00', '2024-01-19 00:00']
+
+    # Otherwise only the restricted one counts: the 1st to the 7th whatever the weekday, or Mondays in February
+    assert runs('0 0 1-7 * *', '2024-01-06 00:00', 2) == ['2024-01-07 00:00', '2024-02-01 00:00']
+    assert runs('0 0 * 2 1', '2024-01-01 00:00', 2) == ['2024-02-05 00:00', '2024-02-12 00:00']
+
+
+def test_expression_that_never_matches():
+    with pytest.raises(ValueError, match='never matches'):
+        scheduler.next_run('0 0 30 2 *', at('2024-01-01 00:00'))
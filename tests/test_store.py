@@ -0,0 +1,148 @@
+"""
+test_store.py
+
+Version: 1.3.0
+
+Tests the deduplicated object store of store.py on a temporary folder: storing a world
+and rebuilding it, checking it, sharing chunks between files and snapshots, and collecting
+garbage without touching the objects a manifest still refers to.
+"""
+
+
+# Standard library imports
+import copy
+import os
+import random
+import zipfile
+
+# Third-party imports
+import pytest
+
+# First-party imports
+from bot_modules import archive, store
+
+
+CHUNK_SIZE = 4096
+
+
+@pytest.fixture(name='objects_path')
+def objects_path_fixture(tmp_path, monkeypatch):
+    objects_path = tmp_path / 'objects'
+    monkeypatch.setattr(store, 'objects_path', objects_path)
+    return objects_path
+
+
+def make_world(path, seed=0):
+    """Writes a small world, with files of several chunks, a file repeated in full and an empty folder."""
+    rng = random.Random(seed)
+    (path / 'world' / 'region').mkdir(parents=True)
+    (path / 'world' / 'data').mkdir()
+    (path / 'world' / 'empty').mkdir()
+    shared = rng.randbytes(3 * CHUNK_SIZE)
+    files = {
+        'world/level.dat': rng.randbytes(100),
+        'world/region/r.0.0.mca': rng.randbytes(5 * CHUNK_SIZE + 17),
+        'world/region/r.0.1.mca': shared,
+        'world/region/r.1.1.mca': shared,
+        'world/data/raids.dat': b'raids ' * 2000,  # Compresses well
+        'world/data/nothing.dat': b'',
+    }
+    for name, data in files.items():
+        (path / name).write_bytes(data)
+    return files
+
+
+def snapshot(path):
+    entries = archive.scan_tree([path / 'world'], path)
+    store.store_tree(entries, CHUNK_SIZE)
+    return entries
+
+
+def read_tree(path):
+    return {file.relative_to(path).as_posix(): (file.read_bytes(), file.stat().st_mtime_ns)
+            for file in (path / 'world').rglob('*') if file.is_file()}
+
+
+def referenced(*manifests):
+    return {chunk_hash for entries in manifests for entry in entries for chunk_hash in entry['chunks']}
+
+
+def test_round_trip(tmp_path, objects_path):
+    files = make_world(tmp_path / 'server')
+    entries = snapshot(tmp_path / 'server')
+
+    store.restore_tree(entries, tmp_path / 'restored')
+    assert read_tree(tmp_path / 'restored') == read_tree(tmp_path / 'server')
+    assert (tmp_path / 'restored' / 'world' / 'empty').is_dir()
+
+    # Identical chunks are stored once
+    object_count = sum(1 for stored_object in objects_path.rglob('*') if stored_object.is_file())
+    assert object_count == len(referenced(entries)) < sum(len(entry['chunks']) for entry in entries)
+    assert store.verify_tree(entries) == (object_count, sum(
+        stored_object.stat().st_size for stored_object in objects_path.rglob('*') if stored_object.is_file()))
+
+    store.export_zip(entries, tmp_path / 'export.zip')
+    with zipfile.ZipFile(tmp_path / 'export.zip') as export:
+        assert export.testzip() is None
+        assert {name: export.read(name) for name in files} == files
+        assert 'world/empty/' in export.namelist()
+
+
+def test_unchanged_chunks_are_not_stored_again(tmp_path, objects_path):
+    make_world(tmp_path / 'server')
+    first = snapshot(tmp_path / 'server')
+    size_before = sum(stored_object.stat().st_size for stored_object in objects_path.rglob('*'))
+
+    region = tmp_path / 'server' / 'world' / 'region' / 'r.0.0.mca'
+    data = bytearray(region.read_bytes())
+    data[CHUNK_SIZE:CHUNK_SIZE + 4] = b'edit'  # Only the second chunk changes
+    region.write_bytes(bytes(data))
+
+    entries = archive.scan_tree([tmp_path / 'server' / 'world'], tmp_path / 'server')
+    stats = store.store_tree(entries, CHUNK_SIZE)
+    assert sum(rule_stats['bytes_out'] for rule_stats in stats.values()) <= CHUNK_SIZE + 1
+    assert sum(stored_object.stat().st_size for stored_object in objects_path.rglob('*')) > size_before
+    assert len(referenced(entries) - referenced(first)) == 1
+
+
+def test_garbage_collection_keeps_referenced_objects(tmp_path, objects_path):
+    make_world(tmp_path / 'server')
+    first = snapshot(tmp_path / 'server')
+    (tmp_path / 'server' / 'world' / 'level.dat').write_bytes(b'changed level')
+    os.remove(tmp_path / 'server' / 'world' / 'region' / 'r.0.0.mca')
+    second = snapshot(tmp_path / 'server')
+
+    only_first = referenced(first) - referenced(second)
+    assert store.collect_garbage(referenced(first, second)) == (0, 0)
+
+    # The first snapshot is deleted, only its own objects go
+    removed, freed = store.collect_garbage(referenced(second))
+    assert removed == len(only_first) and freed > 0
+    assert {stored_object.name for stored_object in objects_path.rglob('*') if stored_object.is_file()} == \
+        referenced(second)
+    assert store.verify_tree(second)[0] == len(referenced(second))
+    store.restore_tree(second, tmp_path / 'restored')
+    assert read_tree(tmp_path / 'restored') == read_tree(tmp_path / 'server')
+
+    with pytest.raises(ValueError, match=f'{len(only_first)} objects are damaged or missing'):
+        store.verify_tree(first)
+
+
+def test_damaged_object_is_refused(tmp_path, objects_path):
+    make_world(tmp_path / 'server')
+    entries = snapshot(tmp_path / 'server')
+    level = next(entry for entry in entries if entry['path'] == 'world/level.dat')
+    object_path = objects_path / level['chunks'][0][:2] / level['chunks'][0]
+    object_path.write_bytes(b'N' + b'x' * 100)
+
+    with pytest.raises(ValueError, match='damaged or missing'):
+        store.verify_tree(entries)
+    with pytest.raises(ValueError, match='is corrupted'):
+        store.restore_tree(entries, tmp_path / 'restored')
+
+    # A manifest that does not match the stored file is refused too
+    entries = copy.deepcopy(entries)
+    region = next(entry for entry in entries if entry['path'] == 'world/region/r.0.0.mca')
+    region['chunks'] = region['chunks'][:-1]
+    with pytest.raises(ValueError, match='does not match its manifest'):
+        store.restore_tree([region], tmp_path / 'restored')